@@ -73,6 +73,21 @@ ACTIONS = {
         "stats": {
             "msg": "Display the daemon stats.",
         },
+        "profile_start": {
+            "msg": "Start sampling the stack of the daemon thread pointed by :opt:`--thread-id`. The profile is reported in the :cmd:`om daemon stats` output.",
+            "options": [
+                OPT.thr_id,
+            ],
+        },
+        "profile_stop": {
+            "msg": "Stop sampling the stack of the daemon thread pointed by :opt:`--thread-id`.",
+            "options": [
+                OPT.thr_id,
+            ],
+        },
+        "crypto_bench": {
+            "msg": "Measure the encrypt and decrypt throughput of the AES backends available on this node, for heartbeat and api message sizes. The daemon uses the first backend listed, unless the OSVC_AES_BACKEND environment variable names another one.",
+        },
         "start": {
             "msg": "Start the daemon or a daemon thread pointed by :opt:`--thread-id`.",
             "options": [
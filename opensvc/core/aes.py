@@ -0,0 +1,255 @@
+"""
+The AES-CBC backends used to encrypt and decrypt the daemon communications.
+
+The backends are registered in preference order: the accelerated
+implementations first, the pure python foreign.pyaes implementation last.
+The first backend available on the host is selected, unless the
+OSVC_AES_BACKEND environment variable names another available backend.
+
+All backends produce the same PKCS7-padded AES-CBC ciphertext, so nodes
+using different backends communicate.
+"""
+import os
+import threading
+import time
+
+import foreign.six as six
+import foreign.pyaes as pyaes
+
+BACKENDS = []
+
+# the maximum number of key schedules cached by the pyaes backend
+MAX_KEYS = 32
+
+
+def register(backend_class, first=False):
+    """
+    Register <backend_class> in the backends list, with the highest
+    preference if <first> is True, else with the lowest.
+    """
+    if first:
+        BACKENDS.insert(0, backend_class)
+    else:
+        BACKENDS.append(backend_class)
+    return backend_class
+
+
+def to_key(key):
+    if isinstance(key, six.text_type):
+        return key.encode("utf-8")
+    return key
+
+
+class Backend(object):
+    """
+    The base backend class.
+    """
+    name = None
+
+    @classmethod
+    def available(cls):
+        return False
+
+    @classmethod
+    def version(cls):
+        return ""
+
+    @classmethod
+    def description(cls):
+        version = cls.version()
+        if version:
+            return "%s %s" % (cls.name, version)
+        return cls.name
+
+    def encrypt(self, message, key, iv):
+        """
+        Return the AES-CBC ciphertext of the PKCS7-padded <message>.
+        """
+        raise NotImplementedError
+
+    def decrypt(self, ciphertext, key, iv):
+        """
+        Return the PKCS7-unpadded plaintext of the AES-CBC <ciphertext>.
+        """
+        raise NotImplementedError
+
+
+@register
+class CryptographyBackend(Backend):
+    """
+    The pyca/cryptography OpenSSL bindings.
+    """
+    name = "cryptography"
+
+    @classmethod
+    def available(cls):
+        try:
+            from cryptography.hazmat.primitives.ciphers import Cipher
+            return True
+        except ImportError:
+            return False
+
+    @classmethod
+    def version(cls):
+        import cryptography
+        return cryptography.__version__
+
+    def cipher(self, key, iv):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        return Cipher(algorithms.AES(to_key(key)), modes.CBC(iv), backend=default_backend())
+
+    def encrypt(self, message, key, iv):
+        encryptor = self.cipher(key, iv).encryptor()
+        return encryptor.update(pyaes.util.append_PKCS7_padding(message)) + encryptor.finalize()
+
+    def decrypt(self, ciphertext, key, iv):
+        decryptor = self.cipher(key, iv).decryptor()
+        message = decryptor.update(ciphertext) + decryptor.finalize()
+        return pyaes.util.strip_PKCS7_padding(message)
+
+
+@register
+class PycryptoBackend(Backend):
+    """
+    The pycryptodome or pycrypto Crypto.Cipher module.
+    """
+    name = "pycrypto"
+
+    @classmethod
+    def available(cls):
+        try:
+            from Crypto.Cipher import AES
+            return True
+        except ImportError:
+            return False
+
+    @classmethod
+    def version(cls):
+        from Crypto import __version__ as version
+        return version
+
+    def encrypt(self, message, key, iv):
+        from Crypto.Cipher import AES
+        obj = AES.new(to_key(key), AES.MODE_CBC, iv)
+        return obj.encrypt(pyaes.util.append_PKCS7_padding(message))
+
+    def decrypt(self, ciphertext, key, iv):
+        from Crypto.Cipher import AES
+        obj = AES.new(to_key(key), AES.MODE_CBC, iv)
+        return pyaes.util.strip_PKCS7_padding(obj.decrypt(ciphertext))
+
+
+@register
+class PyaesBackend(Backend):
+    """
+    The pure python foreign.pyaes implementation. The key expansion is
+    cached, and the CBC chaining is done on bytearrays instead of through
+    the pyaes block feeders.
+    """
+    name = "pyaes"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.schedules = {}
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def schedule(self, key):
+        key = to_key(key)
+        try:
+            return self.schedules[key]
+        except KeyError:
+            pass
+        schedule = self.make_schedule(key)
+        with self.lock:
+            if len(self.schedules) >= MAX_KEYS:
+                self.schedules.clear()
+            self.schedules[key] = schedule
+        return schedule
+
+    def make_schedule(self, key):
+        return pyaes.AES(key)
+
+    def encrypt(self, message, key, iv):
+        aes = self.schedule(key)
+        message = bytearray(pyaes.util.append_PKCS7_padding(message))
+        ciphertext = bytearray(len(message))
+        last = bytearray(iv)
+        for offset in range(0, len(message), 16):
+            block = [b ^ l for b, l in zip(message[offset:offset+16], last)]
+            last = bytearray(aes.encrypt(block))
+            ciphertext[offset:offset+16] = last
+        return bytes(ciphertext)
+
+    def decrypt(self, ciphertext, key, iv):
+        if len(ciphertext) % 16 != 0:
+            raise ValueError("invalid ciphertext length")
+        aes = self.schedule(key)
+        ciphertext = bytearray(ciphertext)
+        message = bytearray(len(ciphertext))
+        last = bytearray(iv)
+        for offset in range(0, len(ciphertext), 16):
+            block = ciphertext[offset:offset+16]
+            message[offset:offset+16] = bytearray(b ^ l for b, l in zip(aes.decrypt(block), last))
+            last = block
+        return pyaes.util.strip_PKCS7_padding(bytes(message))
+
+
+def available_backends():
+    return [backend_class for backend_class in BACKENDS if backend_class.available()]
+
+
+def get_backend(name=None):
+    """
+    Return an instance of the <name> backend, or of the preferred backend
+    available if <name> is not set or not available.
+    """
+    backends = available_backends()
+    for backend_class in backends:
+        if name == backend_class.name:
+            return backend_class()
+    return backends[0]()
+
+
+BACKEND = get_backend(os.environ.get("OSVC_AES_BACKEND"))
+
+
+def benchmark(sizes=(256, 4096, 65536, 1048576), duration=0.2):
+    """
+    Return the encrypt and decrypt throughput of the available backends,
+    in MB/s, for messages of <sizes> bytes, each case being measured for
+    <duration> seconds.
+    """
+    key = os.urandom(32)
+    iv = os.urandom(16)
+    data = []
+    for backend_class in available_backends():
+        backend = backend_class()
+        for size in sizes:
+            message = os.urandom(size)
+            ciphertext = backend.encrypt(message, key, iv)
+            data.append({
+                "backend": backend.description(),
+                "size": size,
+                "encrypt": measure(backend.encrypt, (message, key, iv), size, duration),
+                "decrypt": measure(backend.decrypt, (ciphertext, key, iv), size, duration),
+            })
+    return data
+
+
+def measure(fn, args, size, duration):
+    """
+    Return the throughput of fn(*args) in MB/s, for a <size> bytes message.
+    """
+    count = 0
+    begin = time.time()
+    while True:
+        fn(*args)
+        count += 1
+        elapsed = time.time() - begin
+        if elapsed >= duration:
+            break
+    return round(count * size / elapsed / 1024 / 1024, 2)
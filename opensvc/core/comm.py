@@ -7,6 +7,7 @@ import base64
 import json
 import os
 import socket
+import struct
 import threading
 import zlib
 import time
@@ -37,7 +38,7 @@ except Exception:
     has_ssl = False
 
 import foreign.six as six
-import foreign.pyaes as pyaes
+from core.aes import BACKEND
 from env import Env
 from utilities.storage import Storage
 from utilities.lazy import lazy
@@ -66,6 +67,12 @@ SOCK_TMO_STREAM = 6.2
 PAUSE = 0.2
 PING = ".".encode()
 
+# The h2 client connections pool settings: the delay after which an idle
+# connection is closed, and the maximum number of idle connections kept
+# per daemon.
+H2_POOL_IDLE_TIMEOUT = 60
+H2_POOL_MAX_IDLE = 4
+
 # Number of received misencrypted data messages by senders
 BLACKLIST = {}
 BLACKLIST_LOCK = threading.RLock()
@@ -74,6 +81,42 @@ BLACKLIST_LOCK = threading.RLock()
 # new messages
 BLACKLIST_THRESHOLD = 5
 
+# The binary encrypted message envelope, used by the heartbeats when all
+# peers support it:
+#   magic, version, flags, clustername length, nodename length,
+#   created timestamp, ciphertext length, iv,
+# followed by the clustername, the nodename and the raw ciphertext.
+BINARY_MAGIC = b"\x93OSV"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct(">4sBBHHdI16s")
+
+
+def is_binary_message(message):
+    """
+    Return True if <message> starts with the binary envelope magic.
+    """
+    return isinstance(message, (bytes, bytearray, memoryview)) and \
+           bytes(message[:len(BINARY_MAGIC)]) == BINARY_MAGIC
+
+
+def binary_message_len(buff):
+    """
+    Return the total length of the binary envelope at the head of <buff>,
+    or None if <buff> does not contain the full envelope header yet.
+    """
+    if len(buff) < BINARY_HEADER.size:
+        return
+    _, _, _, clen, nlen, _, dlen, _ = BINARY_HEADER.unpack_from(buff)
+    return BINARY_HEADER.size + clen + nlen + dlen
+
+
+def binary_message_created(buff):
+    """
+    Return the creation timestamp of the binary envelope <buff>.
+    """
+    return BINARY_HEADER.unpack_from(buff)[5]
+
+
 class Headers(object):
     node = "o-node"
     secret = "o-secret"
@@ -83,53 +126,22 @@ class SockReset(Exception):
     pass
 
 
-try:
-    from Crypto.Cipher import AES
-    from Crypto import __version__ as version
-    CRYPTO_MODULE = "pycrypto %s" % version
+CRYPTO_MODULE = BACKEND.description()
 
-    def _encrypt(message, key, _iv):
-        """
-        Low level encrypter.
-        """
-        message = pyaes.util.append_PKCS7_padding(
-            zlib.compress(message)
-        )
-        obj = AES.new(key, AES.MODE_CBC, _iv)
-        ciphertext = obj.encrypt(message)
-        return ciphertext
 
-    def _decrypt(ciphertext, key, _iv):
-        """
-        Low level decrypter.
-        """
-        obj = AES.new(key, AES.MODE_CBC, _iv)
-        message = obj.decrypt(ciphertext)
-        return zlib.decompress(pyaes.util.strip_PKCS7_padding(message))
-except ImportError:
-    CRYPTO_MODULE = "fallback"
+def _encrypt(message, key, _iv):
+    """
+    Low level encrypter.
+    """
+    return BACKEND.encrypt(zlib.compress(message), key, _iv)
 
-    def _encrypt(message, key, _iv):
-        """
-        Low level encrypter.
-        """
-        obj = pyaes.Encrypter(
-            pyaes.AESModeOfOperationCBC(to_bytes(key), iv=_iv)
-        )
-        ciphertext = obj.feed(zlib.compress(message))
-        ciphertext += obj.feed()
-        return ciphertext
 
-    def _decrypt(ciphertext, key, _iv):
-        """
-        Low level decrypter.
-        """
-        obj = pyaes.Decrypter(
-           pyaes.AESModeOfOperationCBC(to_bytes(key), iv=_iv)
-        )
-        message = obj.feed(ciphertext)
-        message += obj.feed()
-        return zlib.decompress(message)
+def _decrypt(ciphertext, key, _iv):
+    """
+    Low level decrypter.
+    """
+    return zlib.decompress(BACKEND.decrypt(ciphertext, key, _iv))
+
 
 def get_http2_client_ssl_context(cafile=None, keyfile=None, certfile=None):
     """
@@ -172,6 +184,159 @@ def get_http2_client_ssl_context(cafile=None, keyfile=None, certfile=None):
 
     return ctx
 
+
+class H2Pool(object):
+    """
+    A process-wide pool of idle h2 client connections, so the consecutive
+    requests to a daemon reuse the same socket, tls session and h2
+    connection.
+
+    The connections are keyed by the daemon address, the scheme and the
+    tls credentials. A connection serves one request at a time. It is
+    closed when idle for more than <idle_timeout> seconds, and dropped
+    when found closed by the peer on checkout. The connections inherited
+    by a forked process are dropped without use.
+    """
+    def __init__(self, idle_timeout=H2_POOL_IDLE_TIMEOUT, max_idle=H2_POOL_MAX_IDLE):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.stats = {"created": 0, "reused": 0, "discarded": 0}
+
+    def check_pid(self):
+        """
+        In a forked process, forget the idle connections inherited from the
+        parent. They are not closed, as their sockets and tls and h2 states
+        are shared with the parent. The lock is replaced too, as it may have
+        been held by a parent thread at fork time.
+        """
+        pid = os.getpid()
+        if pid == self.pid:
+            return
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.pid = pid
+
+    def get(self, key, factory):
+        """
+        Return a (<conn>, <reused>) tuple, <conn> being a healthy idle
+        connection of <key>, or a new connection returned by <factory>.
+        """
+        self.check_pid()
+        while True:
+            with self.lock:
+                expired = self.expire(time.time())
+                try:
+                    conn = self.idle[key].pop()[0]
+                except (KeyError, IndexError):
+                    conn = None
+            self.close(expired)
+            if conn is None:
+                break
+            if self.healthy(conn):
+                with self.lock:
+                    self.stats["reused"] += 1
+                return conn, True
+            self.discard(conn)
+        with self.lock:
+            self.stats["created"] += 1
+        return factory(), False
+
+    def put(self, key, conn):
+        """
+        Return <conn> to the idle connections of <key>, once its response
+        is read.
+        """
+        if getattr(conn, "_sock", None) is None:
+            return
+        if not self.reusable(conn):
+            self.discard(conn)
+            return
+        self.check_pid()
+        now = time.time()
+        with self.lock:
+            expired = self.expire(now)
+            conns = self.idle.setdefault(key, [])
+            conns.append((conn, now))
+            while len(conns) > self.max_idle:
+                expired.append(conns.pop(0)[0])
+        self.close(expired)
+
+    def discard(self, conn):
+        """
+        Close a connection not suitable for reuse.
+        """
+        with self.lock:
+            self.stats["discarded"] += 1
+        self.close([conn])
+
+    def expire(self, now):
+        """
+        Remove the connections idle for more than <idle_timeout> from the
+        pool, and return them. Called with the lock held.
+        """
+        expired = []
+        for key in list(self.idle):
+            conns = self.idle[key]
+            while conns and now - conns[0][1] > self.idle_timeout:
+                expired.append(conns.pop(0)[0])
+            if not conns:
+                del self.idle[key]
+        return expired
+
+    def clear(self):
+        with self.lock:
+            conns = [conn for conns in self.idle.values() for conn, _ in conns]
+            self.idle = {}
+        self.close(conns)
+
+    @staticmethod
+    def close(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def reusable(conn):
+        """
+        Return True if <conn> exposes the hyper connection internals used
+        to check its health and reuse it. If a hyper upgrade removes them,
+        the requests fall back to a new connection each.
+        """
+        sock = getattr(conn, "_sock", None)
+        if sock is None or not hasattr(conn, "_single_read"):
+            return False
+        return hasattr(sock, "can_read") and hasattr(sock, "settimeout")
+
+    @staticmethod
+    def healthy(conn):
+        """
+        Process the frames received while idle, like settings, pings or
+        goaway, and return False if the peer closed the connection.
+        """
+        if not H2Pool.reusable(conn):
+            return False
+        try:
+            while conn._sock is not None and conn._sock.can_read:
+                conn._single_read()
+        except Exception:
+            return False
+        return conn._sock is not None
+
+    def status(self):
+        with self.lock:
+            data = dict(self.stats)
+            data["idle"] = sum(len(conns) for conns in self.idle.values())
+        return data
+
+
+H2_POOL = H2Pool()
+
+
 class Crypt(object):
     """
     A class implement AES encrypt, decrypt and message padding.
@@ -351,17 +516,11 @@ class Crypt(object):
             cluster_names = self.cluster_names
         else:
             cluster_names = [cluster_name]
-        message = bdecode(message).rstrip("\0\x00")
-        try:
-            message = json.loads(message)
-        except ValueError:
-            message_len = len(message)
-            if message_len > 40:
-                self.log.error("misformatted encrypted message from %s: %s",
-                               sender_id, message[:30]+"..."+message[-10:])
-            elif message_len > 0:
-                self.log.error("misformatted encrypted message from %s",
-                               sender_id)
+        if is_binary_message(message):
+            message = self.binary_msg_decode(message, sender_id=sender_id)
+        else:
+            message = self.legacy_msg_decode(message, sender_id=sender_id)
+        if message is None:
             return None, None, None
         msg_clustername = message.get("clustername")
         msg_nodename = message.get("nodename")
@@ -386,8 +545,10 @@ class Crypt(object):
             return None, None, None
         if self.blacklisted(sender_id):
             return None, None, None
-        iv = base64.urlsafe_b64decode(to_bytes(iv))
-        data = base64.urlsafe_b64decode(to_bytes(message["data"]))
+        data = message["data"]
+        if not message.get("binary"):
+            iv = base64.urlsafe_b64decode(to_bytes(iv))
+            data = base64.urlsafe_b64decode(to_bytes(data))
         try:
             data = self._decrypt(data, cluster_key, iv)
         except Exception as exc:
@@ -409,9 +570,67 @@ class Crypt(object):
         except ValueError as exc:
             return msg_clustername, msg_nodename, data
 
-    def encrypt(self, data, cluster_name=None, secret=None, encode=True):
+    def legacy_msg_decode(self, message, sender_id=None):
+        """
+        Return the json encrypted message wrapping structure as a dict.
+        """
+        message = bdecode(message).rstrip("\0\x00")
+        try:
+            return json.loads(message)
+        except ValueError:
+            message_len = len(message)
+            if message_len > 40:
+                self.log.error("misformatted encrypted message from %s: %s",
+                               sender_id, message[:30]+"..."+message[-10:])
+            elif message_len > 0:
+                self.log.error("misformatted encrypted message from %s",
+                               sender_id)
+            return
+
+    def binary_msg_decode(self, message, sender_id=None):
+        """
+        Return the binary envelope fields as a dict, with the raw iv and
+        ciphertext.
+        """
+        try:
+            _, version, _, clen, nlen, created, dlen, iv = BINARY_HEADER.unpack_from(message)
+        except struct.error:
+            self.log.error("truncated encrypted message header from %s", sender_id)
+            return
+        if version != BINARY_VERSION:
+            self.log.error("unsupported encrypted message version %d from %s",
+                           version, sender_id)
+            return
+        offset = BINARY_HEADER.size
+        if len(message) < offset + clen + nlen + dlen:
+            self.log.error("truncated encrypted message from %s", sender_id)
+            return
+        message = memoryview(message)
+        return {
+            "clustername": bdecode(bytes(message[offset:offset+clen])),
+            "nodename": bdecode(bytes(message[offset+clen:offset+clen+nlen])),
+            "created": created,
+            "iv": iv,
+            "data": bytes(message[offset+clen+nlen:offset+clen+nlen+dlen]),
+            "binary": True,
+        }
+
+    @staticmethod
+    def binary_msg_encode(cluster_name, iv, ciphertext):
+        cluster_name = cluster_name.encode("utf-8")
+        nodename = Env.nodename.encode("utf-8")
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0,
+                                    len(cluster_name), len(nodename),
+                                    time.time(), len(ciphertext), iv)
+        return b"".join([header, cluster_name, nodename, ciphertext])
+
+    def encrypt(self, data, cluster_name=None, secret=None, encode=True,
+                binary=False):
         """
         Encrypt and return data in a wrapping structure.
+
+        If <binary> is True, return the bytes of a binary envelope instead
+        of the json wrapping structure.
         """
         if cluster_name is None:
             cluster_name = self.cluster_name
@@ -427,6 +646,9 @@ class Crypt(object):
         except (UnicodeDecodeError, TypeError):
             # already binary data
             pass
+        if binary:
+            return self.binary_msg_encode(cluster_name, iv,
+                                          self._encrypt(data, cluster_key, iv))
         message = {
             "clustername": cluster_name,
             "nodename": Env.nodename,
@@ -702,9 +924,8 @@ class Crypt(object):
             # relay, arbitrator, node-to-node
             return self.socket_parms_inet_raw(server)
 
-    def get_http2_client_context(self, sp):
-        if not sp.tls:
-            return
+    @staticmethod
+    def get_http2_client_credentials(sp):
         try:
             cafile = sp.context["cluster"]["certificate_authority"]
         except:
@@ -715,6 +936,12 @@ class Crypt(object):
         except:
             keyfile = None
             certfile = None
+        return cafile, keyfile, certfile
+
+    def get_http2_client_context(self, sp):
+        if not sp.tls:
+            return
+        cafile, keyfile, certfile = self.get_http2_client_credentials(sp)
         return get_http2_client_ssl_context(
             cafile=cafile,
             keyfile=keyfile,
@@ -732,6 +959,13 @@ class Crypt(object):
         conn = hyper.HTTP20Connection(host, port=port, ssl_context=context, secure=sp.tls, **kwargs)
         return conn
 
+    def h2_pool_key(self, sp):
+        if sp.tls:
+            credentials = self.get_http2_client_credentials(sp)
+        else:
+            credentials = None
+        return sp.to, sp.scheme, sp.tls, credentials
+
     def daemon_get(self, *args, **kwargs):
         kwargs["method"] = "GET"
         return self.daemon_request(*args, **kwargs)
@@ -783,17 +1017,28 @@ class Crypt(object):
         headers = self.h2_headers(node=node, secret=secret, multiplexed=data.get("multiplexed"), af=sp.af)
         body = self.h2_body_from_data(data)
         headers.update({"Content-Length": str(len(body))})
-        conn = self.h2c(sp=sp, timeout=timeout)
+        key = self.h2_pool_key(sp)
         elapsed = 0
         while True:
+            conn, reused = H2_POOL.get(key, lambda: self.h2c(sp=sp, timeout=timeout))
+            if reused:
+                conn._sock.settimeout(timeout)
             try:
-                conn.request(method, path, headers=headers, body=body)
+                stream_id = conn.request(method, path, headers=headers, body=body)
                 break
             except AssertionError as exc:
+                H2_POOL.discard(conn)
                 raise ex.Error(str(exc))
             except ConnectionResetError:
+                H2_POOL.discard(conn)
+                if reused:
+                    # the peer closed the idle connection, retry on a new one
+                    continue
                 return {"status": 1, "error": "%s %s connection reset"%(method, path)}
             except (ConnectionRefusedError, ssl.SSLError, socket.error) as exc:
+                H2_POOL.discard(conn)
+                if reused:
+                    continue
                 try:
                     errno = exc.errno
                 except AttributeError:
@@ -807,8 +1052,13 @@ class Crypt(object):
                     elapsed += PAUSE
                     continue
                 return {"status": 1, "error": "%s"%exc, "errno": errno}
-        resp = conn.get_response()
-        data = resp.read()
+        try:
+            resp = conn.get_response(stream_id)
+            data = resp.read()
+        except Exception:
+            H2_POOL.discard(conn)
+            raise
+        H2_POOL.put(key, conn)
         data = json.loads(bdecode(data))
         return data
 
@@ -3937,6 +3937,67 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
         print(format_cluster(paths=paths, node=self.cluster_nodes, data=data))
         return 0
 
+    def daemon_profile_start(self):
+        """
+        Tell the daemon to start sampling a thread stack
+        """
+        return self._daemon_profile(True)
+
+    def daemon_profile_stop(self):
+        """
+        Tell the daemon to stop sampling a thread stack
+        """
+        return self._daemon_profile(False)
+
+    def _daemon_profile(self, enable):
+        if not self.options.thr_id:
+            raise ex.Error("--thread-id is required")
+        data = self.daemon_post(
+            {
+                "action": "daemon_profile",
+                "options": {
+                    "thr_id": self.options.thr_id,
+                    "enable": enable,
+                },
+            },
+            server=self.options.server,
+            timeout=DEFAULT_DAEMON_TIMEOUT,
+        )
+        status, error, info = self.parse_result(data)
+        if error:
+            print(error, file=sys.stderr)
+        return status
+
+    @formatter
+    def daemon_crypto_bench(self):
+        """
+        Measure the throughput of the AES backends available on this node.
+        """
+        from core.aes import BACKEND, benchmark
+        data = benchmark()
+        if self.options.format in ("json", "flat_json") or self.options.jsonpath_filter:
+            return data
+
+        from utilities.render.forest import Forest
+        from utilities.render.color import color
+
+        tree = Forest()
+        head = tree.add_node()
+        head.add_column("backend")
+        head.add_column("size")
+        head.add_column("encrypt")
+        head.add_column("decrypt")
+        for _data in data:
+            node = head.add_node()
+            if _data["backend"] == BACKEND.description():
+                node.add_column(_data["backend"] + " (selected)", color.BOLD)
+            else:
+                node.add_column(_data["backend"])
+            node.add_column(print_size(_data["size"], unit="B"))
+            node.add_column("%.2f MB/s" % _data["encrypt"])
+            node.add_column("%.2f MB/s" % _data["decrypt"])
+        tree.out()
+
     def daemon_blacklist_clear(self):
         """
         Tell the daemon to clear the senders blacklist
@@ -514,6 +514,34 @@ The default ruser is root for all nodes. ruser accepts a list of user[@node] ...
         "default": 60,
         "text": "A duration expression, like ``1m30s``, defining how long the daemon retains a remote in-maintenance node data. The maintenance state is announced to peers on daemon stop and daemon restart, but not on daemon shutdown. As long as the remote node data are retained, the local daemon won't opt-in to takeover its running instances. This parameter should be adjusted to span the daemon restart time."
     },
+    {
+        "section": "node",
+        "keyword": "dataset_journal_check",
+        "convert": "boolean",
+        "default": False,
+        "text": "If set to ``true``, the daemon monitor verifies the heartbeat patches built from the journal of the local dataset changed paths against a full diff of the dataset, logs the changes missed by the journal and includes them in the patch. This check is costly on nodes hosting many objects, and should only be enabled for troubleshooting."
+    },
+    {
+        "section": "node",
+        "keyword": "status_workers",
+        "convert": "integer",
+        "default": 2,
+        "text": "The number of long-lived worker processes the daemon monitor uses to refresh the objects status, instead of spawning a :cmd:`om <path> status --refresh` command per refresh. Set to ``0`` to disable the workers."
+    },
+    {
+        "section": "node",
+        "keyword": "status_queue_size",
+        "convert": "integer",
+        "default": 1024,
+        "text": "The maximum number of object status refreshes queued for the status workers. The refreshes requested while the queue is full are executed by a :cmd:`om <path> status --refresh` command."
+    },
+    {
+        "section": "node",
+        "keyword": "watcher_poll_interval",
+        "convert": "duration",
+        "default": 10,
+        "text": "A duration expression, like ``10s``, defining the interval between the objects configuration and status files scans of the daemon watcher, when inotify is not available. The changes missed between scans are also caught by the daemon monitor periodic full rescan."
+    },
     {
         "section": "node",
         "keyword": "rejoin_grace_period",
@@ -670,6 +698,55 @@ If not set, or set to ``true``, the reboot flag is removed before reboot, and a
         "default": 1214,
         "text": """The port the daemon listener must listen on. In pull action mode, the collector sends a tcp packet to the server to notify there are actions to unqueue. The opensvc daemon executes the :c-action:`dequeue actions` node action upon receive. The :kw:`listener.port` parameter is sent to the collector upon :c-action:`pushasset`. The collector uses this port to notify the node."""
     },
+    {
+        "section": "listener",
+        "keyword": "io_mode",
+        "candidates": ["selector", "thread"],
+        "default": "selector",
+        "text": "In ``selector`` mode, the idle and streaming client connections are multiplexed by the listener thread, and their requests are served by a bounded pool of handler threads. In ``thread`` mode, a thread is started for each client connection. The ``selector`` mode falls back to ``thread`` on python versions without the selectors module. Changes take effect on daemon restart."
+    },
+    {
+        "section": "listener",
+        "keyword": "workers",
+        "convert": "integer",
+        "default": 16,
+        "text": "The maximum number of handler threads serving the client connections in ``selector`` :kw:`io_mode`. Changes take effect on daemon restart."
+    },
+    {
+        "section": "listener",
+        "keyword": "queue_size",
+        "convert": "integer",
+        "default": 64,
+        "text": "The maximum number of client connections waiting for a handler thread in ``selector`` :kw:`io_mode`. Beyond, new raw clients are answered a 503 busy status, and new h2 clients are disconnected. Changes take effect on daemon restart."
+    },
+    {
+        "section": "listener",
+        "keyword": "multiplex_workers",
+        "convert": "integer",
+        "default": 8,
+        "text": "The maximum number of concurrent peer requests sent to serve a request targeting multiple nodes."
+    },
+    {
+        "section": "listener",
+        "keyword": "multiplex_timeout",
+        "convert": "duration",
+        "default": 60,
+        "text": "A duration expression, like ``10s``, defining how long a request targeting multiple nodes waits for each peer result. The results of the peers not answering in time are reported as timeout errors, and the results of the other nodes are returned."
+    },
+    {
+        "section": "listener",
+        "keyword": "auth_cache_size",
+        "convert": "integer",
+        "default": 1024,
+        "text": "The maximum number of authenticated basic, jwt and x509 credentials cached with their user grants. The least recently used entries are evicted first."
+    },
+    {
+        "section": "listener",
+        "keyword": "auth_cache_ttl",
+        "convert": "duration",
+        "default": 60,
+        "text": "A duration expression, like ``1m``, defining how long an authenticated credential is cached. The entries of a user are also dropped when its ``system/usr`` object configuration changes, and a jwt entry does not outlive its token expiration."
+    },
     {
         "section": "listener",
         "keyword": "openid_well_known",
@@ -883,6 +960,22 @@ Arbitrators can be tested using :cmd:`om node ping --node <arbitrator name>`.
         "default": 5,
         "text": "The interval between tx threads data sends."
     },
+    {
+        "section": "hb",
+        "keyword": "batch_window",
+        "convert": "duration",
+        "at": True,
+        "default": "200ms",
+        "text": "A duration expression, like ``200ms``, defining the delay the tx threads wait after a local dataset change before sending, so the changes done during this window are sent in a single message. Set to 0 to send immediately."
+    },
+    {
+        "section": "hb",
+        "keyword": "keepalive_interval",
+        "convert": "duration",
+        "at": True,
+        "default_text": "A third of the :kw:`timeout`.",
+        "text": "The maximum interval between tx threads sends when the local dataset does not change and all peers have its last generation. The interval between these keepalive sends doubles from :kw:`interval` up to this value, which is capped to a third of the :kw:`timeout`."
+    },
     {
         "section": "hb",
         "keyword": "addr",
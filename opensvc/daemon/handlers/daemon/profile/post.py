@@ -0,0 +1,50 @@
+import daemon.handler
+import daemon.shared as shared
+
+class Handler(daemon.handler.BaseHandler):
+    """
+    Enable or disable the sampling profiler of the daemon thread identified by <thr_id>.
+    The profile is reported in the thread section of the daemon_stats handler data.
+    """
+    routes = (
+        ("POST", "daemon_profile"),
+        (None, "daemon_profile"),
+    )
+    prototype = [
+        {
+            "name": "thr_id",
+            "required": True,
+            "desc": "The id of a thread to profile.",
+            "example": "monitor",
+            "format": "string",
+        },
+        {
+            "name": "enable",
+            "desc": "Enable the thread profiling if True, disable if False.",
+            "required": False,
+            "default": True,
+            "format": "boolean",
+        },
+        {
+            "name": "interval",
+            "desc": "The stack sampling interval in milliseconds.",
+            "required": False,
+            "default": 10,
+            "format": "integer",
+        },
+    ]
+
+    def action(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        with shared.THREADS_LOCK:
+            dthr = shared.THREADS.get(options.thr_id)
+        if dthr is None or dthr.ident is None:
+            thr.log_request("profile requested on non-existing thread", nodename, **kwargs)
+            return {"error": "thread does not exist", "status": 1}
+        if options.enable:
+            thr.log_request("enable thread %s profiling" % options.thr_id, nodename, **kwargs)
+            shared.SAMPLER.enable(options.thr_id, dthr.ident, interval=options.interval / 1000.0)
+        else:
+            thr.log_request("disable thread %s profiling" % options.thr_id, nodename, **kwargs)
+            shared.SAMPLER.disable(options.thr_id)
+        return {"status": 0}
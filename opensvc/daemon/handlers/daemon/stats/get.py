@@ -27,10 +27,14 @@ class Handler(daemon.handler.BaseHandler):
                  },
             },
             "services": {},
+            "locks": dict((name, lock.summary()) for name, lock in shared.PROFILED_LOCKS.items()),
         }
         with shared.THREADS_LOCK:
             for dthr_id, dthr in shared.THREADS.items():
                 data[dthr_id] = dthr.thread_stats()
+                profile = shared.SAMPLER.report(dthr_id)
+                if profile and data[dthr_id]:
+                    data[dthr_id] = dict(data[dthr_id], profile=profile)
         with shared.SERVICES_LOCK:
             for svc in shared.SERVICES.values():
                 _data = svc.pg_stats()
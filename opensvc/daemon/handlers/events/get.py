@@ -61,13 +61,8 @@ class Handler(daemon.handler.BaseHandler):
                     selector=options.selector
                 ),
             }
-            if thr.h2conn:
-                _msg = fevent
-            elif thr.encrypted:
-                _msg = thr.encrypt(fevent)
-            else:
-                _msg = thr.msg_encode(fevent)
-            thr.event_queue.put(_msg)
+            # encoded by the raw or h2 sender
+            thr.event_queue.put(fevent)
         if not thr in thr.parent.events_clients:
             thr.parent.events_clients.append(thr)
         if not stream_id in thr.events_stream_ids:
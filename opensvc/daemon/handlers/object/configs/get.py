@@ -0,0 +1,54 @@
+import codecs
+import os
+
+import daemon.handler
+import daemon.shared as shared
+from utilities.files import fsum
+from utilities.naming import split_path, svc_pathcf
+
+class Handler(daemon.handler.BaseHandler):
+    """
+    Return the configuration file data, mtime and csum of the <paths>
+    objects.
+    """
+    routes = (
+        ("GET", "object_configs"),
+    )
+    access = {
+        "roles": ["admin"],
+    }
+    prototype = [
+        {
+            "name": "paths",
+            "desc": "The object paths.",
+            "required": True,
+            "format": "list",
+        },
+    ]
+
+    def rbac(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        namespaces = list(set([split_path(path)[1] for path in options.paths]))
+        thr.rbac_requires(roles=["admin"], namespaces=namespaces, **kwargs)
+
+    def action(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        data = {}
+        for path in options.paths:
+            data[path] = self.object_config(path)
+        thr.log.info("serve %d objects config to %s", len(data), nodename)
+        return {"status": 0, "data": data}
+
+    @staticmethod
+    def object_config(path):
+        if shared.SMON_DATA.get(path, {}).get("status") in ("purging", "deleting") or \
+           shared.SMON_DATA.get(path, {}).get("global_expect") in ("purged", "deleted"):
+            return {"error": "delete in progress", "status": 2}
+        fpath = svc_pathcf(path)
+        try:
+            mtime = os.path.getmtime(fpath)
+            with codecs.open(fpath, "r", "utf8") as filep:
+                buff = filep.read()
+        except (OSError, IOError):
+            return {"error": "%s does not exist" % fpath, "status": 3}
+        return {"status": 0, "data": buff, "mtime": mtime, "csum": fsum(fpath)}
@@ -0,0 +1,76 @@
+import daemon.handler
+import daemon.shared as shared
+
+class Handler(daemon.handler.BaseHandler):
+    """
+    Return the relay heartbeat payloads of the <cluster_id> cluster slots
+    written since the client-supplied <version> of the cluster slots.
+
+    If the <epoch> supplied by the client is not the relay counters epoch,
+    the relay restarted and all the slots are returned.
+    """
+    routes = (
+        ("GET", "relay_slots"),
+        (None, "relay_slots"),
+    )
+    prototype = [
+        {
+            "name": "cluster_id",
+            "desc": "The cluster.id keyword value of the requesting node.",
+            "required": False,
+            "format": "string",
+            "default": "",
+        },
+        {
+            "name": "slots",
+            "desc": "The names of the nodes to fetch the last heartbeat message from. All the cluster slots if not set.",
+            "required": False,
+            "format": "list",
+            "default": None,
+        },
+        {
+            "name": "version",
+            "desc": "The cluster slots version returned by the previous request.",
+            "required": False,
+            "format": "integer",
+            "default": 0,
+        },
+        {
+            "name": "epoch",
+            "desc": "The relay counters epoch returned by the previous request.",
+            "required": False,
+            "format": "string",
+            "default": "",
+        },
+    ]
+    access = {
+        "roles": ["heartbeat"],
+    }
+
+    def action(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        data = {}
+        with shared.RELAY_LOCK:
+            version = shared.RELAY_VERSIONS.get(options.cluster_id, 0)
+            if options.epoch != shared.RELAY_EPOCH:
+                since = 0
+            else:
+                since = options.version
+            if version > since:
+                prefix = options.cluster_id + "/"
+                for key, slot in shared.RELAY_DATA.items():
+                    if not key.startswith(prefix) or slot.get("version", 0) <= since:
+                        continue
+                    slot_nodename = key[len(prefix):]
+                    if options.slots and slot_nodename not in options.slots:
+                        continue
+                    data[slot_nodename] = {
+                        "data": slot["msg"],
+                        "updated": slot["updated"],
+                    }
+        return {
+            "status": 0,
+            "epoch": shared.RELAY_EPOCH,
+            "version": version,
+            "slots": data,
+        }
@@ -49,7 +49,10 @@ class Handler(daemon.handler.BaseHandler):
         options = self.parse_options(kwargs)
         key = "/".join([options.cluster_id, nodename])
         with shared.RELAY_LOCK:
+            version = shared.RELAY_VERSIONS.get(options.cluster_id, 0) + 1
+            shared.RELAY_VERSIONS[options.cluster_id] = version
             shared.RELAY_DATA[key] = {
+                "version": version,
                 "msg": options.msg,
                 "updated": time.time(),
                 "cluster_name": options.cluster_name,
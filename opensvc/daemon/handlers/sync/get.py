@@ -1,6 +1,3 @@
-import time
-
-from foreign.six.moves import queue
 import daemon.handler
 import daemon.shared as shared
 
@@ -29,26 +26,17 @@ class Handler(daemon.handler.BaseHandler):
         options = self.parse_options(kwargs)
         thr.selector = ""
         ref_gen = shared.GEN
-        if not thr.event_queue:
-            thr.event_queue = queue.Queue()
-        if not thr in thr.parent.events_clients:
-            thr.parent.events_clients.append(thr)
         if self.match(ref_gen):
             return {"status": 0, "data": {"satisfied": True, "gen": ref_gen}}
-        limit = time.time() + options.timeout
-        while True:
+
+        def check(msg):
             if self.match(ref_gen):
                 return {"status": 0, "data": {"satisfied": True, "gen": ref_gen}}
-            left = limit - time.time()
-            if left <= 0:
-                break
-            if left > 3:
-                left = 3
-            try:
-                thr.event_queue.get(True, left)
-            except queue.Empty:
-                pass
-        return {"status": 1, "data": {"satisfied": False, "gen": ref_gen}}
+
+        def expire():
+            return {"status": 1, "data": {"satisfied": False, "gen": ref_gen}}
+
+        return thr.long_poll_result(check, expire, options.timeout)
 
     def match(self, ref_gen):
         for node, gen in shared.LOCAL_GEN.items():
@@ -2,7 +2,6 @@ import json
 import re
 import time
 
-from foreign.six.moves import queue
 import daemon.handler
 import daemon.shared as shared
 import core.exceptions as ex
@@ -48,31 +47,23 @@ class Handler(daemon.handler.BaseHandler):
         thr.selector = "**"
         options = self.parse_options(kwargs)
         duration = options.duration if (options.duration is not None and options.duration < MAX_DURATION) else MAX_DURATION
-        timeout = time.time() + duration
+        begin = time.time()
         if not options.condition:
             return {"status": 0, "data": {"satisfied": True, "duration": duration, "elapsed": 0}}
-        if not thr.event_queue:
-            thr.event_queue = queue.Queue()
-        if not thr in thr.parent.events_clients:
-            thr.parent.events_clients.append(thr)
         neg, jsonpath_expr, oper, val = self.parse_condition(options.condition)
         if neg ^ self.match(jsonpath_expr, oper, val, {"kind": "patch"}):
             return {"status": 0, "data": {"satisfied": True, "duration": duration, "elapsed": 0}}
-        end = False
-        while True:
-            left = timeout - time.time()
-            if left < 0:
-                left = 0
-            try:
-                msg = thr.event_queue.get(True, left if left < 3 else 3)
-            except queue.Empty:
+
+        def check(msg):
+            if msg is None:
                 msg = {"kind": "patch"}
-                if left < 3:
-                    end = True
             if neg ^ self.match(jsonpath_expr, oper, val, msg):
-                return {"status": 0, "data": {"satisfied": True, "duration": duration, "elapsed": duration-left}}
-            if end:
-                return {"status": 1, "data": {"satisfied": False, "duration": duration, "elapsed": duration-left}}
+                return {"status": 0, "data": {"satisfied": True, "duration": duration, "elapsed": time.time()-begin}}
+
+        def expire():
+            return {"status": 1, "data": {"satisfied": False, "duration": duration, "elapsed": time.time()-begin}}
+
+        return thr.long_poll_result(check, expire, duration)
 
     def parse_condition(self, condition):
         oper = None
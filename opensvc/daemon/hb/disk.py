@@ -8,14 +8,41 @@ import stat
 import errno
 import contextlib
 import json
+import struct
 import time
 
 import daemon.shared as shared
 import core.exceptions as ex
+from core.comm import is_binary_message
 from env import Env
 from .hb import Hb
+from utilities.storage import Storage
 from utilities.string import bdecode
 
+# The cleartext header of a data slot: magic, version, sequence number,
+# write time and payload length. The encrypted message payload follows.
+SLOT_MAGIC = b"OSVH"
+SLOT_VERSION = 1
+SLOT_HEADER = struct.Struct(">4sBxxxQdI")
+
+
+def slot_header(seq, updated, length):
+    return SLOT_HEADER.pack(SLOT_MAGIC, SLOT_VERSION, seq, updated, length)
+
+
+def parse_slot_header(buff):
+    """
+    Return the slot header fields as a Storage, or None if <buff> does not
+    start with a slot header, ie the slot was written in the legacy format.
+    """
+    if bytes(buff[:len(SLOT_MAGIC)]) != SLOT_MAGIC:
+        return
+    _, version, seq, updated, length = SLOT_HEADER.unpack(bytes(buff[:SLOT_HEADER.size]))
+    if version != SLOT_VERSION:
+        return
+    return Storage(seq=seq, updated=updated, length=length)
+
+
 class HbDisk(Hb):
     """
     A class factorizing common methods and properties for the disk
@@ -27,6 +54,10 @@ class HbDisk(Hb):
     # A 100MB disk can hold 96 nodes
     SLOTSIZE = 1024 * 1024
 
+    # The minimum size of a slot i/o. The slot header and a small payload
+    # are read in one i/o of this size.
+    SLOT_IOSIZE = 2 * mmap.PAGESIZE
+
     MAX_SLOTS = METASIZE // mmap.PAGESIZE
 
     def status(self, **kwargs):
@@ -61,9 +92,11 @@ class HbDisk(Hb):
             self.meta_slot_buff = mmap.mmap(-1, 2*mmap.PAGESIZE)
         if not hasattr(self, "slot_buff"):
             self.slot_buff = mmap.mmap(-1, self.SLOTSIZE)
+            self.slot_view = memoryview(self.slot_buff)
 
         self.timeout = shared.NODE.oget(self.name, "timeout")
         self.interval = shared.NODE.oget(self.name, "interval")
+        self.configure_tx_schedule()
         try:
             new_dev = shared.NODE.oget(self.name, "dev")
         except ex.RequiredOptNotFound:
@@ -145,7 +178,18 @@ class HbDisk(Hb):
     def slot_offset(self, slot):
         return self.METASIZE + slot * self.SLOTSIZE
 
+    def slot_iosize(self, size):
+        """
+        Return <size> rounded up to the pages boundary, and to at least
+        SLOT_IOSIZE, as required by the direct i/o.
+        """
+        size = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+        return min(max(size, self.SLOT_IOSIZE), self.SLOTSIZE)
+
     def read_slot(self, slot, fo=None):
+        """
+        Read and return the legacy format slot data.
+        """
         offset = self.slot_offset(slot)
         fo.seek(offset, os.SEEK_SET)
         fo.readinto(self.slot_buff)
@@ -153,6 +197,31 @@ class HbDisk(Hb):
         end = data.index("\0")
         return data[:end]
 
+    def read_slot_header(self, slot, fo=None):
+        """
+        Read the first SLOT_IOSIZE bytes of the slot, and return the parsed
+        slot header, or None if the slot is in the legacy format.
+        """
+        offset = self.slot_offset(slot)
+        fo.seek(offset, os.SEEK_SET)
+        fo.readinto(self.slot_view[:self.SLOT_IOSIZE])
+        return parse_slot_header(self.slot_buff[:SLOT_HEADER.size])
+
+    def read_slot_payload(self, slot, header, fo=None):
+        """
+        Return the payload of the slot whose header was read by
+        read_slot_header(), reading only the part not already read.
+        """
+        end = SLOT_HEADER.size + header.length
+        if end > self.SLOTSIZE:
+            raise ex.Error("slot %d payload length %d exceeds the slot size" % (slot, header.length))
+        if end > self.SLOT_IOSIZE:
+            offset = self.slot_offset(slot) + self.SLOT_IOSIZE
+            size = self.slot_iosize(end - self.SLOT_IOSIZE)
+            fo.seek(offset, os.SEEK_SET)
+            fo.readinto(self.slot_view[self.SLOT_IOSIZE:self.SLOT_IOSIZE+size])
+        return self.slot_buff[SLOT_HEADER.size:end]
+
     def write_slot(self, slot, data, fo=None):
         if len(data) > self.SLOTSIZE:
             self.log.error("attempt to write too long data in slot %d", slot)
@@ -161,7 +230,7 @@ class HbDisk(Hb):
         self.slot_buff.write(data)
         offset = self.slot_offset(slot)
         fo.seek(offset, os.SEEK_SET)
-        fo.write(self.slot_buff)
+        fo.write(self.slot_view[:self.slot_iosize(len(data))])
         fo.flush()
 
     def load_peer_config(self, fo=None, verbose=True):
@@ -213,6 +282,7 @@ class HbDiskTx(HbDisk):
     """
     def __init__(self, name):
         HbDisk.__init__(self, name, role="tx")
+        self.seq = 0
 
     def _configure(self):
         HbDisk._configure(self)
@@ -233,8 +303,7 @@ class HbDiskTx(HbDisk):
                 self.do()
                 if self.stopped():
                     sys.exit(0)
-                with shared.HB_TX_TICKER:
-                    shared.HB_TX_TICKER.wait(self.interval)
+                self.tx_wait()
         except Exception as exc:
             self.log.exception(exc)
 
@@ -254,10 +323,20 @@ class HbDiskTx(HbDisk):
         if message is None:
             return
 
-        data = (json.dumps({
-            "msg": message,
-            "updated": time.time(),
-        })+'\0').encode()
+        if self.peers_compat(shared.DISK_SLOT_HEADER_COMPAT):
+            if not is_binary_message(message):
+                message = message.encode()
+            self.seq += 1
+            data = slot_header(self.seq, time.time(), len(message)) + message
+        else:
+            if is_binary_message(message):
+                message, message_bytes = self.get_message(binary=False)
+                if message is None:
+                    return
+            data = (json.dumps({
+                "msg": message,
+                "updated": time.time(),
+            })+'\0').encode()
         try:
             self.write_slot(slot, data, fo=fo)
             self.set_last()
@@ -321,8 +400,24 @@ class HbDiskRx(HbDisk):
             if data["slot"] < 0:
                 continue
             try:
-                slot_data = json.loads(self.read_slot(data["slot"], fo=fo))
-                _clustername, _nodename, _data = self.decrypt(slot_data["msg"])
+                header = self.read_slot_header(data["slot"], fo=fo)
+                if header is None:
+                    slot_data = json.loads(self.read_slot(data["slot"], fo=fo))
+                    msg = slot_data["msg"]
+                    updated = change = slot_data["updated"]
+                else:
+                    # check the cleartext header before reading and
+                    # decrypting the payload
+                    updated = header.updated
+                    change = (header.seq, header.updated)
+                    if self.last_updated.get(nodename) == change:
+                        # remote tx has not rewritten its slot
+                        continue
+                    if updated < time.time() - self.timeout:
+                        # discard too old dataset
+                        continue
+                    msg = self.read_slot_payload(data["slot"], header, fo=fo)
+                _clustername, _nodename, _data = self.decrypt(msg, received=time.time())
                 if _clustername != self.cluster_name:
                     continue
                 if _nodename is None:
@@ -334,18 +429,17 @@ class HbDiskRx(HbDisk):
                     self.log.warning("node %s has written its data in node %s "
                                      "reserved slot", _nodename, nodename)
                     nodename = _nodename
-                updated = slot_data["updated"]
                 last_updated = self.last_updated.get(nodename)
-                if last_updated is not None and last_updated == updated:
+                if last_updated is not None and last_updated == change:
                     # remote tx has not rewritten its slot
                     #self.log.info("node %s has not updated its slot", nodename)
                     continue
                 if updated < time.time() - self.timeout:
                     # discard too old dataset
                     continue
-                self.last_updated[nodename] = updated
+                self.last_updated[nodename] = change
                 self.store_rx_data(_data, nodename)
-                self.push_stats(len(slot_data))
+                self.push_stats(len(msg))
                 self.set_last(nodename)
             except Exception as exc:
                 self.push_stats()
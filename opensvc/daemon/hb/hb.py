@@ -2,12 +2,15 @@
  Heartbeat parent class
 """
 import logging
+import threading
 import time
 
 import foreign.json_delta as json_delta
+import daemon.journal as journal
 import daemon.shared as shared
 import core.exceptions as ex
 import utilities.ifconfig
+from daemon.profiler import RollingStats
 from env import Env
 from utilities.storage import Storage
 
@@ -17,6 +20,8 @@ class Hb(shared.OsvcThread):
     """
     interval = 5
     timeout = None
+    batch_window = 0.2
+    keepalive_interval = None
 
     def __init__(self, name, role=None):
         shared.OsvcThread.__init__(self)
@@ -24,9 +29,65 @@ class Hb(shared.OsvcThread):
         self.id = name + "." + role
         self.log = logging.LoggerAdapter(logging.getLogger(Env.nodename+".osvcd."+self.id), {"node": Env.nodename, "component": self.id})
         self.peers = {}
+        self.metrics = {}
+        self.rx_local = threading.local()
+        self.tx_gen = None
+        self.tx_delay = None
         self.reset_stats()
         self.hb_nodes = self.cluster_nodes
 
+    def configure_tx_schedule(self):
+        self.batch_window = shared.NODE.oget(self.name, "batch_window")
+        self.keepalive_interval = shared.NODE.oget(self.name, "keepalive_interval")
+
+    def max_keepalive_interval(self):
+        """
+        Return the maximum delay between two keepalive sends, capped to
+        a third of the timeout so the rx threads still receive a beat
+        before declaring this node stale when one is lost or delayed.
+        """
+        if self.timeout:
+            delay = self.timeout / 3.0
+        else:
+            delay = self.interval
+        if self.keepalive_interval:
+            delay = min(delay, self.keepalive_interval)
+        return max(delay, self.interval)
+
+    def peers_synced(self):
+        """
+        Return True if all the known hb peers have the last generation of
+        the local dataset.
+        """
+        for nodename, gen in list(shared.LOCAL_GEN.items()):
+            if nodename in self.hb_nodes and gen != shared.GEN:
+                return False
+        return True
+
+    def tx_wait(self):
+        """
+        Wait for the next tx loop iteration.
+
+        A local dataset change wakes the tx threads up. The send is then
+        delayed by <batch_window>, so the generations created during this
+        window are sent in the same message.
+
+        When the local dataset did not change during the previous wait and
+        all peers have its last generation, the next send is a pure
+        keepalive: the wait doubles from <interval> up to the maximum
+        keepalive interval.
+        """
+        gen = shared.GEN
+        if gen == self.tx_gen and self.peers_synced():
+            self.tx_delay = min(2 * (self.tx_delay or self.interval), self.max_keepalive_interval())
+        else:
+            self.tx_delay = self.interval
+        self.tx_gen = gen
+        with shared.HB_TX_TICKER:
+            shared.HB_TX_TICKER.wait(self.tx_delay)
+        if shared.GEN != gen and self.batch_window > 0 and not self.stopped():
+            time.sleep(self.batch_window)
+
     def get_hb_nodes(self):
         try:
             self.hb_nodes = [node for node in shared.NODE.conf_get(self.name, "nodes")
@@ -69,8 +130,68 @@ class Hb(shared.OsvcThread):
                 "last": _data.last,
                 "beating": _data.beating if running else False,
             }
+            if nodename in self.metrics:
+                data["peers"][nodename]["metrics"] = self.metrics_summary(nodename)
         return data
 
+    def peer_metrics(self, nodename):
+        """
+        Return the rx metrics of the <nodename> peer:
+
+        * size: the received messages size, in bytes
+        * latency: the duration from the message reception to the end of
+          its application to the peer dataset, in seconds
+        * decrypt: the message decryption duration, in seconds
+        * patch: the dataset patch duration, in seconds
+        * resyncs: the count of full dataset resyncs asked to the peer
+        """
+        try:
+            return self.metrics[nodename]
+        except KeyError:
+            return self.metrics.setdefault(nodename, Storage({
+                "size": RollingStats(),
+                "latency": RollingStats(),
+                "decrypt": RollingStats(),
+                "patch": RollingStats(),
+                "resyncs": 0,
+            }))
+
+    def metrics_summary(self, nodename):
+        metrics = self.metrics[nodename]
+        return {
+            "size": metrics.size.summary(),
+            "latency": metrics.latency.summary(),
+            "decrypt": metrics.decrypt.summary(),
+            "patch": metrics.patch.summary(),
+            "resyncs": metrics.resyncs,
+        }
+
+    def decrypt(self, message, *args, **kwargs):
+        """
+        Decrypt a received message, recording its size and decryption
+        duration in the sender metrics. The <received> keyword argument,
+        set by the rx threads to the time the message was read from the
+        socket, disk or relay, is kept for the rx-to-apply latency
+        measured by store_rx_data(). It defaults to the decryption start.
+        """
+        received = kwargs.pop("received", None)
+        begin = time.time()
+        self.rx_local.received = begin if received is None else received
+        clustername, nodename, data = shared.OsvcThread.decrypt(self, message, *args, **kwargs)
+        if nodename is not None and data is not None:
+            metrics = self.peer_metrics(nodename)
+            metrics.decrypt.add(time.time() - begin)
+            metrics.size.add(len(message))
+        return clustername, nodename, data
+
+    def ask_full(self, nodename):
+        """
+        Count a full dataset resync asked to <nodename>. The resync is
+        asked by resetting its remote gen.
+        """
+        shared.REMOTE_GEN[nodename] = 0
+        self.peer_metrics(nodename).resyncs += 1
+
     def set_last(self, nodename="*", success=True):
         if nodename not in self.peers:
             self.peers[nodename] = Storage({
@@ -150,7 +271,54 @@ class Hb(shared.OsvcThread):
             addr = intf.ipaddr
         return addr
 
-    def get_message(self, nodename=None):
+    def peers_compat(self, version):
+        """
+        Return True if all the hb peers announced a compat version greater
+        or equal to <version>.
+        """
+        for nodename in self.hb_nodes:
+            if nodename == Env.nodename:
+                continue
+            try:
+                if shared.CLUSTER_DATA[nodename]["compat"] < version:
+                    return False
+            except (KeyError, TypeError):
+                return False
+        return True
+
+    def binary_hb(self):
+        """
+        Return True if all the hb peers support the binary message envelope.
+        """
+        return self.peers_compat(shared.BINARY_HB_COMPAT)
+
+    def get_deltas(self, begin):
+        """
+        Return the deltas of the generations after <begin>, and the
+        generation the deltas apply from if they are coalesced in a single
+        delta, or None.
+        """
+        deltas = sorted((gen, delta) for gen, delta in list(shared.GEN_DIFF.items()) if gen > begin)
+        data = dict(deltas)
+        if len(deltas) < 2:
+            return data, None
+        if [gen for gen, _ in deltas] != list(range(begin + 1, deltas[-1][0] + 1)):
+            return data, None
+        if not self.peers_compat(shared.COALESCED_PATCH_COMPAT):
+            return data, None
+        coalesced = journal.coalesce([delta for _, delta in deltas])
+        if coalesced is None:
+            return data, None
+        return {deltas[-1][0]: coalesced}, begin
+
+    def get_message(self, nodename=None, binary=None):
+        """
+        Return the encrypted message to send and its length. The message is
+        a binary envelope if <binary> is True, or if <binary> is None and
+        all the hb peers support it.
+        """
+        if binary is None:
+            binary = self.binary_hb()
         begin, num = self.get_oldest_gen(nodename)
         if num == 0:
             # we're alone for now. don't send a full status payload.
@@ -162,7 +330,7 @@ class Hb(shared.OsvcThread):
                 "gen": self.get_gen(),
                 "monitor": self.get_node_monitor(),
                 "updated": time.time(), # for hb and relay readers
-            }, encode=False)
+            }, encode=False, binary=binary)
             return message, len(message) if message else 0
         if begin == 0 or begin > shared.GEN:
             self.log.debug("send full node data to %s", nodename if nodename else "*")
@@ -172,11 +340,12 @@ class Hb(shared.OsvcThread):
                 # no pertinent data to send yet (pre-init)
                 self.log.debug("no pertinent data to send yet (pre-init)")
                 return None, 0
-            if shared.HB_MSG is not None:
-                return shared.HB_MSG, shared.HB_MSG_LEN
             with shared.HB_MSG_LOCK:
+                if shared.HB_MSG is not None and shared.HB_MSG_BINARY == binary:
+                    return shared.HB_MSG, shared.HB_MSG_LEN
                 with shared.CLUSTER_DATA_LOCK:
-                    shared.HB_MSG = self.encrypt(shared.CLUSTER_DATA[Env.nodename], encode=False)
+                    shared.HB_MSG = self.encrypt(shared.CLUSTER_DATA[Env.nodename], encode=False, binary=binary)
+                shared.HB_MSG_BINARY = binary
                 if shared.HB_MSG is None:
                     shared.HB_MSG_LEN = 0
                 else:
@@ -184,63 +353,148 @@ class Hb(shared.OsvcThread):
                 return shared.HB_MSG, shared.HB_MSG_LEN
         else:
             #self.log.info("send gen %d-%d deltas to %s", begin, shared.GEN, nodename if nodename else "*")
-            data = {}
-            for gen, delta in shared.GEN_DIFF.items():
-                if gen <= begin:
-                    continue
-                data[gen] = delta
-            message = self.encrypt({
+            data, since = self.get_deltas(begin)
+            payload = {
                 "kind": "patch",
                 "deltas": data,
                 "gen": self.get_gen(),
                 "updated": time.time(), # for hb and relay readers
-            }, encode=False)
+            }
+            if since is not None:
+                payload["since"] = since
+            message = self.encrypt(payload, encode=False, binary=binary)
             return message, len(message) if message else 0
 
     def store_rx_data(self, data, nodename):
         if data is None:
             self.log.info("drop corrupted hb data from %s", nodename)
         with shared.RX_LOCK:
+            full_asked = self.full_asked(data, nodename)
             self._store_rx_data(data, nodename)
+        if full_asked:
+            # don't make the peer wait for our next keepalive
+            shared.wake_heartbeat_tx()
+        received = getattr(self.rx_local, "received", None)
+        if received is not None:
+            self.rx_local.received = None
+            self.peer_metrics(nodename).latency.add(time.time() - received)
+
+    @staticmethod
+    def full_asked(data, nodename):
+        """
+        Return True if the <nodename> peer newly announces it has no gen of
+        our dataset, meaning it waits for a full.
+        """
+        if not data or data.get("gen", {}).get(Env.nodename, 0) != 0:
+            return False
+        return shared.LOCAL_GEN.get(nodename) != 0
+
+    def install_warm_data(self, data, nodename):
+        """
+        Install the <nodename> dataset reloaded from the warm restart
+        snapshot if the received patch <data> applies to its gen, and
+        return this gen.
+
+        Return 0 if no such dataset is loaded, or if it does not line up
+        with the patch, in which case a full is asked. A patch without
+        newer delta lines up only if the peer announces the dataset gen:
+        the peer may have purged the deltas we missed.
+        """
+        warm = shared.pop_warm_data(nodename)
+        if warm is None:
+            return 0
+        gen = warm["gen"]
+        since = data.get("since")
+        gens = sorted([int(_gen) for _gen in data.get("deltas", {}) if int(_gen) > gen])
+        if gens:
+            if since is None:
+                in_sync = gens[0] - 1 == gen
+            else:
+                in_sync = since <= gen < gens[0]
+            if not in_sync:
+                self.log.info("node %s warm restart dataset gen %d does not line up with "
+                              "the received gen %d patch. ask for a full.", nodename, gen, gens[0])
+                self.ask_full(nodename)
+                return 0
+        elif data.get("gen", {}).get(nodename) != gen:
+            self.log.info("node %s warm restart dataset gen %d does not match the "
+                          "announced gen %s. ask for a full.", nodename, gen,
+                          data.get("gen", {}).get(nodename))
+            self.ask_full(nodename)
+            return 0
+        with shared.CLUSTER_DATA_LOCK:
+            shared.CLUSTER_DATA[nodename] = warm["data"]
+            shared.REMOTE_GEN[nodename] = gen
+            self.on_nodes_info_change()
+            shared.publish_cluster_snapshot(nodename)
+        self.log.info("install node %s warm restart dataset gen %d", nodename, gen)
+        return gen
+
+    def patch_rx_data(self, nodename, delta, coalesced):
+        """
+        Apply a <delta> to the <nodename> dataset, recording the patch
+        duration in the peer metrics.
+        """
+        begin = time.time()
+        if coalesced:
+            journal.patch(shared.CLUSTER_DATA[nodename], delta)
+        else:
+            json_delta.patch(shared.CLUSTER_DATA[nodename], delta)
+        self.peer_metrics(nodename).patch.add(time.time() - begin)
 
     def _store_rx_data(self, data, nodename):
         current_gen = shared.REMOTE_GEN.get(nodename, 0)
         our_gen_on_peer = data.get("gen", {}).get(Env.nodename, 0)
         kind = data.get("kind", "full")
         change = False
+        if kind != "patch" and shared.WARM_DATA:
+            # the peer does not send deltas: drop its warm restart dataset
+            shared.pop_warm_data(nodename)
         if kind == "patch":
+            if current_gen == 0:
+                current_gen = self.install_warm_data(data, nodename)
             if current_gen == 0:
                 # waiting for a full: ignore patches
                 return
             if nodename not in shared.CLUSTER_DATA:
                 # happens during init. ignore the patch, and ask for a full
-                shared.REMOTE_GEN[nodename] = 0
+                self.ask_full(nodename)
                 shared.LOCAL_GEN[nodename] = our_gen_on_peer
                 return
             deltas = data.get("deltas", [])
+            # the single delta of a coalesced patch applies to our dataset
+            # at any gen of the (since, gen] range
+            since = data.get("since")
             gens = sorted([int(gen) for gen in deltas])
             gens = [gen for gen in gens if gen > current_gen]
             if len(gens) == 0:
                 #self.log.info("no more recent gen in received deltas")
-                if our_gen_on_peer > shared.LOCAL_GEN[nodename]:
-                    shared.LOCAL_GEN[nodename] = our_gen_on_peer
-                    shared.CLUSTER_DATA[nodename]["gen"][Env.nodename] = our_gen_on_peer
+                if our_gen_on_peer > shared.LOCAL_GEN.get(nodename, 0):
+                    with shared.CLUSTER_DATA_LOCK:
+                        shared.LOCAL_GEN[nodename] = our_gen_on_peer
+                        shared.CLUSTER_DATA[nodename]["gen"][Env.nodename] = our_gen_on_peer
+                        shared.publish_cluster_snapshot(nodename, [["gen"]])
                 return
             with shared.CLUSTER_DATA_LOCK:
                 for gen in gens:
                     #self.log.debug("merge node %s gen %d (%d diffs)", nodename, gen, len(deltas[str(gen)]))
-                    if gen - 1 != current_gen:
+                    if since is None:
+                        in_sync = gen - 1 == current_gen
+                    else:
+                        in_sync = since <= current_gen < gen
+                    if not in_sync:
                         self.log.warning("unsynchronized node %s dataset. local gen %d, received %d. "
                                          "ask for a full.", nodename, current_gen, gen)
-                        shared.REMOTE_GEN[nodename] = 0
+                        self.ask_full(nodename)
                         shared.LOCAL_GEN[nodename] = our_gen_on_peer
                         shared.CLUSTER_DATA[nodename]["gen"] = {
                             nodename: gen,
                             Env.nodename: our_gen_on_peer,
                         }
+                        shared.publish_cluster_snapshot(nodename, [["gen"]])
                         break
                     try:
-                        json_delta.patch(shared.CLUSTER_DATA[nodename], deltas[str(gen)])
+                        self.patch_rx_data(nodename, deltas[str(gen)], since is not None)
                         current_gen = gen
                         shared.REMOTE_GEN[nodename] = gen
                         shared.LOCAL_GEN[nodename] = our_gen_on_peer
@@ -248,6 +502,7 @@ class Hb(shared.OsvcThread):
                             nodename: gen,
                             Env.nodename: our_gen_on_peer,
                         }
+                        shared.publish_cluster_snapshot(nodename, [delta[0] for delta in deltas[str(gen)]] + [["gen"]])
                         self.log.debug("patch node %s dataset to gen %d, peer has gen %d of our dataset",
                                        nodename, shared.REMOTE_GEN[nodename],
                                        shared.LOCAL_GEN[nodename])
@@ -257,12 +512,13 @@ class Hb(shared.OsvcThread):
                     except Exception as exc:
                         self.log.warning("failed to apply node %s dataset gen %d patch: %s. "
                                          "ask for a full: %s", nodename, gen, deltas[str(gen)], exc)
-                        shared.REMOTE_GEN[nodename] = 0
+                        self.ask_full(nodename)
                         shared.LOCAL_GEN[nodename] = our_gen_on_peer
                         shared.CLUSTER_DATA[nodename]["gen"] = {
                             nodename: gen,
                             Env.nodename: our_gen_on_peer,
                         }
+                        shared.publish_cluster_snapshot(nodename)
                         return
         elif kind == "ping":
             with shared.CLUSTER_DATA_LOCK:
@@ -274,7 +530,11 @@ class Hb(shared.OsvcThread):
                     nodename: 0,
                     Env.nodename: our_gen_on_peer,
                 }
-                shared.CLUSTER_DATA[nodename]["monitor"] = data["monitor"]
+                paths = [["gen"]]
+                if shared.CLUSTER_DATA[nodename].get("monitor") != data["monitor"]:
+                    shared.CLUSTER_DATA[nodename]["monitor"] = data["monitor"]
+                    paths.append(["monitor"])
+                shared.publish_cluster_snapshot(nodename, paths)
                 self.log.debug("reset node %s dataset gen, peer has gen %d of our dataset",
                               nodename, shared.LOCAL_GEN[nodename])
                 change = True
@@ -304,6 +564,7 @@ class Hb(shared.OsvcThread):
                     nodename: new_gen,
                     Env.nodename: our_gen_on_peer,
                 }
+                shared.publish_cluster_snapshot(nodename)
                 self.log.debug("install node %s dataset gen %d, peer has gen %d of our dataset",
                               nodename, shared.REMOTE_GEN[nodename],
                               shared.LOCAL_GEN[nodename])
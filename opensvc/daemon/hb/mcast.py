@@ -3,7 +3,6 @@ Multicast Heartbeat
 """
 import sys
 import socket
-import threading
 import struct
 import uuid
 import json
@@ -11,14 +10,28 @@ import time
 
 import core.exceptions as ex
 import daemon.shared as shared
+from core.comm import is_binary_message
+from daemon.workers import WorkerPool
 from env import Env
 from utilities.chunker import chunker
+from utilities.storage import Storage
 from utilities.string import bdecode
 from .hb import Hb
 
 MAX_MESSAGES = 100
 MAX_FRAGMENTS = 1000
 
+# The header of a binary envelope fragment: magic, version, message id,
+# fragment index, fragments count, fragment offset in the message, message
+# length. The fragment data follows.
+FRAGMENT_MAGIC = b"\x93OSF"
+FRAGMENT_VERSION = 1
+FRAGMENT_HEADER = struct.Struct(">4sB16sHHII")
+
+
+def is_fragment(buff):
+    return bytes(buff[:len(FRAGMENT_MAGIC)]) == FRAGMENT_MAGIC
+
 class HbMcast(Hb):
     """
     A class factorizing common methods and properties for the multicast
@@ -31,6 +44,9 @@ class HbMcast(Hb):
     sock = None
     max_data = 1000
 
+    # the maximum size of a binary datagram
+    max_datagram = 1400
+
     def status(self, **kwargs):
         data = Hb.status(self, **kwargs)
         data["stats"] = self.stats
@@ -71,6 +87,7 @@ class HbMcast(Hb):
         self.addr = shared.NODE.oget(self.name, "addr")
         self.timeout = shared.NODE.oget(self.name, "timeout")
         self.interval = shared.NODE.oget(self.name, "interval")
+        self.configure_tx_schedule()
         group = socket.inet_aton(self.addr)
         try:
             self.intf = shared.NODE.conf_get(self.name, "intf")
@@ -81,7 +98,6 @@ class HbMcast(Hb):
             self.intf = "any"
             self.src_addr = "0.0.0.0"
             self.mreq = struct.pack("4sl", group, socket.INADDR_ANY)
-        self.max_handlers = len(self.hb_nodes) * 4
 
         # log changes
         changes = []
@@ -157,8 +173,7 @@ class HbMcastTx(HbMcast):
                 if self.stopped():
                     self.sock.close()
                     sys.exit(0)
-                with shared.HB_TX_TICKER:
-                    shared.HB_TX_TICKER.wait(self.interval)
+                self.tx_wait()
         except Exception as exc:
             self.log.exception(exc)
 
@@ -171,6 +186,11 @@ class HbMcastTx(HbMcast):
 
         #self.log.info("sending to %s:%s", self.addr, self.port)
         try:
+            if is_binary_message(message):
+                self.send_binary(message)
+                self.set_last()
+                self.push_stats(message_bytes)
+                return
             idx = 1
             mid = str(uuid.uuid4())
             total = message_bytes // self.max_data
@@ -201,20 +221,61 @@ class HbMcastTx(HbMcast):
         finally:
             self.set_beating()
 
+    def send_binary(self, message):
+        """
+        Send the binary envelope <message> in one datagram if it fits,
+        else in fragments prefixed by a binary fragment header.
+        """
+        length = len(message)
+        if length <= self.max_datagram:
+            self.sock.sendto(message, self.group)
+            return
+        mid = uuid.uuid4().bytes
+        size = self.max_datagram - FRAGMENT_HEADER.size
+        total = (length + size - 1) // size
+        view = memoryview(message)
+        for idx, offset in enumerate(range(0, length, size)):
+            header = FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, mid,
+                                          idx, total, offset, length)
+            chunk = view[offset:offset+size]
+            if hasattr(self.sock, "sendmsg"):
+                self.sock.sendmsg([header, chunk], [], 0, self.group)
+            else:
+                self.sock.sendto(header + chunk.tobytes(), self.group)
+
 
 #
 class HbMcastRx(HbMcast):
     """
     The multicast heartbeat rx class.
+
+    The received messages are decrypted and applied by a pool of handler
+    threads. The messages of a sender are handled one at a time, in order.
+    While a message of a sender is handled, only the last message received
+    from this sender is kept for handling, as each message contains all the
+    changes not yet acknowledged by the receivers.
     """
     sock_tmo = 2
-    fragments = {}
+
+    # the delay after which the fragments of an incomplete message are
+    # dropped
+    reassembly_tmo = 2
 
     def __init__(self, name):
         HbMcast.__init__(self, name, role="rx")
+        self.fragments = {}
+        self.deferred = {}
+        self.rx_buff = bytearray(65536)
+        self.handlers = WorkerPool(self.id, size=1, log=self.log)
+
+    def status(self, **kwargs):
+        data = HbMcast.status(self, **kwargs)
+        data["handlers"] = self.handlers.status()
+        return data
 
     def _configure(self):
         changed = self.apply_changes()
+        self.handlers.size = max(1, len(self.hb_nodes) - 1)
         if not changed:
             return
         if self.sock:
@@ -254,41 +315,62 @@ class HbMcastRx(HbMcast):
         while True:
             self.do()
             if self.stopped():
-                self.join_threads()
+                self.handlers.stop()
                 self.sock.close()
                 sys.exit(0)
 
-    def do(self):
-        def handle(data, addr):
-            try:
-                thr = threading.Thread(target=self.handle_client, args=(data, addr))
-                thr.start()
-                self.threads.append(thr)
-            except RuntimeError as exc:
-                self.log.warning(exc)
+    def handle(self, data, addr, received=None):
+        """
+        Submit the <data> message received from <addr> at <received> to
+        the handlers, or keep it for submission when the handling of the
+        previous message from <addr> completes.
+        """
+        if self.handlers.submit([addr], self.handle_client, data, addr, received):
+            return
+        if self.handlers.is_pending(addr):
+            self.deferred[addr] = (data, received)
+            return
+        self.log.warning("drop message received from %s: too many queued messages", addr)
 
+    def collect_handlers(self):
+        for keys, _, _ in self.handlers.completed():
+            for addr in keys:
+                deferred = self.deferred.pop(addr, None)
+                if deferred is not None:
+                    self.handle(deferred[0], addr, deferred[1])
+
+    def do(self):
         self.reload_config()
         self.janitor_procs()
-        self.janitor_threads()
+        self.collect_handlers()
 
+        # poll faster while messages wait for their sender's handler
+        self.sock.settimeout(0.05 if self.deferred else self.sock_tmo)
         try:
-            data, addr = self.sock.recvfrom(shared.MAX_MSG_SIZE)
-            self.push_stats(len(data))
+            nbytes, addr = self.sock.recvfrom_into(self.rx_buff)
+            received = time.time()
+            self.push_stats(nbytes)
         except socket.timeout:
             self.set_peers_beating()
+            self.expire_fragments()
+            return
+
+        data = memoryview(self.rx_buff)[:nbytes]
+        if is_fragment(data):
+            self.add_fragment(data, addr, received)
             return
 
-        if len(self.threads) >= self.max_handlers:
-            self.log.warning("drop message received from %s: too many running handlers (%d)",
-                             addr, self.max_handlers)
-            self.fragments = {}
+        if is_binary_message(data):
+            # unfragmented binary envelope
+            self.handle(data.tobytes(), addr, received)
             return
 
+        data = data.tobytes()
         try:
             payload = json.loads(bdecode(data).rstrip("\0\x00"))
         except (ValueError, TypeError) as exc:
             # old format ? try decrypt. will blacklist if failed.
-            handle(data, addr)
+            self.handle(data, addr, received)
             return
 
         try:
@@ -299,37 +381,89 @@ class HbMcastRx(HbMcast):
         except KeyError:
             return
 
-        # verify message DoS
-        if addr not in self.fragments:
-            self.fragments[addr] = {}
-        elif len(self.fragments[addr]) > MAX_MESSAGES:
-            self.log.warning("too many pending messages. purge")
-            self.fragments[addr] = {}
-
-        # verify fragment DoS
-        if mid not in self.fragments[addr]:
-            self.fragments[addr][mid] = {}
-        elif len(self.fragments[addr][mid]) > MAX_FRAGMENTS:
-            self.log.warning("too many pending message fragments. purge")
-            del self.fragments[addr][mid]
+        assembly = self.get_assembly(addr, mid, total)
+        if assembly is None:
             return
-
-        # store fragment
-        self.fragments[addr][mid][idx] = chunk
-
-        if len(self.fragments[addr][mid]) != total:
+        if assembly.buff is None:
+            assembly.buff = {}
+        assembly.buff[idx] = chunk
+        if len(assembly.buff) != total:
             # not yet complete
             return
-
         #self.log.debug("message %s complete", mid)
-        message = ""
-        for idx in sorted(self.fragments[addr][mid].keys()):
-            message += self.fragments[addr][mid][idx]
-        handle(message, addr)
-        self.fragments[addr] = {}
-
-    def handle_client(self, message, addr):
-        clustername, nodename, data = self.decrypt(message, sender_id=addr[0])
+        self.drop_assembly(addr, mid)
+        self.handle("".join(assembly.buff[idx] for idx in sorted(assembly.buff)), addr, received)
+
+    def add_fragment(self, data, addr, received=None):
+        """
+        Copy the binary fragment <data> at its offset in the reassembly
+        buffer of its message, and handle the message when complete,
+        <received> being the reception time of its last fragment.
+        """
+        try:
+            _, version, mid, idx, total, offset, length = FRAGMENT_HEADER.unpack_from(data)
+        except struct.error:
+            return
+        chunk = data[FRAGMENT_HEADER.size:]
+        if version != FRAGMENT_VERSION or idx >= total or \
+           length > shared.MAX_MSG_SIZE or offset + len(chunk) > length:
+            return
+        assembly = self.get_assembly(addr, mid, total)
+        if assembly is None:
+            return
+        if assembly.buff is None:
+            assembly.buff = bytearray(length)
+            assembly.received = set()
+        elif len(assembly.buff) != length:
+            return
+        assembly.buff[offset:offset+len(chunk)] = chunk
+        assembly.received.add(idx)
+        if len(assembly.received) != total:
+            # not yet complete
+            return
+        self.drop_assembly(addr, mid)
+        self.handle(assembly.buff, addr, received)
+
+    def expire_fragments(self, addr=None):
+        """
+        Drop the incomplete messages from <addr>, or from all senders,
+        older than reassembly_tmo.
+        """
+        now = time.time()
+        addrs = [addr] if addr else list(self.fragments)
+        for _addr in addrs:
+            pending = self.fragments.get(_addr, {})
+            for mid in [mid for mid, assembly in pending.items() if now - assembly.created > self.reassembly_tmo]:
+                del pending[mid]
+            if not pending:
+                self.fragments.pop(_addr, None)
+
+    def drop_assembly(self, addr, mid):
+        pending = self.fragments[addr]
+        del pending[mid]
+        if not pending:
+            del self.fragments[addr]
+
+    def get_assembly(self, addr, mid, total):
+        """
+        Return the reassembly state of the <mid> message from <addr>.
+        """
+        if total > MAX_FRAGMENTS:
+            self.log.warning("drop message from %s: too many fragments (%d)", addr, total)
+            return
+        self.expire_fragments(addr)
+        now = time.time()
+        pending = self.fragments.setdefault(addr, {})
+        if mid in pending:
+            return pending[mid]
+        if len(pending) >= MAX_MESSAGES:
+            self.log.warning("too many pending messages from %s. purge", addr)
+            pending.clear()
+        pending[mid] = Storage(created=now, buff=None)
+        return pending[mid]
+
+    def handle_client(self, message, addr, received=None):
+        clustername, nodename, data = self.decrypt(message, sender_id=addr[0], received=received)
         if clustername != self.cluster_name:
             # surely from drp node
             return
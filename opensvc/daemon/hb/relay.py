@@ -1,12 +1,16 @@
 """
 Relay Heartbeat
 """
+import base64
 import sys
 import os
+import time
 
 import daemon.shared as shared
 import core.exceptions as ex
+from core.comm import is_binary_message
 from env import Env
+from utilities.string import bdecode
 from .hb import Hb
 
 class HbRelay(Hb):
@@ -40,6 +44,7 @@ class HbRelay(Hb):
         self.peer_config = {}
         self.timeout = shared.NODE.oget(self.name, "timeout")
         self.interval = shared.NODE.oget(self.name, "interval")
+        self.configure_tx_schedule()
         try:
             self.relay = shared.NODE.oget(self.name, "relay")
         except Exception:
@@ -74,8 +79,7 @@ class HbRelayTx(HbRelay):
                 self.do()
                 if self.stopped():
                     sys.exit(0)
-                with shared.HB_TX_TICKER:
-                    shared.HB_TX_TICKER.wait(self.interval)
+                self.tx_wait()
         except Exception as exc:
             self.log.exception(exc)
 
@@ -105,6 +109,9 @@ class HbRelayTx(HbRelay):
             self.set_beating()
 
     def send(self, message):
+        if is_binary_message(message):
+            # the relay api is json: carry the binary envelope base64-encoded
+            message = bdecode(base64.urlsafe_b64encode(message))
         request = {
             "action": "relay_tx",
             "options": {
@@ -125,9 +132,24 @@ class HbRelayRx(HbRelay):
     """
     The relay heartbeat rx class.
     """
+    # the delay before retrying the batched receive api after the relay
+    # failed to serve it
+    batch_retry_delay = 300
+
     def __init__(self, name):
         HbRelay.__init__(self, name, role="rx")
         self.last_updated = {}
+        self.relay_epoch = ""
+        self.relay_version = 0
+        self.batch_retry_at = 0
+
+    def _configure(self):
+        relay = getattr(self, "relay", None)
+        HbRelay._configure(self)
+        if relay != self.relay:
+            self.relay_epoch = ""
+            self.relay_version = 0
+            self.batch_retry_at = 0
 
     def run(self):
         self.set_tid()
@@ -150,32 +172,54 @@ class HbRelayRx(HbRelay):
     def do(self):
         self.janitor_procs()
         self.reload_config()
+        if time.time() >= self.batch_retry_at:
+            if self.do_batch():
+                return
+            self.log.info("relay %s does not support the batched receive. "
+                          "fallback to per-slot receive", self.relay)
+            self.batch_retry_at = time.time() + self.batch_retry_delay
         for nodename in self.hb_nodes:
             if nodename == Env.nodename:
                 continue
             try:
                 updated, slot_data = self.receive(nodename)
-                _clustername, _nodename, _data = self.decrypt(slot_data, sender_id=self.relay)
-                if _clustername != self.cluster_name:
-                    continue
-                if _nodename is None:
-                    # invalid crypt
-                    #self.log.warning("can't decrypt data in node %s slot",
-                    #                 nodename)
-                    continue
-                if _nodename != nodename:
-                    self.log.warning("node %s has written its data in node %s "
-                                     "reserved slot", _nodename, nodename)
-                    nodename = _nodename
-                last_updated = self.last_updated.get(nodename)
-                if last_updated is not None and last_updated == updated:
+                self.handle_slot(nodename, updated, slot_data, time.time())
+            except Exception as exc:
+                self.push_stats()
+                if self.get_last(nodename).success:
+                    self.log.error("read from relay %s slot %s error: %s", self.relay,
+                                   nodename, str(exc))
+                self.set_last(nodename, success=False)
+            finally:
+                self.set_beating(nodename)
+
+    def do_batch(self):
+        """
+        Fetch the peer slots written since the last request in one relay
+        request, and handle them.
+
+        Return False if the relay does not support the batched receive.
+        """
+        try:
+            slots = self.receive_changes()
+            received = time.time()
+            error = None
+        except ex.Error as exc:
+            slots = {}
+            error = exc
+        if slots is None:
+            return False
+        for nodename in self.hb_nodes:
+            if nodename == Env.nodename:
+                continue
+            try:
+                if error:
+                    raise error
+                if nodename not in slots:
                     # remote tx has not rewritten its slot
-                    #self.log.info("node %s has not updated its slot", nodename)
                     continue
-                self.last_updated[nodename] = updated
-                self.store_rx_data(_data, nodename)
-                self.push_stats(len(_data))
-                self.set_last(nodename)
+                updated, slot_data = slots[nodename]
+                self.handle_slot(nodename, updated, slot_data, received)
             except Exception as exc:
                 self.push_stats()
                 if self.get_last(nodename).success:
@@ -184,6 +228,69 @@ class HbRelayRx(HbRelay):
                 self.set_last(nodename, success=False)
             finally:
                 self.set_beating(nodename)
+        return True
+
+    def handle_slot(self, nodename, updated, slot_data, received=None):
+        _clustername, _nodename, _data = self.decrypt(slot_data, sender_id=self.relay, received=received)
+        if _clustername != self.cluster_name:
+            return
+        if _nodename is None:
+            # invalid crypt
+            #self.log.warning("can't decrypt data in node %s slot",
+            #                 nodename)
+            return
+        if _nodename != nodename:
+            self.log.warning("node %s has written its data in node %s "
+                             "reserved slot", _nodename, nodename)
+            nodename = _nodename
+        last_updated = self.last_updated.get(nodename)
+        if last_updated is not None and last_updated == updated:
+            # remote tx has not rewritten its slot
+            #self.log.info("node %s has not updated its slot", nodename)
+            return
+        self.last_updated[nodename] = updated
+        self.store_rx_data(_data, nodename)
+        self.push_stats(len(_data))
+        self.set_last(nodename)
+
+    @staticmethod
+    def decode_slot_data(data):
+        try:
+            # python3
+            data = bytes(data, "ascii")
+        except TypeError:
+            pass
+        if not data.startswith(b"{"):
+            # base64-encoded binary envelope
+            data = base64.urlsafe_b64decode(data)
+        return data
+
+    def receive_changes(self):
+        """
+        Return a dict of (updated, data) tuples indexed by the peer
+        nodenames, for the slots written since the last request, or None
+        if the relay does not support the batched receive.
+        """
+        request = {
+            "action": "relay_slots",
+            "options": {
+                "cluster_id": self.cluster_id,
+                "slots": [nodename for nodename in self.hb_nodes if nodename != Env.nodename],
+                "version": self.relay_version,
+                "epoch": self.relay_epoch,
+            },
+        }
+        resp = self.daemon_get(request, cluster_name="join", server="raw://"+self.relay, secret=self.secret)
+        if resp is None:
+            raise ex.Error("no response reading relay slots")
+        if resp.get("status", 1) != 0 or "slots" not in resp:
+            return
+        slots = {}
+        for nodename, slot in resp["slots"].items():
+            slots[nodename] = slot["updated"], self.decode_slot_data(slot["data"])
+        self.relay_epoch = resp.get("epoch", "")
+        self.relay_version = resp.get("version", 0)
+        return slots
 
     def receive(self, nodename):
         request = {
@@ -202,9 +309,5 @@ class HbRelayRx(HbRelay):
             raise ex.Error("no data in response reading relay slot %s" % nodename)
         if resp.get("updated") is None:
             raise ex.Error("no 'updated' key in response reading relay slot %s" % nodename)
-        try:
-            # python3
-            return resp.get("updated"), bytes(resp["data"], "ascii")
-        except TypeError:
-            return resp.get("updated"), resp["data"]
+        return resp.get("updated"), self.decode_slot_data(resp["data"])
 
@@ -1,6 +1,7 @@
 """
 Unicast Heartbeat module
 """
+import select
 import sys
 import socket
 import threading
@@ -9,7 +10,11 @@ import time
 import foreign.six as six
 import core.exceptions as ex
 import daemon.shared as shared
+from daemon.profiler import RollingStats
+from daemon.workers import WorkerPool
+from core.comm import is_binary_message, binary_message_len, BINARY_MAGIC
 from env import Env
+from utilities.storage import Storage
 from .hb import Hb
 
 class HbUcast(Hb):
@@ -80,16 +85,27 @@ class HbUcast(Hb):
             self.config_change = True
             self.interval = interval
 
+        self.configure_tx_schedule()
+
         self.max_handlers = len(self.hb_nodes) * 4
 
 class HbUcastTx(HbUcast):
     """
     The unicast heartbeat tx class.
+
+    A persistent connection is kept open to each peer, and the messages
+    are sent to all peers concurrently by a pool of sender threads, so a
+    slow or unreachable peer does not delay the beats to the other peers.
+    A peer with a failing connection is retried with an exponential
+    backoff, capped to the hb timeout.
     """
     sock_tmo = 1.0
+    max_senders = 8
 
     def __init__(self, name):
         HbUcast.__init__(self, name, role="tx")
+        self.conns = {}
+        self.senders = WorkerPool(self.id, size=1, log=self.log)
 
     def run(self):
         self.set_tid()
@@ -102,54 +118,158 @@ class HbUcastTx(HbUcast):
             while True:
                 self.do()
                 if self.stopped():
+                    self.senders.stop()
+                    self.close_conns()
                     sys.exit(0)
-                with shared.HB_TX_TICKER:
-                    shared.HB_TX_TICKER.wait(self.interval)
+                self.tx_wait()
         except Exception as exc:
             self.log.exception(exc)
 
+    def _configure(self):
+        HbUcast._configure(self)
+        if not self.config_change:
+            return
+        self.config_change = False
+        self.close_conns()
+        self.senders.size = max(1, min(len(self.hb_nodes) - 1, self.max_senders))
+
     def status(self, **kwargs):
         data = HbUcast.status(self, **kwargs)
         data["config"] = {}
+        for nodename, conn in list(self.conns.items()):
+            if nodename not in data["peers"]:
+                continue
+            data["peers"][nodename].update({
+                "connected": conn.sock is not None,
+                "backoff": conn.backoff,
+                "send_latency": conn.latency.summary(),
+            })
         return data
 
+    def get_conn(self, nodename):
+        try:
+            return self.conns[nodename]
+        except KeyError:
+            conn = Storage({
+                "sock": None,
+                "backoff": 0,
+                "retry_at": 0,
+                "latency": RollingStats(),
+            })
+            self.conns[nodename] = conn
+            return conn
+
+    def close_conns(self):
+        for conn in self.conns.values():
+            self.close_conn(conn)
+
+    @staticmethod
+    def close_conn(conn):
+        if conn.sock is None:
+            return
+        try:
+            conn.sock.close()
+        except socket.error:
+            pass
+        conn.sock = None
+
     def do(self):
         self.janitor_procs()
         self.reload_config()
+        self.senders.completed()
         message, message_bytes = self.get_message()
         if message is None:
             return
 
+        if is_binary_message(message):
+            # the binary envelope is self-delimited
+            payload = message
+        else:
+            payload = (message+"\0").encode()
+        now = time.time()
         for nodename, config in self.peer_config.items():
             if nodename == Env.nodename:
                 continue
-            self._do(message, message_bytes, nodename, config)
+            conn = self.get_conn(nodename)
+            if now < conn.retry_at:
+                self.set_beating(nodename)
+                continue
+            if not self.senders.submit([nodename], self._do, payload, message_bytes, nodename, config):
+                # the previous send to this peer is still running
+                continue
 
-    def _do(self, message, message_bytes, nodename, config):
+    def _do(self, payload, message_bytes, nodename, config):
+        conn = self.get_conn(nodename)
+        begin = time.time()
         try:
-            #self.log.info("sending to %s:%s", config["addr"], config["port"])
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.sock_tmo)
-            sock.bind((self.peer_config[Env.nodename]["addr"], 0))
-            sock.connect((config["addr"], config["port"]))
-            sock.sendall((message+"\0").encode())
+            self.send(conn, payload, config)
+            conn.latency.add(time.time() - begin)
+            conn.backoff = 0
+            conn.retry_at = 0
             self.set_last(nodename)
             self.push_stats(message_bytes)
         except socket.timeout as exc:
-            self.push_stats()
+            self.send_failed(conn)
             if self.get_last(nodename).success:
                 self.log.warning("send to %s (%s:%d) timeout", nodename,
                                  config["addr"], config["port"])
             self.set_last(nodename, success=False)
         except socket.error as exc:
-            self.push_stats()
+            self.send_failed(conn)
             if self.get_last(nodename).success:
                 self.log.warning("send to %s (%s:%d) error: %s", nodename,
                                  config["addr"], config["port"], str(exc))
             self.set_last(nodename, success=False)
         finally:
             self.set_beating(nodename)
+
+    def send_failed(self, conn):
+        self.push_stats()
+        self.close_conn(conn)
+        conn.backoff = min(max(2 * conn.backoff, self.interval), max(self.timeout, self.interval))
+        conn.retry_at = time.time() + conn.backoff
+
+    def send(self, conn, payload, config):
+        if conn.sock is not None and self.peer_closed(conn.sock):
+            self.close_conn(conn)
+        if conn.sock is not None:
+            try:
+                conn.sock.sendall(payload)
+                return
+            except socket.error:
+                # the peer may have closed the connection since our last
+                # send. retry once on a new connection.
+                self.close_conn(conn)
+        conn.sock = self.connect(config)
+        conn.sock.sendall(payload)
+
+    def connect(self, config):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.sock_tmo)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.bind((self.peer_config[Env.nodename]["addr"], 0))
+            sock.connect((config["addr"], config["port"]))
+        except Exception:
             sock.close()
+            raise
+        return sock
+
+    @staticmethod
+    def peer_closed(sock):
+        """
+        Return True if the peer closed the connection. The rx never sends
+        data, so a readable socket means the peer closed or reset it, like
+        the rx of older agents do after reading the first message.
+        """
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(4096) == six.b("")
+        except (socket.error, ValueError):
+            return True
 
 class HbUcastRx(HbUcast):
     """
@@ -219,8 +339,9 @@ class HbUcastRx(HbUcast):
         finally:
             self.set_peers_beating()
         if len(self.threads) >= self.max_handlers:
-            self.log.warning("drop message received from %s: too many running handlers (%d)",
+            self.log.warning("drop connection from %s: too many running handlers (%d)",
                              addr, self.max_handlers)
+            conn.close()
             return
         try:
             thr = threading.Thread(target=self.handle_client, args=(conn, addr))
@@ -237,19 +358,54 @@ class HbUcastRx(HbUcast):
             conn.close()
 
     def _handle_client(self, conn, addr):
-        chunks = []
-        buff_size = 4096
-        while True:
-            chunk = conn.recv(buff_size)
-            if chunk:
-                chunks.append(chunk)
-            if not chunk or chunk.endswith(b"\x00"):
+        """
+        Read the messages sent through the connection, until the peer
+        closes it, the connection stays idle for longer than the hb timeout,
+        or the thread is stopped.
+
+        The binary envelopes are delimited by the length in their header,
+        the legacy json messages are nul-terminated.
+        """
+        conn.settimeout(self.sock_recv_tmo)
+        buff = bytearray()
+        buff_size = 65536
+        scanned = 0
+        idle = 0
+        while not self.stopped():
+            try:
+                chunk = conn.recv(buff_size)
+            except socket.timeout:
+                idle += self.sock_recv_tmo
+                if idle >= max(self.timeout, self.sock_recv_tmo):
+                    break
+                continue
+            if not chunk:
                 break
-        data = six.b("").join(chunks)
+            received = time.time()
+            idle = 0
+            buff += chunk
+            while buff:
+                if buff[:len(BINARY_MAGIC)] == BINARY_MAGIC[:len(buff)]:
+                    # binary envelope, or the beginning of one
+                    length = binary_message_len(buff)
+                    if length is None or len(buff) < length:
+                        break
+                    self.handle_message(bytes(buff[:length]), addr, received)
+                    del buff[:length]
+                    continue
+                idx = buff.find(b"\0", scanned)
+                if idx < 0:
+                    scanned = len(buff)
+                    break
+                self.handle_message(bytes(buff[:idx]), addr, received)
+                del buff[:idx+1]
+                scanned = 0
+        if buff and not is_binary_message(buff):
+            self.handle_message(bytes(buff), addr, received)
+
+    def handle_message(self, data, addr, received=None):
         self.push_stats(len(data))
-        del chunks
-
-        clustername, nodename, data = self.decrypt(data, sender_id=addr[0])
+        clustername, nodename, data = self.decrypt(data, sender_id=addr[0], received=received)
         if clustername != self.cluster_name:
             return
         if nodename is None or nodename == Env.nodename:
@@ -0,0 +1,303 @@
+"""
+Change tracking structures.
+
+The Journal records the key paths changed in the local node dataset, so
+the monitor can build the generation patch sent to the peers from the
+changed subtrees only, instead of diffing and copying the whole dataset on
+each loop.
+
+The DirtyPaths set records the objects with a changed configuration or
+status file, so the monitor only rescans these objects.
+
+The coalesce() function merges consecutive generation patches into one,
+so a lagging peer receives each changed path once.
+"""
+import json
+import threading
+
+import foreign.json_delta as json_delta
+
+MISSING = object()
+
+
+def copy(data):
+    """
+    Return a deep copy of a json-serializable structure.
+    """
+    return json.loads(json.dumps(data))
+
+
+def get_path(data, path):
+    """
+    Return the value at <path> in <data>, or MISSING if the path does not
+    exist.
+    """
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return MISSING
+    return data
+
+
+def set_path(data, path, value):
+    """
+    Set <value> at <path> in <data>. The parent of <path> must exist.
+    """
+    get_path(data, path[:-1])[path[-1]] = value
+
+
+def del_path(data, path):
+    try:
+        del get_path(data, path[:-1])[path[-1]]
+    except (KeyError, IndexError, TypeError):
+        pass
+
+
+def reduce_paths(paths):
+    """
+    Return the sorted list of <paths> not descending from another path of
+    the set.
+    """
+    kept = set()
+    for path in sorted(paths, key=len):
+        if any(path[:idx] in kept for idx in range(len(path))):
+            continue
+        kept.add(path)
+    return sorted(kept)
+
+
+class Journal(object):
+    """
+    A thread-safe set of the key paths changed in a dataset since the last
+    pop().
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._paths = set()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, path):
+        with self._lock:
+            self._paths.add(tuple(path))
+
+    def set(self, data, path, value, itemized=False):
+        """
+        Set <value> at <path> in <data> and record the path if the value
+        changed.
+
+        With <itemized>, <value> and the current value being dicts, record
+        the changed, added and removed keys paths instead of <path>.
+        """
+        path = tuple(path)
+        current = get_path(data, path)
+        if itemized and isinstance(current, dict) and isinstance(value, dict):
+            with self._lock:
+                for key, val in value.items():
+                    if key not in current or current[key] != val:
+                        self._paths.add(path + (key,))
+                for key in current:
+                    if key not in value:
+                        self._paths.add(path + (key,))
+        elif current is MISSING or current != value:
+            self.add(path)
+        set_path(data, path, value)
+
+    def delete(self, data, path):
+        path = tuple(path)
+        if get_path(data, path) is MISSING:
+            return
+        del_path(data, path)
+        self.add(path)
+
+    def peek(self):
+        """
+        Return the reduced list of recorded paths, without forgetting them.
+        """
+        with self._lock:
+            paths = set(self._paths)
+        return reduce_paths(paths)
+
+    def pop(self):
+        """
+        Return and forget the reduced list of recorded paths.
+        """
+        with self._lock:
+            paths = self._paths
+            self._paths = set()
+        return reduce_paths(paths)
+
+    def clear(self):
+        with self._lock:
+            self._paths = set()
+
+
+def is_dict_path(path):
+    """
+    Return True if no key of <path> is a list index.
+    """
+    return not any(isinstance(key, int) for key in path)
+
+
+def coalesce(patches):
+    """
+    Merge the consecutive json_delta <patches> into one patch, where:
+
+    * a change of a path drops the previous changes of this path and of
+      its descendants,
+    * a change of a path descending from a path set by a previous change
+      is folded into the value of this previous change.
+
+    Return None if the patches can not be coalesced, because a change
+    addresses a list item (the list item indexes shift on insertions and
+    deletions) or the dataset root.
+
+    The coalesced patch only contains dict key sets and deletions, so it
+    is applied with patch() to the dataset at any generation of the
+    coalesced range, not only to the dataset at the range start.
+    """
+    entries = []
+    sets = {}
+    for _patch in patches:
+        for stanza in _patch:
+            path = tuple(stanza[0])
+            if not path or not is_dict_path(path):
+                return
+            for idx in range(len(path) - 1, 0, -1):
+                entry = sets.get(path[:idx])
+                if entry is None:
+                    continue
+                if not entry["copied"]:
+                    entry["value"] = copy(entry["value"])
+                    entry["copied"] = True
+                rel = path[idx:]
+                if len(stanza) == 1:
+                    del_path(entry["value"], rel)
+                    break
+                parent = get_path(entry["value"], rel[:-1])
+                if not isinstance(parent, dict):
+                    return
+                parent[rel[-1]] = copy(stanza[1])
+                break
+            else:
+                size = len(path)
+                entries = [entry for entry in entries if entry["path"][:size] != path]
+                for key in [key for key in sets if key[:size] == path]:
+                    del sets[key]
+                entry = {"path": path, "copied": False}
+                if len(stanza) > 1:
+                    entry["value"] = stanza[1]
+                    sets[path] = entry
+                entries.append(entry)
+    coalesced = []
+    for entry in entries:
+        if "value" in entry:
+            coalesced.append([list(entry["path"]), entry["value"]])
+        else:
+            coalesced.append([list(entry["path"])])
+    return coalesced
+
+
+def patch(data, stanzas):
+    """
+    Apply the coalesced patch <stanzas> to <data>. Deleting a missing key
+    is a no-op, setting a key of a missing parent raises KeyError.
+    """
+    for stanza in stanzas:
+        path = stanza[0]
+        if len(stanza) == 1:
+            del_path(data, path)
+            continue
+        parent = get_path(data, path[:-1])
+        if not isinstance(parent, dict):
+            raise KeyError("no dict at %s" % ".".join(path[:-1]))
+        parent[path[-1]] = stanza[1]
+
+
+class DirtyPaths(object):
+    """
+    A thread-safe set of object paths changed since the last pop(), fed by
+    a tracker. While no tracker is active, or after the tracker lost events,
+    pop() returns None, meaning all objects must be rescanned.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._paths = set()
+        self._tracked = False
+        self._full = True
+
+    def track(self, value=True):
+        """
+        Declare a tracker is active or not. In both cases, the next pop()
+        asks for a full rescan.
+        """
+        with self._lock:
+            self._tracked = value
+            self._full = True
+            self._paths = set()
+
+    def add(self, path):
+        with self._lock:
+            self._paths.add(path)
+
+    def invalidate(self):
+        """
+        Ask for a full rescan on the next pop().
+        """
+        with self._lock:
+            self._full = True
+
+    def pop(self):
+        """
+        Return and forget the set of changed paths, or None if all objects
+        must be rescanned.
+        """
+        with self._lock:
+            paths = self._paths
+            full = self._full or not self._tracked
+            self._paths = set()
+            self._full = False
+        if full:
+            return
+        return paths
+
+
+def diff(last, data, paths):
+    """
+    Return the json_delta diff of the <paths> subtrees of <data> against
+    the same subtrees of <last>, and refresh <last> with copies of these
+    subtrees.
+    """
+    patch = []
+    done = set()
+    for path in paths:
+        # a change at a path whose parent is missing on either side is
+        # sent as a change of the nearest common ancestor.
+        while len(path) > 1 and (get_path(last, path[:-1]) is MISSING or
+                                 get_path(data, path[:-1]) is MISSING):
+            path = path[:-1]
+        if any(path[:idx] in done for idx in range(len(path) + 1)):
+            continue
+        done.add(path)
+        old = get_path(last, path)
+        new = get_path(data, path)
+        if new is MISSING:
+            if old is MISSING:
+                continue
+            del_path(last, path)
+            patch.append([list(path)])
+            continue
+        if old is MISSING:
+            set_path(last, path, copy(new))
+            patch.append([list(path), copy(new)])
+            continue
+        for change in json_delta.diff(old, new, verbose=False,
+                                      array_align=False,
+                                      compare_lengths=False):
+            change[0] = list(path) + change[0]
+            patch.append(change)
+        set_path(last, path, copy(new))
+    # the json_delta changes may reference live data structures
+    return copy(patch)
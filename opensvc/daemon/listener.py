@@ -2,6 +2,8 @@
 Listener Thread
 """
 import base64
+import collections
+import hashlib
 import importlib
 import json
 import os
@@ -10,6 +12,7 @@ import sys
 import socket
 import logging
 import time
+import threading
 import select
 import shutil
 import traceback
@@ -31,6 +34,11 @@ try:
 except Exception:
     has_ssl = False
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
 try:
     import foreign.jwt as jwt
     from foreign.jwt.algorithms import RSAAlgorithm
@@ -40,11 +48,13 @@ except Exception:
 
 import foreign.six as six
 import daemon.shared as shared
+import daemon.snapshot as snapshot
 import core.exceptions as ex
 from foreign.six.moves import queue
 from env import Env
 from utilities.storage import Storage
 from core.comm import Headers
+from daemon.workers import WorkerPool
 from utilities.chunker import chunker
 from utilities.naming import split_path, fmt_path, factory, split_fullname
 from utilities.files import makedirs
@@ -103,6 +113,9 @@ class Listener(shared.OsvcThread):
     port = -1
     addr = ""
     handlers = {}
+    io_mode = "thread"
+    selector = None
+    workers = None
 
     @lazy
     def certfs(self):
@@ -111,6 +124,13 @@ class Listener(shared.OsvcThread):
         set_lazy(res, "log",  self.log)
         return res
 
+    @lazy
+    def auth_cache(self):
+        return AuthCache(
+            size=shared.NODE.oget("listener", "auth_cache_size"),
+            ttl=shared.NODE.oget("listener", "auth_cache_ttl"),
+        )
+
     @lazy
     def ca(self):
         secpath = shared.NODE.oget("cluster", "ca")
@@ -244,9 +264,13 @@ class Listener(shared.OsvcThread):
         self.last_relay_janitor = 0
         self.log = logging.LoggerAdapter(logging.getLogger(Env.nodename+".osvcd.listener"), {"node": Env.nodename, "component": self.name})
         self.events_clients = []
+        self.sessions = {}
+        self.deferred = []
+        self.deferred_sids = set()
         self.stats = Storage({
             "sessions": Storage({
                 "accepted": 0,
+                "busy": 0,
                 "auth_validated": 0,
                 "tx": 0,
                 "rx": 0,
@@ -257,6 +281,7 @@ class Listener(shared.OsvcThread):
 
         self.register_handlers()
         self.setup_socks()
+        self.configure_io()
 
         while True:
             try:
@@ -269,6 +294,7 @@ class Listener(shared.OsvcThread):
             if self.stopped():
                 for sock in self.sockmap.values():
                     sock.close()
+                self.stop_sessions()
                 self.join_threads()
                 if Env.sysname == "Linux":
                     self.certfs.stop()
@@ -281,10 +307,53 @@ class Listener(shared.OsvcThread):
             "port": self.port,
             "addr": self.addr,
         }
+        data["io"] = {
+            "mode": self.io_mode,
+        }
+        data["auth_cache"] = self.auth_cache.status()
+        if self.workers:
+            data["io"].update({
+                "sessions": len(self.sessions),
+                "deferred": len(self.deferred),
+                "workers": self.workers.status(),
+            })
         return data
 
+    def configure_io(self):
+        """
+        Setup the selector, its wakeup socket pair and the handler
+        threads pool if the io mode is "selector".
+        """
+        self.io_mode = shared.NODE.oget("listener", "io_mode")
+        if self.io_mode == "selector" and selectors is None:
+            self.log.info("selectors module not available. fallback to thread io mode")
+            self.io_mode = "thread"
+        if self.io_mode != "selector":
+            return
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, "wakeup")
+        self.workers = WorkerPool(
+            self.name,
+            size=shared.NODE.oget("listener", "workers"),
+            queue_size=shared.NODE.oget("listener", "queue_size"),
+            on_done=self.wakeup,
+            log=self.log,
+        )
+        self.log.info("selector io mode, %d handler threads", self.workers.size)
+
+    def wakeup(self):
+        try:
+            self.wakeup_w.send(b"\0")
+        except socket.error:
+            # the wakeup is already pending
+            pass
+
     def reconfigure(self):
         shared.NODE.listener = self
+        unset_lazy(self, "auth_cache")
         unset_lazy(self, "ca")
         unset_lazy(self, "cert")
         unset_lazy(self, "certfs")
@@ -346,58 +415,20 @@ class Listener(shared.OsvcThread):
             self.janitor_threads()
             self.janitor_events()
             self.janitor_relay()
-        self.last_janitors = ts
+            self.last_janitors = ts
+
+        if self.selector:
+            self.do_selector()
+            return
 
         fds = select.select([fno for fno in self.sockmap], [], [], self.sock_tmo)
         if self.sock_tmo and fds == ([], [], []):
             return
         for fd in fds[0]:
-            sock = self.sockmap[fd]
-            try:
-                conn = None
-                conn, addr = sock.accept()
-                self.stats.sessions.accepted += 1
-                if fd == self.sockux.fileno():
-                    tls = False
-                    addr = ["local"]
-                    scheme = "raw"
-                    encrypted = False
-                elif fd == self.sockuxh2.fileno():
-                    tls = False
-                    addr = ["local"]
-                    scheme = "h2"
-                    encrypted = False
-                elif fd == self.sock.fileno():
-                    scheme = "raw"
-                    tls = False
-                    encrypted = True
-                elif fd == self.tls_sock.fileno():
-                    scheme = "h2"
-                    tls = True
-                    encrypted = False
-                else:
-                    print("bug")
-                    continue
-                if addr[0] not in self.stats.sessions.clients:
-                    self.stats.sessions.clients[addr[0]] = Storage({
-                        "accepted": 0,
-                        "auth_validated": 0,
-                        "tx": 0,
-                        "rx": 0,
-                    })
-                self.stats.sessions.clients[addr[0]].accepted += 1
-                #self.log.info("accept %s", str(addr))
-            except socket.timeout:
-                continue
-            except ConnectionAbortedError:
-                if conn:
-                    conn.close()
-                continue
-            except Exception as exc:
-                self.log.exception(exc)
-                if conn:
-                    conn.close()
+            accepted = self.accept(fd)
+            if accepted is None:
                 continue
+            conn, addr, encrypted, scheme, tls = accepted
             try:
                 thr = ClientHandler(self, conn, addr, encrypted, scheme, tls, self.tls_context)
                 thr.start()
@@ -406,6 +437,203 @@ class Listener(shared.OsvcThread):
                 self.log.warning(exc)
                 conn.close()
 
+    def accept(self, fd):
+        """
+        Accept a connection on the <fd> listening socket, and return the
+        connection, the client address, and the encrypted, scheme and tls
+        settings of the socket. Return None on error.
+        """
+        sock = self.sockmap[fd]
+        try:
+            conn = None
+            conn, addr = sock.accept()
+            self.stats.sessions.accepted += 1
+            if fd == self.sockux.fileno():
+                tls = False
+                addr = ["local"]
+                scheme = "raw"
+                encrypted = False
+            elif fd == self.sockuxh2.fileno():
+                tls = False
+                addr = ["local"]
+                scheme = "h2"
+                encrypted = False
+            elif fd == self.sock.fileno():
+                scheme = "raw"
+                tls = False
+                encrypted = True
+            elif fd == self.tls_sock.fileno():
+                scheme = "h2"
+                tls = True
+                encrypted = False
+            else:
+                print("bug")
+                return
+            if addr[0] not in self.stats.sessions.clients:
+                self.stats.sessions.clients[addr[0]] = Storage({
+                    "accepted": 0,
+                    "auth_validated": 0,
+                    "tx": 0,
+                    "rx": 0,
+                })
+            self.stats.sessions.clients[addr[0]].accepted += 1
+            #self.log.info("accept %s", str(addr))
+        except socket.timeout:
+            return
+        except ConnectionAbortedError:
+            if conn:
+                conn.close()
+            return
+        except Exception as exc:
+            self.log.exception(exc)
+            if conn:
+                conn.close()
+            return
+        return conn, addr, encrypted, scheme, tls
+
+    def do_selector(self):
+        """
+        The "selector" io mode loop iteration.
+
+        The listening sockets, the idle client connections and the handler
+        threads completion notifications are multiplexed by the selector.
+        A readable client connection is unregistered from the selector
+        while a handler thread serves its data, and registered again when
+        the handler is done. The idle connections with pending events or
+        stream pushers are submitted to the handler threads too.
+        """
+        self.sync_listening_socks()
+        self.collect_sessions()
+        self.submit_deferred()
+        self.push_sessions()
+        for key, _ in self.selector.select(self.sock_tmo):
+            if key.data == "wakeup":
+                try:
+                    while self.wakeup_r.recv(4096):
+                        pass
+                except socket.error:
+                    pass
+            elif key.data == "listen":
+                self.accept_session(key.fd)
+            else:
+                self.dispatch(key.data, key.data.serve_data)
+
+    def sync_listening_socks(self):
+        """
+        Register the listening sockets in the selector, and unregister the
+        sockets closed by setup_socks().
+        """
+        registered = dict((key.fd, key) for key in list(self.selector.get_map().values()) if key.data == "listen")
+        for fd, key in registered.items():
+            if self.sockmap.get(fd) is not key.fileobj:
+                self.selector.unregister(key.fileobj)
+        for fd, sock in self.sockmap.items():
+            if fd not in registered or registered[fd].fileobj is not sock:
+                self.selector.register(sock, selectors.EVENT_READ, "listen")
+
+    def accept_session(self, fd):
+        accepted = self.accept(fd)
+        if accepted is None:
+            return
+        conn, addr, encrypted, scheme, tls = accepted
+        thr = ClientHandler(self, conn, addr, encrypted, scheme, tls, self.tls_context, pooled=True)
+        thr.open_session()
+        self.sessions[thr.sid] = thr
+        self.register_session(thr)
+
+    def dispatch(self, thr, fn):
+        """
+        Submit the <fn> io step of the <thr> session to the handler
+        threads. If the queue is full, defer the step of an established
+        session, and answer busy to a new session.
+        """
+        # unregister before submit: the handler thread may replace the
+        # connection socket by its tls wrapper
+        self.unregister_session(thr)
+        if self.workers.submit([thr.sid], thr.serve, fn):
+            return True
+        if fn != thr.serve_data:
+            self.register_session(thr)
+            return False
+        if thr.served:
+            self.deferred.append(thr)
+            self.deferred_sids.add(thr.sid)
+        else:
+            self.stats.sessions.busy += 1
+            thr.busy()
+            self.close_session(thr)
+        return False
+
+    def submit_deferred(self):
+        deferred = self.deferred
+        self.deferred = []
+        self.deferred_sids = set()
+        for idx, thr in enumerate(deferred):
+            if thr.sid not in self.sessions:
+                continue
+            if not self.workers.submit([thr.sid], thr.serve, thr.serve_data):
+                self.deferred += deferred[idx:]
+                self.deferred_sids.update(_thr.sid for _thr in self.deferred)
+                break
+
+    def push_sessions(self):
+        now = time.time()
+        for thr in list(self.sessions.values()):
+            if self.workers.is_pending(thr.sid) or thr.sid in self.deferred_sids:
+                continue
+            if thr.needs_push(now):
+                if not self.dispatch(thr, thr.push):
+                    break
+
+    def collect_sessions(self):
+        for keys, keep, _ in self.workers.completed():
+            for sid in keys:
+                thr = self.sessions.get(sid)
+                if thr is None:
+                    continue
+                if keep and not thr.stopped():
+                    self.register_session(thr)
+                else:
+                    self.close_session(thr)
+
+    def register_session(self, thr):
+        sock = thr.io_sock()
+        try:
+            self.selector.register(sock, selectors.EVENT_READ, thr)
+        except KeyError:
+            # already registered socket
+            self.selector.modify(sock, selectors.EVENT_READ, thr)
+        except (ValueError, OSError):
+            # closed socket
+            self.close_session(thr)
+
+    def unregister_session(self, thr):
+        try:
+            self.selector.unregister(thr.io_sock())
+        except (KeyError, ValueError):
+            pass
+
+    def close_session(self, thr):
+        self.unregister_session(thr)
+        self.sessions.pop(thr.sid, None)
+        thr.close_session()
+
+    def stop_sessions(self):
+        if not self.selector:
+            return
+        self.workers.stop()
+        for thr in list(self.sessions.values()):
+            thr.stop()
+            self.close_session(thr)
+        self.deferred = []
+        self.deferred_sids = set()
+        self.selector.close()
+
+    def client_alive(self, thr):
+        if thr.pooled:
+            return thr.sid in self.sessions
+        return thr in self.threads
+
     def janitor_crl(self):
         if not self.tls_sock:
             return
@@ -475,27 +703,51 @@ class Listener(shared.OsvcThread):
                 event = shared.EVENT_Q.get(False, 0)
             except queue.Empty:
                 break
+            if event and event.get("kind") == "patch":
+                self.auth_cache.invalidate_patch(event)
+            # the event is filtered and encoded once per group of
+            # subscribers with the same filtering fingerprint.
+            groups = {}
             to_remove = []
             for idx, thr in enumerate(self.events_clients):
-                if thr not in self.threads:
+                if not self.client_alive(thr):
                     to_remove.append(idx)
                     continue
-                fevent = self.filter_event(event, thr)
-                if fevent is None:
+                if thr.h2conn and not thr.events_stream_ids:
+                    to_remove.append(idx)
                     continue
-                # make a copy to avoid being replaced while queued
-                fevent = json.loads(json.dumps(fevent))
-                if thr.h2conn:
-                    if not thr.events_stream_ids:
-                        to_remove.append(idx)
-                        continue
-                thr.event_queue.put(fevent)
-            for idx in to_remove:
+                key = self.events_group_key(thr)
+                try:
+                    msg = groups[key]
+                except KeyError:
+                    fevent = self.filter_event(event, thr)
+                    if fevent is None:
+                        msg = None
+                    else:
+                        # freeze to avoid being modified while queued. the
+                        # frozen subtrees of the event are shared, not copied.
+                        msg = EventMessage(snapshot.freeze(fevent))
+                    groups[key] = msg
+                if msg is None:
+                    continue
+                thr.event_queue.put(msg)
+            for idx in reversed(to_remove):
                 try:
                     del self.events_clients[idx]
                 except IndexError:
                     pass
 
+    @staticmethod
+    def events_group_key(thr):
+        """
+        Return the fingerprint of the events filtering applied for the
+        <thr> subscriber: its selector, and its root grant or its
+        namespaces grants.
+        """
+        if thr.usr is False or "root" in thr.usr_grants:
+            return thr.selector, None
+        return thr.selector, frozenset(thr.get_namespaces())
+
     def filter_event(self, event, thr):
         if event is None:
             return
@@ -603,6 +855,7 @@ class Listener(shared.OsvcThread):
             #    print("ACCEPT", thr.usr.name if thr.usr else "", filtered_change)
             #else:
             #    print("DROP  ", thr.usr.name if thr.usr else "", change)
+        event = dict(event)
         event["data"] = changes
         return event
 
@@ -762,14 +1015,302 @@ class Listener(shared.OsvcThread):
         self.setup_sockux_h2()
 
 
+class PeerRequests(object):
+    """
+    The concurrent requests sent to the peers targeted by a multiplexed
+    request. At most <size> requests are in flight, and the result of a
+    peer not answering within <timeout> seconds is a timeout error.
+    """
+    def __init__(self, thr, nodenames, data, method, size=8, timeout=10):
+        self.thr = thr
+        self.nodenames = nodenames
+        self.size = max(1, min(size, len(nodenames)))
+        self.timeout = timeout
+        self.started = {}
+        self.done = threading.Event()
+        self.pool = WorkerPool("multiplex", size=self.size, queue_size=max(1, len(nodenames)),
+                               on_done=self.done.set, log=thr.log)
+        for nodename in nodenames:
+            self.pool.submit([nodename], self.request, nodename, dict(data), method)
+
+    def request(self, nodename, data, method):
+        self.started[nodename] = time.time()
+        return self.thr.daemon_request(data, server=nodename, silent=True, method=method, timeout=self.timeout)
+
+    def results(self):
+        """
+        Yield the (<nodename>, <result>, <latency>) of the peers as their
+        results arrive, and the timeout errors of the peers not answering
+        in time.
+        """
+        pending = set(self.nodenames)
+        begin = time.time()
+        # the deadline of the requests queued behind the in-flight requests
+        queued_deadline = begin + self.timeout * -(-len(self.nodenames) // self.size)
+        try:
+            while pending:
+                self.done.clear()
+                for keys, result, error in self.pool.completed():
+                    nodename = next(iter(keys))
+                    if nodename not in pending:
+                        # already reported as timed out
+                        continue
+                    pending.discard(nodename)
+                    if error is not None:
+                        result = {"status": 1, "error": str(error)}
+                    yield nodename, result, time.time() - self.started.get(nodename, begin)
+                now = time.time()
+                deadlines = {}
+                for nodename in pending:
+                    try:
+                        deadlines[nodename] = self.started[nodename] + self.timeout
+                    except KeyError:
+                        deadlines[nodename] = queued_deadline
+                for nodename, deadline in deadlines.items():
+                    if deadline > now:
+                        continue
+                    pending.discard(nodename)
+                    yield nodename, {"status": 1, "error": "timeout"}, now - self.started.get(nodename, begin)
+                if pending:
+                    self.done.wait(max(0, min(deadlines[nodename] for nodename in pending) - now))
+        finally:
+            # the workers of the timed out requests exit when done
+            self.pool.stop()
+
+
+class EventMessage(object):
+    """
+    A filtered event queued to a group of subscribers. Its encodings are
+    computed on first use, and shared by the subscribers.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.lock = threading.RLock()
+        self.encoded = {}
+
+    def encode(self, fmt, fn):
+        with self.lock:
+            try:
+                return self.encoded[fmt]
+            except KeyError:
+                pass
+            self.encoded[fmt] = fn()
+            return self.encoded[fmt]
+
+    def json(self):
+        return self.encode("json", lambda: json.dumps(self.data).encode())
+
+    def raw(self, thr):
+        """
+        Return the message to send to the <thr> raw protocol client.
+        """
+        if thr.encrypted:
+            return self.encode("encrypted", lambda: thr.encrypt(self.data))
+        return self.encode("raw", lambda: self.json() + b"\0")
+
+
+class LongPoll(object):
+    """
+    The pending result of a long-poll request, like GET /wait or GET /sync.
+
+    <check>(msg) is evaluated on each event queued to the <thr> subscriber,
+    and with a None msg when the queue is empty. It returns the request
+    result when the awaited condition is met, or None. <expire>() returns
+    the request result after <timeout> seconds.
+
+    A pooled handler parks the request: poll() is executed by a handler
+    thread each time the listener pushes the session, so the waiters don't
+    hold the handler threads. The other handlers block on wait().
+    """
+    def __init__(self, thr, check, expire, timeout):
+        self.thr = thr
+        self.check = check
+        self.expire = expire
+        self.deadline = time.time() + timeout
+
+    def poll(self, block=False):
+        """
+        Return the request result, or None if still pending. With <block>,
+        wait for the result.
+        """
+        while True:
+            left = self.deadline - time.time()
+            try:
+                if block and left > 0:
+                    msg = self.thr.event_queue.get(True, min(left, 3))
+                else:
+                    msg = self.thr.event_queue.get(False)
+            except queue.Empty:
+                msg = None
+            if isinstance(msg, EventMessage):
+                msg = msg.data
+            result = self.check(msg)
+            if result is not None:
+                return result
+            if msg is not None:
+                continue
+            if left <= 0:
+                return self.expire()
+            if not block:
+                return
+
+    def wait(self):
+        return self.poll(block=True)
+
+
+class AuthCache(object):
+    """
+    A LRU cache of the authenticated users and their parsed grants, so the
+    clients reconnecting with the same credentials, like a web ui polling
+    the daemon status, don't pay the user object instantiation and the
+    grants parsing on each new connection.
+
+    The entries are keyed by the credentials digest, and are valid for
+    <ttl> seconds if the user object configuration checksum is unchanged.
+    """
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.rules = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0}
+
+    @staticmethod
+    def digest(method, credentials):
+        if isinstance(credentials, six.text_type):
+            credentials = credentials.encode("utf-8")
+        return method + ":" + hashlib.sha256(credentials).hexdigest()
+
+    def get(self, key):
+        """
+        Return the <key> entry, or None if not cached or expired.
+        """
+        with self.lock:
+            try:
+                entry = self.entries[key]
+            except KeyError:
+                self.stats["misses"] += 1
+                return
+            if entry.expire < time.time():
+                del self.entries[key]
+                self.stats["misses"] += 1
+                return
+            # move to the most recently used end
+            del self.entries[key]
+            self.entries[key] = entry
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key, usr, grants, cf_sum, expire=None):
+        """
+        Cache the <usr> authenticated by the <key> credentials, and its
+        <grants>. The entry expires after the cache ttl, or at the <expire>
+        timestamp if sooner.
+        """
+        ttl_expire = time.time() + self.ttl
+        if expire is None or expire > ttl_expire:
+            expire = ttl_expire
+        entry = Storage(usr=usr, grants=grants, cf_sum=cf_sum, expire=expire)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats["invalidated"] += 1
+
+    def invalidate(self, path=None):
+        """
+        Drop the entries of the <path> user, or all entries if <path> is
+        not set.
+        """
+        with self.lock:
+            if path is None:
+                keys = list(self.entries)
+            else:
+                keys = [key for key, entry in self.entries.items() if entry.usr and entry.usr.path == path]
+            for key in keys:
+                del self.entries[key]
+            self.stats["invalidated"] += len(keys)
+
+    def invalidate_patch(self, event):
+        """
+        Drop the entries invalidated by the changes of a daemon status
+        patch <event>: the entries of the users whose configuration
+        changed, and all entries if objects are added or removed, as the
+        grants expanded on the existing namespaces may change.
+        """
+        prefix = ["monitor", "nodes", Env.nodename, "services", "config"]
+        for change in event.get("data", []):
+            key = list(change[0])
+            if key[:5] != prefix[:len(key)]:
+                continue
+            if len(key) <= 6:
+                self.invalidate()
+                return
+            if split_path(key[5])[2] == "usr":
+                self.invalidate(key[5])
+
+    def grant_rules(self, grants):
+        """
+        Return the parsed <grants> string, as a list of (<role>, <patterns>),
+        <patterns> being the compiled namespace patterns of a namespaced
+        role, or None for a cluster role.
+        """
+        with self.lock:
+            try:
+                return self.rules[grants]
+            except KeyError:
+                pass
+        rules = []
+        for _grant in grants.split():
+            if ":" in _grant:
+                role_sel, ns_sel = _grant.split(":", 1)
+                patterns = [re.compile(fnmatch.translate(ns)).match for ns in ns_sel.split(",")]
+                for role in role_sel.split(","):
+                    if role in Env.ns_roles:
+                        rules.append((role, patterns))
+            elif _grant in Env.cluster_roles:
+                rules.append((_grant, None))
+        with self.lock:
+            if len(self.rules) >= self.size:
+                self.rules.clear()
+            self.rules[grants] = rules
+        return rules
+
+    def status(self):
+        with self.lock:
+            data = dict(self.stats)
+            data["entries"] = len(self.entries)
+        return data
+
+
 class ClientHandler(shared.OsvcThread):
+    """
+    A client connection handler. In the listener "thread" io mode, the
+    handler runs as a thread serving the connection until closed. In the
+    "selector" io mode, the handler is not started as a thread: it is
+    <pooled>, and its serve_data() and push() io steps are executed by the
+    listener handler threads.
+    """
     sock_tmo = 5.0
+    push_interval = 1.0
 
-    def __init__(self, parent, conn, addr, encrypted, scheme, tls, tls_context):
+    def __init__(self, parent, conn, addr, encrypted, scheme, tls, tls_context, pooled=False):
         shared.OsvcThread.__init__(self)
         self.parent = parent
+        self.pooled = pooled
+        self.served = False
+        self.raw_events = False
+        self.long_poll = None
+        self.last_push = 0
         self.event_queue = None
         self.conn = conn
+        self.tls_conn = None
         self.addr = addr
         self.encrypted = encrypted
         self.scheme = scheme
@@ -780,6 +1321,7 @@ class ClientHandler(shared.OsvcThread):
         self.h2conn = None
         self.events_stream_ids = []
         self.usr_cf_sum = None
+        self.auth_expire = None
         self.same_auth = lambda h: False
         if scheme == "raw":
             self.usr = False
@@ -807,13 +1349,7 @@ class ClientHandler(shared.OsvcThread):
     def run(self):
         try:
             close = True
-            self.sid = str(uuid.uuid4())
-            self.parent.stats.sessions.alive[self.sid] = Storage({
-                "created": time.time(),
-                "addr": self.addr[0],
-                "encrypted": self.encrypted,
-                "progress": "init",
-            })
+            self.open_session()
             if self.scheme == "h2":
                 self.handle_h2_client()
             else:
@@ -822,25 +1358,154 @@ class ClientHandler(shared.OsvcThread):
             pass
         except DontClose:
             close = False
-        except (OSError, socket.error) as exc:
-            if exc.errno in (0, ECONNRESET):
-                pass
-        except RuntimeError as exc:
-            self.log.error("%s", exc)
         except Exception as exc:
-            try:
-                ignore = exc.errno == 0
-            except AttributeError:
-                ignore = False
-            if not ignore:
-                self.log.error("unexpected: %s", exc)
-                traceback.print_exc()
+            self.log_exception(exc)
         finally:
             if close:
-                del self.parent.stats.sessions.alive[self.sid]
-                if self.h2conn:
-                    self.h2conn.close_connection()
-                self.conn.close()
+                self.close_session()
+
+    def open_session(self):
+        self.sid = str(uuid.uuid4())
+        self.parent.stats.sessions.alive[self.sid] = Storage({
+            "created": time.time(),
+            "addr": self.addr[0],
+            "encrypted": self.encrypted,
+            "progress": "init",
+        })
+
+    def close_session(self):
+        try:
+            del self.parent.stats.sessions.alive[self.sid]
+        except KeyError:
+            pass
+        if self.h2conn:
+            self.h2conn.close_connection()
+        if self.tls_conn is not None and self.tls_conn is not self.conn:
+            self.tls_conn.close()
+        self.conn.close()
+
+    def log_exception(self, exc):
+        if isinstance(exc, (OSError, socket.error)):
+            return
+        if isinstance(exc, RuntimeError):
+            self.log.error("%s", exc)
+            return
+        try:
+            ignore = exc.errno == 0
+        except AttributeError:
+            ignore = False
+        if not ignore:
+            self.log.error("unexpected: %s", exc)
+            traceback.print_exc()
+
+    def io_sock(self):
+        """
+        Return the socket to register in the listener selector.
+        """
+        if self.tls_conn is not None:
+            return self.tls_conn
+        return self.conn
+
+    def serve(self, fn):
+        """
+        Execute the <fn> io step of a pooled handler. Return True if the
+        connection must stay open.
+        """
+        try:
+            return fn()
+        except Close:
+            return False
+        except DontClose:
+            return True
+        except Exception as exc:
+            self.log_exception(exc)
+            return False
+
+    def serve_data(self):
+        """
+        Serve the data received on a pooled handler connection.
+        """
+        self.served = True
+        if self.scheme == "h2":
+            return self.serve_h2()
+        return self.serve_raw()
+
+    def serve_raw(self):
+        if self.raw_events or self.long_poll is not None:
+            # an events subscriber or a long-poll waiter only sends data
+            # to close the stream
+            try:
+                buff = self.conn.recv(4096)
+            except socket.error:
+                return False
+            return bool(buff) and not self.stopped()
+        self.handle_raw_client()
+        return self.raw_events or self.long_poll is not None
+
+    def serve_h2(self):
+        if self.h2conn is None:
+            if not self.h2_setup():
+                return False
+        elif not self.h2_recv():
+            return False
+        while self.tls_pending():
+            # decrypted data buffered in the ssl object is not signaled
+            # by the selector
+            if not self.h2_recv():
+                return False
+        self.h2_push()
+        return not self.stopped()
+
+    def tls_pending(self):
+        try:
+            return self.tls_conn.pending() > 0
+        except AttributeError:
+            return False
+
+    def needs_push(self, now):
+        """
+        Return True if a pooled handler has events to send, or stream
+        pushers or a long-poll not executed for <push_interval> seconds.
+        """
+        if self.event_queue is not None and not self.event_queue.empty():
+            return self.h2conn is not None or self.raw_events or self.long_poll is not None
+        if now < self.last_push + self.push_interval:
+            return False
+        if self.long_poll is not None:
+            return True
+        if self.h2conn is None:
+            return False
+        return any(stream.get("pushers") for stream in list(self.streams.values()))
+
+    def push(self):
+        """
+        Send the pending events and execute the stream pushers of an idle
+        pooled handler.
+        """
+        if self.h2conn:
+            self.h2_push()
+        elif self.long_poll is not None:
+            return self.raw_push_long_poll()
+        elif self.raw_events:
+            self.raw_flush_events()
+        return not self.stopped()
+
+    def busy(self):
+        """
+        Answer a 503 status to a new raw client the listener can not serve.
+        """
+        if self.scheme != "raw":
+            return
+        try:
+            self.conn.setblocking(False)
+            while self.conn.recv(65536):
+                pass
+        except socket.error:
+            pass
+        try:
+            self.raw_send_result({"status": 503, "error": "listener busy"})
+        except Exception:
+            pass
 
     def negotiate_tls(self):
         """
@@ -872,12 +1537,34 @@ class ClientHandler(shared.OsvcThread):
         if negotiated_protocol != "h2":
             raise RuntimeError("couldn't negotiate h2: %s" % negotiated_protocol)
 
-    def current_usr_cf_sum(self):
+    def current_usr_cf_sum(self, usr=None):
+        if usr is None:
+            usr = self.usr
         try:
-            return shared.CLUSTER_DATA[Env.nodename]["services"]["config"][self.usr.path]["csum"]
+            return shared.CLUSTER_DATA[Env.nodename]["services"]["config"][usr.path]["csum"]
         except:
             return "unknown"
 
+    def cached_auth(self, method, credentials, authenticate):
+        """
+        Return the (usr, grants, cf_sum) of the client authenticated by
+        <credentials>, from the listener auth cache if possible, else
+        using the <authenticate> function.
+        """
+        cache = self.parent.auth_cache
+        key = cache.digest(method, credentials)
+        entry = cache.get(key)
+        if entry:
+            if entry.cf_sum == self.current_usr_cf_sum(entry.usr):
+                return entry.usr, entry.grants, entry.cf_sum
+            cache.discard(key)
+        self.auth_expire = None
+        self.usr = authenticate()
+        grants = self.user_grants()
+        cf_sum = self.current_usr_cf_sum()
+        cache.put(key, self.usr, grants, cf_sum, expire=self.auth_expire)
+        return self.usr, grants, cf_sum
+
     def authenticate_client(self, headers):
         if self.usr is False:
             return
@@ -907,25 +1594,34 @@ class ClientHandler(shared.OsvcThread):
         authorization = headers.get("authorization")
         if authorization:
             if authorization.startswith("Bearer "):
-                self.usr = self.authenticate_client_jwt(authorization)
+                self.usr, self.usr_grants, self.usr_cf_sum = self.cached_auth(
+                    "jwt", authorization,
+                    lambda: self.authenticate_client_jwt(authorization)
+                )
                 self.usr_auth = "jwt"
-                self.usr_grants = self.user_grants()
                 self.last_auth = authorization
                 self.same_auth = lambda h: h.get("authorization") == self.last_auth
                 return
             elif authorization.startswith("Basic "):
-                self.usr = self.authenticate_client_basic(authorization)
+                self.usr, self.usr_grants, self.usr_cf_sum = self.cached_auth(
+                    "basic", authorization,
+                    lambda: self.authenticate_client_basic(authorization)
+                )
                 self.usr_auth = "basic"
-                self.usr_grants = self.user_grants()
-                self.usr_cf_sum = self.current_usr_cf_sum()
                 self.last_auth = authorization
                 self.same_auth = lambda h: h.get("authorization") == self.last_auth
                 return
         try:
-            self.usr = self.authenticate_client_x509()
+            cert = self.tls_conn.getpeercert(binary_form=True)
+            if cert:
+                self.usr, self.usr_grants, self.usr_cf_sum = self.cached_auth(
+                    "x509", cert, self.authenticate_client_x509
+                )
+            else:
+                self.usr = self.authenticate_client_x509()
+                self.usr_grants = self.user_grants()
+                self.usr_cf_sum = self.current_usr_cf_sum()
             self.usr_auth = "x509"
-            self.usr_grants = self.user_grants()
-            self.usr_cf_sum = self.current_usr_cf_sum()
             #self.log.info("loaded grants for %s, conf %s", self.usr.path, self.usr_cf_sum)
             self.last_auth = None
             self.same_auth = lambda h: h.get(Headers.secret) is None and h.get("authorization") is None
@@ -980,6 +1676,7 @@ class ClientHandler(shared.OsvcThread):
         algorithm = header['alg']
         public_key = self.jwt_provider_keys[key_id]
         decoded = jwt.decode(token, public_key, audience=self.cluster_name, algorithms=algorithm)
+        self.auth_expire = decoded.get("exp")
         grant = decoded.get("grant", "")
         if isinstance(grant, list):
             grant = " ".join(grant)
@@ -1036,7 +1733,9 @@ class ClientHandler(shared.OsvcThread):
                 ('Connection', 'keep-alive'),
                 ('Transfer-Encoding', 'chunked'),
             ]
-        if "json" in content_type:
+        if isinstance(data, EventMessage):
+            data = data.json()
+        elif "json" in content_type:
             if data is None:
                 data = {}
             data = json.dumps(data).encode()
@@ -1209,8 +1908,7 @@ class ClientHandler(shared.OsvcThread):
             "outbound": b'',
         }
         if event.stream_ended:
-            status, content_type, data = self.h2_router(stream_id)
-            self.prepare_response(stream_id, status, data, content_type)
+            self.h2_respond(stream_id)
 
     def h2_data_received(self, event):
         self.streams[event.stream_id]["data"] += event.data
@@ -1218,8 +1916,25 @@ class ClientHandler(shared.OsvcThread):
         self.streams[event.stream_id]["stream_ended"] = event.stream_ended
         if not event.stream_ended:
             return
-        status, content_type, data = self.h2_router(event.stream_id)
-        self.prepare_response(event.stream_id, status, data, content_type)
+        self.h2_respond(event.stream_id)
+
+    def h2_respond(self, stream_id):
+        status, content_type, data = self.h2_router(stream_id)
+        if isinstance(data, LongPoll):
+            # parked: the response is sent by the stream pusher
+            self.streams[stream_id]["pushers"].append({
+                "fn": "h2_push_long_poll",
+                "args": [data],
+            })
+            return
+        self.prepare_response(stream_id, status, data, content_type)
+
+    def h2_push_long_poll(self, stream_id, long_poll):
+        result = long_poll.poll()
+        if result is None:
+            return
+        self.streams[stream_id]["pushers"] = []
+        self.prepare_response(stream_id, 200, result)
 
     def h2_stream_ended(self, event):
         pass
@@ -1264,7 +1979,11 @@ class ClientHandler(shared.OsvcThread):
             elif isinstance(event, h2.events.ConnectionTerminated):
                 self.stop()
 
-    def handle_h2_client(self):
+    def h2_setup(self):
+        """
+        Negotiate tls if needed, and initiate the h2 connection. Return
+        False if the client is already gone.
+        """
         self.negotiate_tls()
         self.tls_conn.settimeout(self.sock_tmo)
 
@@ -1277,54 +1996,72 @@ class ClientHandler(shared.OsvcThread):
         except socket.error as exc:
             if exc.errno == EPIPE:
                 # daemon restart with connected clients
-                return
+                return False
             raise
+        return True
 
+    def h2_recv(self):
+        """
+        Receive and process the client data. Return False if the
+        connection is closed.
+        """
+        try:
+            data = self.tls_conn.recv(65535)
+            if not data:
+                return False
+            self.parent.stats.sessions.rx += len(data)
+            self.parent.stats.sessions.clients[self.addr[0]].rx += len(data)
+            self.h2_received(data)
+        except ssl.SSLError:
+            pass
+        except socket.timeout:
+            pass
+        except socket.error as exc:
+            if exc.errno in (0, ECONNRESET):
+                return True
+            self.log.error("%s", exc)
+            return False
+        except h2.exceptions.StreamClosedError:
+            return False
+        except ConnectionResetError:
+            return False
+        except Exception as exc:
+            self.log.error("exit on %s %s", type(exc), exc)
+            traceback.print_exc()
+            return False
+        return True
+
+    def h2_push(self):
+        """
+        Execute all registered pushers, and send the pending data.
+        """
+        self.last_push = time.time()
+        pushers_per_stream = [(stream_id, stream.get("pushers", [])) for stream_id, stream in self.streams.items() if stream.get("pushers")]
+        for stream_id, pushers in pushers_per_stream:
+            for pusher in pushers:
+                fn = pusher.get("fn")
+                args = pusher.get("args", [])
+                kwargs = pusher.get("kwargs", {})
+                if not fn:
+                    continue
+                try:
+                    getattr(self, fn)(stream_id, *args, **kwargs)
+                except Exception as exc:
+                    print(exc)
+
+        data_to_send = self.h2conn.data_to_send()
+        if data_to_send:
+            self.tls_conn.sendall(data_to_send)
+
+    def handle_h2_client(self):
+        if not self.h2_setup():
+            return
         while True:
             if self.stopped():
                 break
-            try:
-                data = self.tls_conn.recv(65535)
-                if not data:
-                    break
-                self.parent.stats.sessions.rx += len(data)
-                self.parent.stats.sessions.clients[self.addr[0]].rx += len(data)
-                self.h2_received(data)
-            except ssl.SSLError:
-                pass
-            except socket.timeout:
-                pass
-            except socket.error as exc:
-                if exc.errno in (0, ECONNRESET):
-                    continue
-                self.log.error("%s", exc)
-                return
-            except h2.exceptions.StreamClosedError:
-                return
-            except ConnectionResetError:
+            if not self.h2_recv():
                 return
-            except Exception as exc:
-                self.log.error("exit on %s %s", type(exc), exc)
-                traceback.print_exc()
-                return
-
-            # execute all registered pushers
-            pushers_per_stream = [(stream_id, stream.get("pushers", [])) for stream_id, stream in self.streams.items() if stream.get("pushers")]
-            for stream_id, pushers in pushers_per_stream:
-                for pusher in pushers:
-                    fn = pusher.get("fn")
-                    args = pusher.get("args", [])
-                    kwargs = pusher.get("kwargs", {})
-                    if not fn:
-                        continue
-                    try:
-                        getattr(self, fn)(stream_id, *args, **kwargs)
-                    except Exception as exc:
-                        print(exc)
-
-            data_to_send = self.h2conn.data_to_send()
-            if data_to_send:
-                self.tls_conn.sendall(data_to_send)
+            self.h2_push()
 
     def handle_raw_client(self):
         chunks = []
@@ -1400,6 +2137,10 @@ class ClientHandler(shared.OsvcThread):
         except Exception as exc:
             result = {"status": 500, "error": str(exc), "traceback": traceback.format_exc()}
             self.log.exception(exc)
+        if isinstance(result, LongPoll):
+            # parked: the result is sent by raw_push_long_poll()
+            self.long_poll = result
+            return
         self.raw_send_result(result)
 
     def raw_send_result(self, result):
@@ -1488,29 +2229,23 @@ class ClientHandler(shared.OsvcThread):
             return data
         if all_ns is None:
             all_ns = self.get_all_ns()
-        for _grant in grants.split():
-            if ":" in _grant:
-                role_sel, ns_sel = _grant.split(":", 1)
-                for role in role_sel.split(","):
-                    if role not in Env.ns_roles:
-                        continue
-                    if role not in data:
-                        data[role] = set()
-                    for ns in ns_sel.split(","):
-                        for _ns in all_ns:
-                            if fnmatch.fnmatch(_ns, ns):
-                                data[role].add(_ns)
-                                for equiv in Env.roles_equiv.get(role, ()):
-                                    if equiv not in data:
-                                        data[equiv] = set([_ns])
-                                    else:
-                                        data[equiv].add(_ns)
-            else:
-                role = _grant
-                if role not in Env.cluster_roles:
-                    continue
+        for role, patterns in self.parent.auth_cache.grant_rules(grants):
+            if patterns is None:
+                # cluster role
                 if role not in data:
                     data[role] = None
+                continue
+            if role not in data:
+                data[role] = set()
+            for _ns in all_ns:
+                if not any(match(_ns) for match in patterns):
+                    continue
+                data[role].add(_ns)
+                for equiv in Env.roles_equiv.get(role, ()):
+                    if equiv not in data:
+                        data[equiv] = set([_ns])
+                    else:
+                        data[equiv].add(_ns)
         # make sure all ns roles have a key, to avoid checking the key existance
         for role in Env.ns_roles:
             if role not in data:
@@ -1590,7 +2325,7 @@ class ClientHandler(shared.OsvcThread):
         except Exception:
             pass
         data["multiplexed"] = True # prevent multiplex at the peer endpoint
-        result = {"nodes": {}, "status": 0}
+        result = {"nodes": {}, "status": 0, "latencies": {}}
         path = self.options_path(options, required=False)
         if node == "ANY" and path:
             svcnodes = [n for n in shared.CLUSTER_DATA if shared.CLUSTER_DATA[n].get("services", {}).get("config", {}).get(path)]
@@ -1612,10 +2347,25 @@ class ClientHandler(shared.OsvcThread):
                 svcnodes = [n for n in shared.CLUSTER_DATA if shared.CLUSTER_DATA[n].get("services", {}).get("config", {}).get(path)]
                 nodenames = [n for n in nodenames if n in svcnodes]
 
+        def add_result(nodename, _result, latency):
+            result["nodes"][nodename] = _result
+            result["latencies"][nodename] = round(latency, 6)
+            try:
+                if nodename == Env.nodename:
+                    result["status"] += 1 if _result.get("status") else 0
+                else:
+                    result["status"] += _result.get("status", 0)
+            except AttributeError:
+                # result is not a dict
+                pass
+
         def do_node(nodename):
             if nodename == Env.nodename:
                 try:
                     _result = handler.action(nodename, action=action, options=options, stream_id=stream_id, thr=self)
+                    if isinstance(_result, LongPoll):
+                        # can't park a request merged with the peers results
+                        _result = _result.wait()
                 except ex.HTTP as exc:
                     status = exc.status
                     _result = {"status": exc.status, "error": exc.msg}
@@ -1626,35 +2376,37 @@ class ClientHandler(shared.OsvcThread):
                     status = 500
                     _result = {"status": status, "error": str(exc), "traceback": traceback.format_exc()}
                     self.log.exception(exc)
-                result["nodes"][nodename] = _result
-                try:
-                    result["status"] += 1 if _result.get("status") else 0
-                except AttributeError:
-                    # result is not a dict
-                    pass
             else:
-                if handler.stream:
-                    sp = self.socket_parms("https://"+nodename)
-                    client_stream_id, conn, resp = self.h2_daemon_stream_conn(data, sp=sp)
-                    self.streams[stream_id]["pushers"].append({
-                        "fn": "push_peer_stream",
-                        "args": [nodename, client_stream_id, conn, resp],
-                    })
-                    _result = {}
-                else:
-                    _result = self.daemon_request(data, server=nodename, silent=True, method=method)
-                result["nodes"][nodename] = _result
-                try:
-                    result["status"] += _result.get("status", 0)
-                except AttributeError:
-                    # result is not a dict
-                    pass
-
+                sp = self.socket_parms("https://"+nodename)
+                client_stream_id, conn, resp = self.h2_daemon_stream_conn(data, sp=sp)
+                self.streams[stream_id]["pushers"].append({
+                    "fn": "push_peer_stream",
+                    "args": [nodename, client_stream_id, conn, resp],
+                })
+                _result = {}
+            return _result
+
+        # the peer requests are sent concurrently, while the local
+        # node and the peer streams are served by this thread.
+        if handler.stream:
+            peers = []
+        else:
+            peers = [n for n in nodenames if n != Env.nodename]
+        requests = PeerRequests(
+            self, peers, data, method,
+            size=shared.NODE.oget("listener", "multiplex_workers"),
+            timeout=shared.NODE.oget("listener", "multiplex_timeout"),
+        )
         for nodename in nodenames:
+            if nodename in peers:
+                continue
+            begin = time.time()
             try:
-                do_node(nodename)
+                add_result(nodename, do_node(nodename), time.time() - begin)
             except Exception:
                 continue
+        for nodename, _result, latency in requests.results():
+            add_result(nodename, _result, latency)
 
         if handler.stream:
             return
@@ -1833,6 +2585,10 @@ class ClientHandler(shared.OsvcThread):
             self.h2_stream_send(stream_id, msg)
 
     def raw_push_action_events(self):
+        if self.pooled:
+            # the listener submits raw_flush_events() when events are queued
+            self.raw_events = True
+            return
         while True:
             if self.stopped():
                 break
@@ -1847,13 +2603,52 @@ class ClientHandler(shared.OsvcThread):
                 msg = self.event_queue.get(True, 1)
             except queue.Empty:
                 continue
+            self.raw_send_event(msg)
 
-            if self.encrypted:
-                msg = self.encrypt(msg)
-            else:
-                msg = self.msg_encode(msg)
+    def raw_push_long_poll(self):
+        """
+        Send the result of the parked long-poll request if ready. Return
+        True if the connection must stay open.
+        """
+        self.last_push = time.time()
+        result = self.long_poll.poll()
+        if result is None:
+            return not self.stopped()
+        self.long_poll = None
+        self.raw_send_result(result)
+        return False
 
-            self.conn.sendall(msg)
+    def long_poll_result(self, check, expire, timeout):
+        """
+        Return a LongPoll for a pooled handler to park the request, or the
+        awaited result.
+        """
+        if not self.event_queue:
+            self.event_queue = queue.Queue()
+        if self not in self.parent.events_clients:
+            self.parent.events_clients.append(self)
+        long_poll = LongPoll(self, check, expire, timeout)
+        if self.pooled:
+            return long_poll
+        return long_poll.wait()
+
+    def raw_flush_events(self):
+        self.conn.settimeout(self.sock_tmo)
+        while True:
+            try:
+                msg = self.event_queue.get(False)
+            except queue.Empty:
+                break
+            self.raw_send_event(msg)
+
+    def raw_send_event(self, msg):
+        if isinstance(msg, EventMessage):
+            msg = msg.raw(self)
+        elif self.encrypted:
+            msg = self.encrypt(msg)
+        else:
+            msg = self.msg_encode(msg)
+        self.conn.sendall(msg)
 
     def logskip(self, backlog, logfile):
         skip = 0
@@ -1940,9 +2735,12 @@ class ClientHandler(shared.OsvcThread):
 
     def h2_sse_stream_send(self, stream_id, data):
         self.events_counter += 1
-        msg = "id: %d\n" % self.events_counter
-        msg += "data: %s\n\n" % json.dumps(data)
-        self.streams[stream_id]["outbound"] += msg.encode()
+        if isinstance(data, EventMessage):
+            data = data.json()
+        else:
+            data = json.dumps(data).encode()
+        msg = ("id: %d\ndata: " % self.events_counter).encode() + data + b"\n\n"
+        self.streams[stream_id]["outbound"] += msg
         self.send_outbound(stream_id)
 
     def h2_stream_send(self, stream_id, data):
@@ -27,6 +27,7 @@ from .dns import Dns
 from .listener import Listener
 from .monitor import Monitor
 from .scheduler import Scheduler
+from .watcher import Watcher
 from core.node import Node
 from utilities.lazy import lazy, unset_lazy
 
@@ -210,6 +211,9 @@ class Daemon(object):
         self.log.info("%d capabilities:", len(caps))
         for cap in caps:
             self.log.info(" %s", cap)
+        count = shared.load_warm_snapshot(shared.NODE.cluster_nodes)
+        if count:
+            self.log.info("%d peer datasets loaded from the warm restart snapshot", count)
 
     def loop_forever(self):
         """
@@ -219,6 +223,7 @@ class Daemon(object):
         while self.loop():
             with DAEMON_TICKER:
                 DAEMON_TICKER.wait(DAEMON_INTERVAL)
+        self.save_warm_snapshot()
         self.log.info("daemon graceful stop")
 
     def loop(self):
@@ -228,6 +233,13 @@ class Daemon(object):
         self.start_threads()
         return True
 
+    def save_warm_snapshot(self):
+        try:
+            count = shared.save_warm_snapshot()
+            self.log.info("%d peer datasets saved in the warm restart snapshot", count)
+        except Exception as exc:
+            self.log.warning("failed to save the warm restart snapshot: %s", exc)
+
     def stats(self):
         now = time.time()
         if self.stats_data and now - self.last_stats_refresh < STATS_INTERVAL:
@@ -329,6 +341,8 @@ class Daemon(object):
             changed |= self.start_thread("listener", Listener)
         if shared.NODE and shared.NODE.collector_env.dbopensvc and self.need_start("collector"):
             changed |= self.start_thread("collector", Collector)
+        if self.need_start("watcher"):
+            changed |= self.start_thread("watcher", Watcher)
         if self.need_start("monitor"):
             changed |= self.start_thread("monitor", Monitor)
         if self.need_start("scheduler"):
@@ -13,7 +13,12 @@ import threading
 import time
 from itertools import chain
 
+import daemon.journal as journal
 import daemon.shared as shared
+from daemon.objcache import ObjectCache
+from daemon.profiler import PhaseProfiler
+from daemon.statusworker import StatusWorkers
+from daemon.workers import WorkerPool
 import foreign.json_delta as json_delta
 from core.freezer import Freezer
 from env import Env
@@ -571,6 +576,11 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
     monitor_period = 0.5
     arbitrators_check_period = 60
     max_shortloops = 30
+    full_rescan_interval = 60
+    config_sync_workers = 4
+    config_sync_queue_size = 16
+    config_sync_batch_size = 32
+    config_sync_multi_threshold = 3
     default_stdby_nb_restart = 2
     arbitrators_data = None
     last_arbitrator_ping = 0
@@ -580,6 +590,13 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         self._shutdown = False
         self.compat = True
         self.last_node_data = None
+        self.last_full_rescan = {}
+        self.agg_children = {}
+        self.agg_cluster_nodes = None
+        self.object_cache = ObjectCache()
+        self.profiler = PhaseProfiler()
+        self.init_status_paths = set()
+        self.init_status_proc = False
         self.init_steps = set()
 
     def init(self):
@@ -591,6 +608,16 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         self.shortloops = 0
         self.unfreeze_when_all_nodes_joined = False
         self.node_frozen = self.freezer.node_frozen()
+        self.config_sync_pool = WorkerPool(
+            "config sync",
+            size=self.config_sync_workers,
+            queue_size=self.config_sync_queue_size,
+            on_done=lambda: shared.wake_monitor("config sync done"),
+            log=self.log,
+        )
+        self.status_workers = self.new_status_workers()
+        shared.AGG_DIRTY.track()
+        shared.ORCH_DIRTY.track()
 
         shared.CLUSTER_DATA[Env.nodename] = {
             "compat": shared.COMPAT_VERSION,
@@ -640,6 +667,8 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             while True:
                 self.do()
                 if self.stopped():
+                    self.config_sync_pool.stop()
+                    self.status_workers.stop()
                     self.join_threads()
                     self.kill_procs()
                     sys.exit(0)
@@ -674,19 +703,21 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         The node config references may have changed, update the services objects.
         """
         shared.NODE.unset_lazy("labels")
-        shared.CLUSTER_DATA[Env.nodename]["labels"] = shared.NODE.labels
+        shared.LOCAL_DATA_JOURNAL.set(shared.CLUSTER_DATA[Env.nodename],
+                                      ["labels"], shared.NODE.labels)
         self.on_nodes_info_change()
         for path in [p for p in shared.SERVICES]:
+            # only rebuild the objects whose config references node
+            # keywords with changed values.
             try:
-                name, namespace, kind = split_path(path)
-                svc = factory(kind)(name, namespace, node=shared.NODE)
+                svc = self.object_cache.get(path, shared.NODE)
             except Exception as exc:
                 continue
             with shared.SERVICES_LOCK:
                 shared.SERVICES[path] = svc
 
     def do(self):
-        terminated = self.janitor_procs() + self.janitor_threads()
+        terminated = self.janitor_procs() + self.janitor_threads() + self.janitor_status_workers()
         changed = self.mon_changed()
         if shared.NMON_DATA.status == "init" and self.services_have_init_status():
             self.set_nmon(status="rejoin")
@@ -707,15 +738,22 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                 #    self.log.debug("%d. %s", idx, reason)
                 self.unset_mon_changed()
         self.shortloops = 0
-        self.reload_config()
+        with self.profiler.phase("loop"):
+            self.long_loop()
+        shared.wake_collector()
+
+    def long_loop(self):
+        with self.profiler.phase("reload_config"):
+            self.reload_config()
+        self.reconfigure_status_workers()
         if self._shutdown:
             if len(self.procs) == 0:
                 self.stop()
         else:
             self.update_cluster_data()
             self.orchestrator()
-        self.update_hb_data()
-        shared.wake_collector()
+        with self.profiler.phase("update_hb_data"):
+            self.update_hb_data()
 
     #########################################################################
     #
@@ -725,10 +763,15 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
     def sync_services_conf(self):
         """
         For each service, decide if we have an outdated configuration file
-        and fetch the most recent one if needed.
+        and submit the fetch of the most recent one to the config sync
+        workers, batching the paths to fetch from the same node.
         """
+        self.sync_services_conf_completed()
         confs = self.get_services_configs()
+        todo = {}
         for path, data in confs.items():
+            if self.config_sync_pool.is_pending(path):
+                continue
             new_service = False
             with shared.SERVICES_LOCK:
                 if path not in shared.SERVICES:
@@ -780,24 +823,73 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                    ref_nodename in shared.SERVICES[path].drpnodes:
                     # don't fetch drp config from prd nodes
                     continue
+            todo.setdefault(ref_nodename, []).append((path, new_service))
+        for nodename, paths in todo.items():
+            for idx in range(0, len(paths), self.config_sync_batch_size):
+                batch = paths[idx:idx+self.config_sync_batch_size]
+                if not self.config_sync_pool.submit([path for path, _ in batch],
+                                                    self.install_services_conf,
+                                                    nodename, batch):
+                    # queue full. retry on the next loop
+                    return
+
+    def sync_services_conf_completed(self):
+        """
+        Collect the config sync jobs completions, install the new objects
+        built by the workers, and rescan the installed objects
+        configuration and status.
+        """
+        for paths, svcs, error in self.config_sync_pool.completed():
+            if error:
+                self.log.error("config sync of %s failed: %s", ",".join(sorted(paths)), error)
+            if svcs:
+                with shared.SERVICES_LOCK:
+                    for path, svc in svcs.items():
+                        shared.SERVICES.setdefault(path, svc)
+            for path in paths:
+                shared.CONFIG_DIRTY.add(path)
+                shared.STATUS_DIRTY.add(path)
+
+    def install_services_conf(self, nodename, batch):
+        """
+        Fetch, validate and install from <nodename> the most recent config
+        of the objects in the <batch> list of (<path>, <new_service>), and
+        evaluate the installed instances status. Return the new objects
+        built, indexed by path, for the monitor thread to install in
+        shared.SERVICES.
+
+        Executed by a config sync worker.
+        """
+        for path, _ in batch:
             self.log.info("node %s has the most recent %s config",
-                          ref_nodename, path)
-            self.fetch_service_config(path, ref_nodename)
+                          nodename, path)
+        if len(batch) > self.config_sync_multi_threshold:
+            self.fetch_services_config([path for path, _ in batch], nodename)
+        else:
+            for path, _ in batch:
+                self.fetch_service_config(path, nodename)
+        svcs = {}
+        for path, new_service in batch:
             if new_service:
-                self.init_new_service(path)
+                svc = self.init_new_service(path)
+                if svc is not None:
+                    svcs[path] = svc
             else:
                 self.service_status_fallback(path)
+        return svcs
 
     def init_new_service(self, path):
-        name, namespace, kind = split_path(path)
+        """
+        Build, freeze and evaluate the status of a new object, and return
+        the object.
+        """
         try:
-            shared.SERVICES[path] = factory(kind)(name, namespace, node=shared.NODE)
+            svc = self.object_cache.get(path, shared.NODE)
         except Exception as exc:
             self.log.error("unbuildable service %s fetched: %s", path, exc)
             return
 
         try:
-            svc = shared.SERVICES[path]
             if svc.kind == "svc":
                 self.event("instance_freeze", {
                     "reason": "install",
@@ -805,11 +897,12 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                 })
                 Freezer(path).freeze()
             if not os.path.exists(svc.paths.cf):
-                return
+                return svc
             self.service_status_fallback(svc.path)
         except Exception:
             # can happen when deleting the service
             pass
+        return svc
 
     def fetch_service_config(self, path, nodename):
         """
@@ -823,6 +916,49 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             },
         }
         resp = self.daemon_get(req, server=nodename)
+        self.install_service_config(path, nodename, resp)
+
+    def fetch_services_config(self, paths, nodename):
+        """
+        Fetch and install the most recent configuration files of <paths>,
+        using a single request to the remote node listener. Fallback to
+        per-object requests if the remote node does not support the
+        batched request.
+        """
+        req = {
+            "action": "object_configs",
+            "options": {
+                "paths": paths,
+            },
+        }
+        resp = self.daemon_get(req, server=nodename)
+        if resp is None or resp.get("status") != 0 or not isinstance(resp.get("data"), dict):
+            self.log.info("unable to fetch %d services config from node %s "
+                          "in a single request: received %s. fallback to "
+                          "per-service requests", len(paths), nodename,
+                          resp.get("error") if isinstance(resp, dict) else resp)
+            for path in paths:
+                self.fetch_service_config(path, nodename)
+            return
+        for path in paths:
+            data = resp["data"].get(path)
+            if data and data.get("csum") and data["csum"] == self.get_local_config_csum(path):
+                # already installed
+                continue
+            self.install_service_config(path, nodename, data)
+
+    @staticmethod
+    def get_local_config_csum(path):
+        try:
+            return shared.CLUSTER_DATA[Env.nodename]["services"]["config"][path]["csum"]
+        except (KeyError, TypeError):
+            return
+
+    def install_service_config(self, path, nodename, resp):
+        """
+        Validate and install the service configuration file data fetched
+        from the remote node listener in <resp>.
+        """
         if resp is None:
             self.log.error("unable to fetch service %s config from node %s: "
                            "received %s", path, nodename, resp)
@@ -858,19 +994,22 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             if results["errors"] == 0:
                 dst = svc_pathcf(path)
                 makedirs(os.path.dirname(dst))
-                shutil.copy(filep.name, dst)
+                # install atomically, as the monitor thread may be reading
+                # the config file.
+                shutil.copy(filep.name, dst + ".tmp")
                 mtime = resp.get("mtime")
                 if mtime:
-                    os.utime(dst, (mtime, mtime))
+                    os.utime(dst + ".tmp", (mtime, mtime))
+                os.rename(dst + ".tmp", dst)
             else:
                 self.log.error("the service %s config fetched from node %s is "
                                "not valid", path, nodename)
                 return
             try:
+                svc = self.object_cache.get(path, shared.NODE)
                 with shared.SERVICES_LOCK:
-                    name, namespace, kind = split_path(path)
-                    shared.SERVICES[path] = factory(kind)(name, namespace, node=shared.NODE)
-                shared.SERVICES[path].postinstall()
+                    shared.SERVICES[path] = svc
+                svc.postinstall()
             except Exception as exc:
                 self.log.error("service %s postinstall failed: %s", path, exc)
         finally:
@@ -976,6 +1115,11 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         if smon.status and smon.status.endswith("ing"):
             # no need to run status, the running action will refresh the status earlier
             return
+        if self.status_workers.enabled and self.status_workers.refresh(path):
+            return
+        self.service_status_command(path)
+
+    def service_status_command(self, path):
         cmd = ["status", "--refresh", "--waitlock=0"]
         if self.has_proc(cmd):
             # no need to run status twice
@@ -1272,17 +1416,90 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             self.log.info("no objects to get an initial status from")
             return
         self.services_purge_status(paths=svcs)
-        proc = self.service_command(",".join(svcs), ["status", "--parallel", "--refresh"], local=False)
         self.add_init_step("boot")
+        if self.status_workers.enabled:
+            self.init_status_paths = set([path for path in svcs if self.status_workers.refresh(path)])
+            svcs = [path for path in svcs if path not in self.init_status_paths]
+            if not svcs:
+                return
+        proc = self.service_command(",".join(svcs), ["status", "--parallel", "--refresh"], local=False)
+        self.init_status_proc = True
         self.push_proc(
             proc=proc,
             cmd="init status",
-            on_success="add_init_step",
-            on_success_args=["status"],
-            on_error="add_init_step",
-            on_error_args=["status"],
+            on_success="init_status_done",
+            on_success_kwargs={"proc_done": True},
+            on_error="init_status_done",
+            on_error_kwargs={"proc_done": True},
+        )
+
+    def init_status_done(self, proc_done=False):
+        """
+        Add the status init step when both the status workers and the
+        status command are done evaluating the objects initial status.
+        """
+        if proc_done:
+            self.init_status_proc = False
+        if self.init_status_proc or self.init_status_paths:
+            return
+        self.add_init_step("status")
+
+    #########################################################################
+    #
+    # Status workers
+    #
+    #########################################################################
+    def new_status_workers(self):
+        return StatusWorkers(
+            size=self.status_workers_size,
+            queue_size=self.status_queue_size,
+            on_done=lambda: shared.wake_monitor("status eval done"),
+            log=self.log,
+            exists=lambda path: path in shared.SERVICES,
         )
 
+    def reconfigure_status_workers(self):
+        """
+        Replace the status workers pool if its size settings changed, and
+        requeue the pending refreshes in the new pool.
+        """
+        if self.status_workers.size == self.status_workers_size and \
+           self.status_workers.jobs.maxsize == self.status_queue_size:
+            return
+        self.log.info("reconfigure status workers: size %d, queue size %d",
+                      self.status_workers_size, self.status_queue_size)
+        old = self.status_workers
+        old.stop()
+        self.status_workers = self.new_status_workers()
+        with old.lock:
+            paths = old.pending | old.rerun
+        for path in paths:
+            if self.status_workers.enabled and self.status_workers.refresh(path):
+                continue
+            self.init_status_paths.discard(path)
+            self.service_status_command(path)
+        self.init_status_done()
+
+    def janitor_status_workers(self):
+        """
+        Collect the status refreshes done by the status workers. Fallback
+        to a status command if a worker failed.
+        """
+        done = self.status_workers.completed()
+        for paths, result, error in done:
+            for path in paths:
+                if error:
+                    self.log.warning("status worker failed to refresh %s: %s", path, error)
+                    self.service_status_command(path)
+                elif result.get("status"):
+                    self.log.debug("status worker failed to refresh %s: %s", path, result.get("error"))
+                if path in shared.SERVICES:
+                    shared.STATUS_DIRTY.add(path)
+            if paths & self.init_status_paths:
+                self.init_status_paths -= paths
+                self.init_status_done()
+        return len(done)
+
     def services_init_boot(self):
         self.services_purge_status()
         proc1 = self.service_command(",".join(list_services(kinds=["vol", "svc"])), ["boot", "--parallel"])
@@ -1319,14 +1536,25 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             return
 
         # node
-        self.node_orchestrator()
+        with self.profiler.phase("node_orchestrator"):
+            self.node_orchestrator()
 
         # services (iterate over deleting services too)
-        paths = [path for path in shared.SMON_DATA]
-        self.get_agg_services()
-        for path in paths:
+        with self.profiler.phase("get_agg_services"):
+            self.get_agg_services()
+        with self.profiler.phase("objects_orchestrator"):
+            self.objects_orchestrator()
+        with self.profiler.phase("sync_services_conf"):
+            self.sync_services_conf()
+
+    def objects_orchestrator(self):
+        paths = self.orchestrator_paths()
+        for idx, path in enumerate(paths):
             self.clear_start_failed(path)
             if self.transitions_maxed():
+                # orchestrate the skipped objects on the next pass
+                for _path in paths[idx:]:
+                    shared.ORCH_DIRTY.add(_path)
                 break
             if self.status_older_than_cf(path):
                 #self.log.info("%s status dump is older than its config file",
@@ -1334,11 +1562,65 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                 instance = self.get_service_instance(path, Env.nodename)
                 if instance:
                     self.service_status(path)
+                shared.ORCH_DIRTY.add(path)
                 continue
             svc = self.get_service(path)
             self.resources_orchestrator(path, svc)
             self.object_orchestrator(path, svc)
-        self.sync_services_conf()
+
+    def orchestrator_paths(self):
+        """
+        Return the list of object paths to orchestrate: the objects marked
+        dirty in ORCH_DIRTY since the last pass, the objects related to
+        a dirty object and the objects with a pending transition or global
+        expect. Return all objects on a full sweep.
+        """
+        dirty = self.pop_dirty(shared.ORCH_DIRTY, "orchestrator")
+        if dirty is None:
+            return [path for path in shared.SMON_DATA]
+        related = self.get_orchestrator_related()
+        todo = set(dirty)
+        for path in dirty:
+            todo |= related.get(path, set())
+        paths = []
+        for path in list(shared.SMON_DATA):
+            if path in todo or self.orchestrator_busy(path):
+                paths.append(path)
+        return paths
+
+    @staticmethod
+    def orchestrator_busy(path):
+        """
+        Return True if the <path> object local monitor has a pending
+        transition or global expect, whose progress may depend on time
+        only.
+        """
+        try:
+            smon = shared.SMON_DATA[path]
+        except KeyError:
+            return False
+        return smon.status != "idle" or smon.global_expect is not None
+
+    @staticmethod
+    def get_orchestrator_related():
+        """
+        Return a dict of the sets of paths related to each object path by a
+        parent, child, slave or affinity relation, in both directions.
+        """
+        related = {}
+        for path, svc in list(shared.SERVICES.items()):
+            others = []
+            for parent in getattr(svc, "parents", None) or []:
+                others.append(resolve_path(parent.split("@")[0], svc.namespace))
+            others += getattr(svc, "children_and_slaves", None) or []
+            for kw in ("hard_affinity", "hard_anti_affinity", "soft_affinity", "soft_anti_affinity"):
+                others += getattr(svc, kw, None) or []
+            for other in others:
+                if other == path:
+                    continue
+                related.setdefault(path, set()).add(other)
+                related.setdefault(other, set()).add(path)
+        return related
 
     def transitions_maxed(self):
         transitions = self.transition_count()
@@ -1883,7 +2165,9 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             pattern = "^%s/%s/%s" % (namespace, kind, pattern)
         else:
             pattern = "^%s" % pattern
-        return [slave for slave in shared.SERVICES if re.match(pattern, slave)]
+        with shared.SERVICES_LOCK:
+            paths = list(shared.SERVICES)
+        return [slave for slave in paths if re.match(pattern, slave)]
 
     def object_orchestrator_scaler(self, svc):
         smon = self.get_service_monitor(svc.path)
@@ -2119,6 +2403,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
 
     def end_rejoin_grace_period(self, reason=""):
         self.rejoin_grace_period_expired = True
+        shared.ORCH_DIRTY.invalidate()
         self.duplog("info", "end of rejoin grace period: %s" % reason,
                     nodename="")
         nmon = self.get_node_monitor()
@@ -2711,8 +2996,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             if n_up > 0 and n_up < instance.get("scale"):
                 return "warn"
 
-        slaves = instance.get("slaves", [])
-        slaves += instance.get("scaler_slaves", [])
+        slaves = instance.get("slaves", []) + instance.get("scaler_slaves", [])
         if slaves:
             _, namespace, _ = split_path(path)
             avails = set([avail])
@@ -2772,8 +3056,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         if instance is None:
             # during init for example
             return "unknown"
-        slaves = instance.get("slaves", [])
-        slaves += instance.get("scaler_slaves", [])
+        slaves = instance.get("slaves", []) + instance.get("scaler_slaves", [])
         if slaves:
             _, namespace, _ = split_path(path)
             avails = set([ostatus])
@@ -3120,16 +3403,49 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         self.log.info("service %s config consensus reached", path)
         return True
 
+    def pop_dirty(self, dirty_paths, key):
+        """
+        Return the paths changed since the last call, as tracked by the
+        watcher thread in <dirty_paths>, or None if all paths must be
+        rescanned. Force a full rescan every <full_rescan_interval> seconds,
+        as a safety net against missed changes.
+        """
+        dirty = dirty_paths.pop()
+        now = time.time()
+        if dirty is None or now > self.last_full_rescan.get(key, 0) + self.full_rescan_interval:
+            self.last_full_rescan[key] = now
+            return
+        return dirty
+
+    def changed_services_config(self):
+        """
+        Return the list of object paths to rescan and the set of paths
+        whose configuration changed, or None if all are to be considered
+        changed.
+        """
+        dirty = self.pop_dirty(shared.CONFIG_DIRTY, "config")
+        if dirty is None:
+            return list_services(), None
+        last = set(shared.CLUSTER_DATA[Env.nodename].get("services", {}).get("config", {}))
+        paths = [path for path in last - dirty]
+        paths += [path for path in dirty if os.path.exists(svc_pathcf(path))]
+        return paths, dirty
+
     def get_services_config(self):
         config = {}
-        for path in list_services():
-            cfg = svc_pathcf(path)
-            try:
-                config_mtime = os.path.getmtime(cfg)
-            except Exception as exc:
-                self.log.warning("failed to get %s mtime: %s", cfg, str(exc))
-                config_mtime = 0
+        paths, dirty = self.changed_services_config()
+        for path in paths:
             last_config = self.get_last_svc_config(path)
+            if dirty is not None and path not in dirty and last_config is not None:
+                # unchanged since the last scan
+                config_mtime = last_config["updated"]
+            else:
+                cfg = svc_pathcf(path)
+                try:
+                    config_mtime = os.path.getmtime(cfg)
+                except Exception as exc:
+                    self.log.warning("failed to get %s mtime: %s", cfg, str(exc))
+                    config_mtime = 0
             if last_config is None or config_mtime > last_config["updated"]:
                 #self.log.debug("compute service %s config checksum", path)
                 try:
@@ -3139,8 +3455,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                     continue
                 try:
                     with shared.SERVICES_LOCK:
-                        name, namespace, kind = split_path(path)
-                        shared.SERVICES[path] = factory(kind)(name, namespace, node=shared.NODE)
+                        shared.SERVICES[path] = self.object_cache.get(path, shared.NODE, csum=csum)
                 except Exception as exc:
                     self.log.error("%s build error: %s", path, str(exc))
                     continue
@@ -3170,10 +3485,12 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                 if path not in config:
                     self.log.info("purge deleted %s from daemon data", path)
                     del shared.SERVICES[path]
-                    try:
-                        del shared.CLUSTER_DATA[Env.nodename]["services"]["status"][path]
-                    except KeyError:
-                        pass
+                    self.object_cache.drop(path)
+                    self.status_workers.discard(path)
+                    shared.LOCAL_DATA_JOURNAL.delete(
+                        shared.CLUSTER_DATA[Env.nodename],
+                        ["services", "status", path]
+                    )
         return config
 
     def get_last_svc_status_mtime(self, path):
@@ -3230,10 +3547,19 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         # this data ends up in CLUSTER_DATA[Env.nodename]["services"]["status"]
         data = {}
 
+        # the paths with a changed status.json or frozen flag, None if
+        # unknown
+        dirty = self.pop_dirty(shared.STATUS_DIRTY, "status")
+
         for path in paths:
             idata = None
             last_mtime = self.get_last_svc_status_mtime(path)
             fpath = svc_pathvar(path, "status.json")
+            if dirty is not None and path not in dirty and last_mtime > 0:
+                # the status.json and frozen flag did not change
+                data[path] = dict(shared.CLUSTER_DATA[Env.nodename]["services"]["status"][path])
+                self.update_service_status_monitor(data, path)
+                continue
             try:
                 mtime = os.path.getmtime(fpath)
                 if mtime < self.startup:
@@ -3254,8 +3580,9 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
 
             if not idata and last_mtime > 0:
                 # the status.json did not change or failed to load
-                #  => preserve current data
-                idata = shared.CLUSTER_DATA[Env.nodename]["services"]["status"][path]
+                #  => preserve current data. Work on a shallow copy, so
+                #  the changes are detected when the data is committed.
+                idata = dict(shared.CLUSTER_DATA[Env.nodename]["services"]["status"][path])
 
             if idata:
                 data[path] = idata
@@ -3267,16 +3594,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             # update the frozen instance attribute
             data[path]["frozen"] = shared.SERVICES[path].frozen()
 
-            # embed the updated smon data
-            self.set_smon_l_expect_from_status(data, path)
-            data[path]["monitor"] = dict(self.get_service_monitor(path))
-
-            # forget the stonith target node if we run the service
-            if data[path].get("avail", "n/a") == "up":
-                try:
-                    del data[path]["monitor"]["stonith"]
-                except KeyError:
-                    pass
+            self.update_service_status_monitor(data, path)
 
         # deleting services (still in SMON_DATA, no longer has cf).
         # emulate a status
@@ -3288,22 +3606,38 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
 
         return data
 
+    def update_service_status_monitor(self, data, path):
+        # embed the updated smon data
+        self.set_smon_l_expect_from_status(data, path)
+        data[path]["monitor"] = dict(self.get_service_monitor(path))
+
+        # forget the stonith target node if we run the service
+        if data[path].get("avail", "n/a") == "up":
+            try:
+                del data[path]["monitor"]["stonith"]
+            except KeyError:
+                pass
+
     #########################################################################
     #
     # Service-specific monitor data helpers
     #
     #########################################################################
-    @staticmethod
-    def reset_smon_retries(path, rid):
+    def reset_smon_retries(self, path, rid):
         with shared.SMON_DATA_LOCK:
             if path not in shared.SMON_DATA:
                 return
             if "restart" not in shared.SMON_DATA[path]:
                 return
-            if rid in shared.SMON_DATA[path].restart:
-                del shared.SMON_DATA[path].restart[rid]
-            if len(shared.SMON_DATA[path].restart.keys()) == 0:
+            if rid not in shared.SMON_DATA[path].restart:
+                return
+            restart = dict(shared.SMON_DATA[path].restart)
+            del restart[rid]
+            if restart:
+                shared.SMON_DATA[path].restart = restart
+            else:
                 del shared.SMON_DATA[path].restart
+        self.smon_changed(path)
 
     @staticmethod
     def get_smon_retries(path, rid):
@@ -3317,17 +3651,14 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
             else:
                 return shared.SMON_DATA[path].restart[rid]
 
-    @staticmethod
-    def inc_smon_retries(path, rid):
+    def inc_smon_retries(self, path, rid):
         with shared.SMON_DATA_LOCK:
             if path not in shared.SMON_DATA:
                 return
-            if "restart" not in shared.SMON_DATA[path]:
-                shared.SMON_DATA[path].restart = {}
-            if rid not in shared.SMON_DATA[path].restart:
-                shared.SMON_DATA[path].restart[rid] = 1
-            else:
-                shared.SMON_DATA[path].restart[rid] += 1
+            restart = dict(shared.SMON_DATA[path].get("restart") or {})
+            restart[rid] = restart.get(rid, 0) + 1
+            shared.SMON_DATA[path].restart = restart
+        self.smon_changed(path)
 
     def all_nodes_frozen(self):
         with shared.CLUSTER_DATA_LOCK:
@@ -3522,6 +3853,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                           "%s => %s", path,
                           shared.SMON_DATA[path].local_expect, "started")
             shared.SMON_DATA[path].local_expect = "started"
+        self.smon_changed(path)
 
     def get_arbitrators_data(self):
         if self.arbitrators_data is None or self.last_arbitrator_ping < time.time() - self.arbitrators_check_period:
@@ -3543,40 +3875,52 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         return self.arbitrators_data
 
     def update_cluster_data(self):
-        self.update_node_data()
+        with self.profiler.phase("update_node_data"):
+            self.update_node_data()
         self.purge_left_nodes()
-        self.merge_hb_data()
-        self.update_daemon_status()
+        with self.profiler.phase("merge_hb_data"):
+            self.merge_hb_data()
 
     def purge_left_nodes(self):
         left = set([node for node in shared.CLUSTER_DATA]) - set(self.cluster_nodes)
         for node in left:
             self.log.info("purge left node %s data", node)
-            try:
-                del shared.CLUSTER_DATA[node]
-            except Exception:
-                pass
+            with shared.CLUSTER_DATA_LOCK:
+                try:
+                    del shared.CLUSTER_DATA[node]
+                except Exception:
+                    pass
+                shared.publish_cluster_snapshot(node)
 
     def update_node_data(self):
         """
         Rescan services config and status.
         """
         data = shared.CLUSTER_DATA[Env.nodename]
-        data["stats"] = shared.NODE.stats()
-        data["frozen"] = self.node_frozen
-        data["env"] = shared.NODE.env
-        data["labels"] = shared.NODE.labels
-        data["targets"] = shared.NODE.targets
+        jset = shared.LOCAL_DATA_JOURNAL.set
+        jset(data, ["stats"], shared.NODE.stats())
+        jset(data, ["frozen"], self.node_frozen)
+        jset(data, ["env"], shared.NODE.env)
+        jset(data, ["labels"], shared.NODE.labels)
+        jset(data, ["targets"], shared.NODE.targets)
+        jset(data, ["speaker"], self.speaker() and "collector" in shared.THREADS)
+        jset(data, ["min_avail_mem"], shared.NODE.min_avail_mem)
+        jset(data, ["min_avail_swap"], shared.NODE.min_avail_swap)
+        jset(data, ["monitor"], dict(shared.NMON_DATA))
+        with self.profiler.phase("get_services_config"):
+            config = self.get_services_config()
+        jset(data, ["services", "config"], config, itemized=True)
+        with self.profiler.phase("get_services_status"):
+            status = self.get_services_status(data["services"]["config"].keys())
+        jset(data, ["services", "status"], status, itemized=True)
+
+        # the locks are changed in-place by the lock handlers and the hb
+        # data merge, always journal them.
         data["locks"] = shared.LOCKS
-        data["speaker"] = self.speaker() and "collector" in shared.THREADS
-        data["min_avail_mem"] = shared.NODE.min_avail_mem
-        data["min_avail_swap"] = shared.NODE.min_avail_swap
-        data["monitor"] = dict(shared.NMON_DATA)
-        data["services"]["config"] = self.get_services_config()
-        data["services"]["status"] = self.get_services_status(data["services"]["config"].keys())
+        shared.LOCAL_DATA_JOURNAL.add(["locks"])
 
         if self.quorum:
-            data["arbitrators"] = self.get_arbitrators_data()
+            jset(data, ["arbitrators"], self.get_arbitrators_data())
 
         # purge deleted service instances
         for path in set(chain(data["services"]["status"].keys(), shared.SMON_DATA.keys())):
@@ -3595,11 +3939,9 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                     del shared.SMON_DATA[path]
             except KeyError:
                 pass
-            try:
-                del data["services"]["status"][path]
+            if path in data["services"]["status"]:
+                shared.LOCAL_DATA_JOURNAL.delete(data, ["services", "status", path])
                 self.log.debug("purge deleted service %s from status data", path)
-            except KeyError:
-                pass
 
     def update_hb_data(self):
         """
@@ -3612,6 +3954,8 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         with shared.CLUSTER_DATA_LOCK:
             diff = self._update_hb_data_locked()
 
+        self.update_daemon_status()
+
         if diff is None:
             return
 
@@ -3643,29 +3987,49 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         except KeyError:
             updated = now
 
-        if self.last_node_data is not None:
-            diff = json_delta.diff(
-                self.last_node_data, data,
-                verbose=False, array_align=False, compare_lengths=False
-            )
-        else:
+        if self.last_node_data is None:
             # first run
-            self.last_node_data = json.loads(json.dumps(data))
+            shared.LOCAL_DATA_JOURNAL.clear()
+            self.last_node_data = journal.copy(data)
             data["gen"] = self.get_gen(inc=True)
             data["updated"] = now
+            shared.publish_cluster_snapshot(Env.nodename)
             return
 
+        # diff only the subtrees journaled as changed since the last run.
+        # this also refreshes these subtrees in self.last_node_data.
+        diff = journal.diff(self.last_node_data, data, shared.LOCAL_DATA_JOURNAL.pop())
+        if self.dataset_journal_check:
+            diff += self.journal_missed_changes(data)
+
         if len(diff) == 0:
             data["gen"] = self.get_gen(inc=False)
             data["updated"] = updated
+            shared.publish_cluster_snapshot(Env.nodename, [["gen"], ["updated"]])
             return
 
-        self.last_node_data = json.loads(json.dumps(data))
         data["gen"] = self.get_gen(inc=True)
         data["updated"] = now
         diff.append([["updated"], data["updated"]])
+        shared.publish_cluster_snapshot(Env.nodename, [change[0] for change in diff] + [["gen"]])
         return diff
 
+    def journal_missed_changes(self, data):
+        """
+        Return the local dataset changes missed by the journal, and resync
+        the last sent dataset copy.
+        """
+        missed = json_delta.diff(
+            self.last_node_data, data,
+            verbose=False, array_align=False, compare_lengths=False
+        )
+        if len(missed) == 0:
+            return []
+        self.log.warning("local dataset changes missed by the journal: %s",
+                         ", ".join(sorted(set(["/".join([str(key) for key in change[0]]) for change in missed]))))
+        self.last_node_data = journal.copy(data)
+        return journal.copy(missed)
+
     def merge_hb_data(self):
         self.merge_hb_data_locks()
         self.merge_hb_data_compat()
@@ -3922,11 +4286,68 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                 continue
         return paths
 
+    def get_agg_children(self, path):
+        """
+        Return the set of paths the <path> aggregated status is computed
+        from, in addition to its own instances.
+        """
+        instance = self.get_any_service_instance(path)
+        if not instance:
+            return set()
+        _, namespace, _ = split_path(path)
+        slaves = instance.get("slaves", []) + instance.get("scaler_slaves", [])
+        children = set([resolve_path(child, namespace) for child in slaves])
+        if instance.get("scale") is not None:
+            children |= set(self.scaler_current_slaves(path))
+        return children
+
+    def get_agg_parents(self, paths):
+        """
+        Return the set of paths whose aggregated status is computed from
+        the aggregated status or instances of any of <paths>.
+        """
+        index = {}
+        for parent, children in self.agg_children.items():
+            for child in children:
+                index.setdefault(child, set()).add(parent)
+        parents = set()
+        for path in paths:
+            parents |= index.get(path, set())
+            name, namespace, kind = split_path(path)
+            match = re.match(r"^[0-9]+\.(.+)$", name)
+            if match:
+                # a new scaler slave is not yet known as a child of its scaler
+                parents.add(fmt_path(match.group(1), namespace, kind))
+        return parents
+
     def get_agg_services(self):
-        data = {}
+        """
+        Refresh and return the objects aggregated status.
+
+        Only the objects with instances or configuration changed since the
+        last refresh, as tracked in AGG_DIRTY and the local dataset journal,
+        are recomputed. The other objects keep their previous aggregated
+        status.
+        """
         with shared.CLUSTER_DATA_LOCK:
+            shared.invalidate_objects(shared.LOCAL_DATA_JOURNAL.peek())
+            dirty = self.pop_dirty(shared.AGG_DIRTY, "agg")
+            cluster_nodes = list(self.cluster_nodes)
+            if cluster_nodes != self.agg_cluster_nodes:
+                self.agg_cluster_nodes = cluster_nodes
+                dirty = None
             all_paths = self.get_all_paths()
+            if dirty is None:
+                todo = all_paths
+                self.agg_children = {}
+            else:
+                todo = (dirty | set(all_paths - set(shared.AGG))) & all_paths
+            data = {}
             for path in all_paths:
+                if path not in todo:
+                    data[path] = shared.AGG[path]
+                    continue
+                self.agg_children[path] = self.get_agg_children(path)
                 try:
                     if self.get_service(path).topology == "span":
                         data[path] = Storage()
@@ -3935,6 +4356,15 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
                     data[path] = Storage()
                     pass
                 data[path] = self.get_agg(path)
+            for path in set(self.agg_children) - all_paths:
+                del self.agg_children[path]
+            changed = [path for path in set(shared.AGG) ^ set(data) | todo
+                       if shared.AGG.get(path) != data.get(path)]
+            if changed:
+                # the parents aggregate the previous children aggregated
+                # status: refresh them on the next call.
+                for parent in self.get_agg_parents(changed):
+                    shared.AGG_DIRTY.add(parent)
         shared.AGG = data
         return data
 
@@ -3956,7 +4386,7 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
 
     def status(self):
         data = shared.OsvcThread.status(self)
-        data["nodes"] = json.loads(json.dumps(shared.CLUSTER_DATA))
+        data["nodes"] = shared.CLUSTER_SNAPSHOT
         data["compat"] = self.compat
         data["transitions"] = self.transition_count()
         data["frozen"] = self.get_clu_agg_frozen()
@@ -4027,7 +4457,9 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
         and stopped while we were not alive.
         """
         last_shutdown = self.get_last_shutdown()
-        for svc in shared.SERVICES.values():
+        with shared.SERVICES_LOCK:
+            svcs = list(shared.SERVICES.values())
+        for svc in svcs:
             if svc.orchestrate == "no":
                 continue
             if len(svc.peers) < 2:
@@ -4067,7 +4499,11 @@ class Monitor(shared.OsvcThread, MonitorObjectOrchestratorManualMixin):
 
     def reload_instance_frozen(self, path):
         try:
-            shared.CLUSTER_DATA[Env.nodename]["services"]["status"][path]["frozen"] = shared.SERVICES[path].frozen()
+            shared.LOCAL_DATA_JOURNAL.set(
+                shared.CLUSTER_DATA[Env.nodename],
+                ["services", "status", path, "frozen"],
+                shared.SERVICES[path].frozen()
+            )
         except Exception:
             pass
 
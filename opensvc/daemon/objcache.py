@@ -0,0 +1,168 @@
+"""
+A cache of the daemon long-lived object instances.
+
+Building an object parses its configuration file and creates all its
+resources, so the monitor reuses the cached instance as long as the
+object configuration checksum and the values of the node-level references
+used by the object configuration are unchanged.
+
+The node-level references are the {node.<keyword>} references, the
+hardcoded references resolved through the node (clustername, clusternodes,
+dns, ...), and the node selector expressions depending on the nodes labels.
+"""
+import codecs
+import hashlib
+import re
+import threading
+
+from utilities.naming import factory, split_path, svc_pathcf
+
+# hardcoded references resolved through a node attribute
+NODE_ATTR_REFS = {
+    "clusterid": "cluster_id",
+    "clustername": "cluster_name",
+    "fqdn": "cluster_name",
+    "domain": "cluster_name",
+    "clusternodes": "cluster_nodes",
+    "clusterdrpnodes": "cluster_drpnodes",
+    "dns": "dns",
+    "dnsnodes": "dnsnodes",
+}
+MODIFIERS = ("upper:", "lower:", "capitalize:", "title:", "swapcase:")
+NODES_KEYWORDS = ("nodes", "drpnodes", "drpnode", "encapnodes")
+
+RE_REF = re.compile(r"{\w*[\w#][\w\.\[\]:\/]*}")
+RE_NODES_KEYWORD = re.compile(r"^\s*(%s)(@\S+)?\s*=(.*)$" % "|".join(NODES_KEYWORDS),
+                              re.MULTILINE)
+RE_SELECTOR = re.compile(r"[*?=,+]")
+
+
+def node_refs(buff):
+    """
+    Return the set of node-level references used in the object
+    configuration text <buff>.
+    """
+    refs = set()
+    for match in RE_REF.finditer(buff):
+        ref = match.group(0).strip("{}").lower()
+        if "[" in ref:
+            ref = ref[:ref.index("[")]
+        ref = ref.lstrip("#")
+        for modifier in MODIFIERS:
+            if ref.startswith(modifier):
+                ref = ref[len(modifier):]
+                break
+        if ref in NODE_ATTR_REFS:
+            refs.add(NODE_ATTR_REFS[ref])
+        elif ref.startswith("node."):
+            refs.add(ref)
+    for match in RE_NODES_KEYWORD.finditer(buff):
+        if RE_SELECTOR.search(match.group(3)):
+            refs |= set(["cluster_nodes", "nodes_info"])
+    return refs
+
+
+def node_ref_value(node, ref):
+    """
+    Return the current value of the node-level reference <ref>.
+    """
+    try:
+        if ref.startswith("node."):
+            return node.conf_get("node", ref[5:])
+        if ref == "nodes_info":
+            return dict((nodename, data.get("labels"))
+                        for nodename, data in (node.nodes_info or {}).items())
+        val = getattr(node, ref)
+        if isinstance(val, (set, tuple)):
+            val = sorted(val)
+        return val
+    except Exception:
+        return
+
+
+class ObjectCache(object):
+    """
+    The instances cache, indexed by object path. Each entry records the
+    config checksum the instance was built from, and the values of the
+    node-level references the instance config uses.
+
+    The config sync workers and the monitor thread share the cache, so the
+    entries are accessed under a lock. The builds are done outside the lock.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    @staticmethod
+    def read(path):
+        with codecs.open(svc_pathcf(path), "r", "utf-8") as filep:
+            buff = filep.read()
+        return hashlib.md5(buff.encode("utf-8")).hexdigest(), buff
+
+    def csum(self, path):
+        with self.lock:
+            try:
+                return self.entries[path]["csum"]
+            except KeyError:
+                return
+
+    def get(self, path, node, csum=None):
+        """
+        Return the <path> object instance, reused from the cache if its
+        config checksum is <csum> and its node-level references values
+        are unchanged, built otherwise.
+
+        If <csum> is not set, the config file checksum is computed.
+        Raise on config read or object build errors.
+        """
+        buff = None
+        if csum is None:
+            csum, buff = self.read(path)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry["csum"] == csum and not self.changed(entry, node):
+            if entry["svc"].node is not node:
+                # the daemon replaces the node instance on node.conf change
+                entry["svc"].node = node
+            return entry["svc"]
+        if buff is None:
+            csum, buff = self.read(path)
+        return self.build(path, node, csum, buff)
+
+    def build(self, path, node, csum, buff):
+        name, namespace, kind = split_path(path)
+        svc = factory(kind)(name, namespace, node=node)
+        refs = node_refs(buff)
+        entry = {
+            "svc": svc,
+            "csum": csum,
+            "refs": dict((ref, node_ref_value(node, ref)) for ref in refs),
+        }
+        with self.lock:
+            self.entries[path] = entry
+        return svc
+
+    def outdated(self, path, node):
+        """
+        Return True if a node-level reference value used by the <path>
+        cached instance has changed since the instance was built.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is None:
+            return True
+        return self.changed(entry, node)
+
+    @staticmethod
+    def changed(entry, node):
+        for ref, value in entry["refs"].items():
+            if node_ref_value(node, ref) != value:
+                return True
+        return False
+
+    def drop(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
@@ -0,0 +1,220 @@
+"""
+Daemon threads instrumentation.
+
+* RollingStats keeps the last samples of a measure and summarizes them as
+  percentiles.
+* PhaseProfiler records the duration of the named phases of a thread loop.
+* ProfiledRLock is a RLock recording the time spent waiting for and
+  holding the lock.
+* SamplingProfiler periodically samples the stack of the threads it is
+  enabled for, and counts the functions seen on top of the stacks.
+"""
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(values, pct):
+    """
+    Return the <pct> percentile of the sorted list <values>.
+    """
+    if not values:
+        return 0.0
+    idx = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[idx]
+
+
+class RollingStats(object):
+    """
+    The last <size> samples of a measure.
+    """
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, val):
+        with self.lock:
+            self.samples.append(val)
+            self.count += 1
+
+    def summary(self):
+        with self.lock:
+            values = sorted(self.samples)
+            count = self.count
+        return {
+            "count": count,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
+
+
+class PhaseProfiler(object):
+    """
+    The rolling durations of the named phases of a thread loop.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, duration):
+        try:
+            stats = self.stats[name]
+        except KeyError:
+            with self.lock:
+                stats = self.stats.setdefault(name, RollingStats(self.size))
+        stats.add(duration)
+
+    @contextmanager
+    def phase(self, name):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - begin)
+
+    def summary(self):
+        with self.lock:
+            stats = list(self.stats.items())
+        return dict((name, _stats.summary()) for name, _stats in stats)
+
+
+class ProfiledRLock(object):
+    """
+    A reentrant lock recording, for the outermost acquire of each owner,
+    the time waited for the lock and the time the lock was held.
+    """
+    def __init__(self, name="", size=256):
+        self._lock = threading.RLock()
+        self.name = name
+        self.local = threading.local()
+        self.wait = RollingStats(size)
+        self.hold = RollingStats(size)
+
+    def acquire(self, *args, **kwargs):
+        begin = time.time()
+        acquired = self._lock.acquire(*args, **kwargs)
+        if not acquired:
+            return acquired
+        depth = getattr(self.local, "depth", 0)
+        if depth == 0:
+            now = time.time()
+            self.wait.add(now - begin)
+            self.local.acquired = now
+        self.local.depth = depth + 1
+        return acquired
+
+    def release(self):
+        depth = self.local.depth - 1
+        self.local.depth = depth
+        if depth == 0:
+            self.hold.add(time.time() - self.local.acquired)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def summary(self):
+        return {
+            "wait": self.wait.summary(),
+            "hold": self.hold.summary(),
+        }
+
+
+class SamplingProfiler(object):
+    """
+    A sampler thread, started when profiling is enabled for at least one
+    thread, sampling the enabled threads stack every <interval> seconds.
+
+    For each profiled thread, the samples are counted by function on top
+    of the stack ("self" count) and by function anywhere in the stack
+    ("total" count).
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.sampler = None
+
+    def enable(self, name, ident, interval=None):
+        with self.lock:
+            if interval:
+                self.interval = interval
+            self.threads[name] = {
+                "ident": ident,
+                "started": time.time(),
+                "samples": 0,
+                "self": {},
+                "total": {},
+            }
+            if self.sampler is None or not self.sampler.is_alive():
+                self.sampler = threading.Thread(target=self.run, name="sampling profiler")
+                self.sampler.daemon = True
+                self.sampler.start()
+
+    def disable(self, name):
+        with self.lock:
+            self.threads.pop(name, None)
+
+    def enabled(self, name):
+        with self.lock:
+            return name in self.threads
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.threads:
+                    self.sampler = None
+                    return
+                interval = self.interval
+                self.sample()
+            time.sleep(interval)
+
+    def sample(self):
+        frames = sys._current_frames()
+        for data in self.threads.values():
+            frame = frames.get(data["ident"])
+            if frame is None:
+                continue
+            data["samples"] += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = "%s:%d %s" % (code.co_filename, code.co_firstlineno, code.co_name)
+                if top:
+                    data["self"][key] = data["self"].get(key, 0) + 1
+                    top = False
+                if key not in seen:
+                    data["total"][key] = data["total"].get(key, 0) + 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    def report(self, name, top=20):
+        """
+        Return the <top> most sampled functions of the <name> thread, or
+        None if the thread is not profiled.
+        """
+        with self.lock:
+            data = self.threads.get(name)
+            if data is None:
+                return
+            samples = data["samples"]
+            _self = sorted(data["self"].items(), key=lambda x: -x[1])[:top]
+            total = sorted(data["total"].items(), key=lambda x: -x[1])[:top]
+            started = data["started"]
+        return {
+            "started": started,
+            "interval": self.interval,
+            "samples": samples,
+            "self": [{"function": key, "samples": count} for key, count in _self],
+            "total": [{"function": key, "samples": count} for key, count in total],
+        }
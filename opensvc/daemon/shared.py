@@ -9,6 +9,7 @@ import hashlib
 import json
 import tempfile
 import shutil
+import uuid
 from subprocess import Popen, PIPE
 
 import foreign.six as six
@@ -16,7 +17,6 @@ import foreign.six as six
 from foreign.six.moves import queue
 
 import core.exceptions as ex
-import foreign.json_delta as json_delta
 from foreign.jsonpath_ng.ext import parse
 from env import Env
 from utilities.lazy import lazy, unset_lazy
@@ -24,8 +24,11 @@ from utilities.naming import split_path, paths_data, factory, object_path_glob
 from utilities.selector import selector_config_match, selector_value_match, selector_parse_fragment, selector_parse_op_fragment
 from utilities.storage import Storage
 from core.freezer import Freezer
-from core.comm import Crypt
+from core.comm import Crypt, CRYPTO_MODULE
 from .events import EVENTS
+from .journal import DirtyPaths, Journal
+from .profiler import ProfiledRLock, SamplingProfiler
+from . import snapshot
 
 
 class DebugRLock(object):
@@ -64,15 +67,26 @@ RLock = threading.RLock
 # a global to store the Daemon() instance
 DAEMON = None
 
-# daemon_status cache
-LAST_DAEMON_STATUS = {}
+# daemon_status cache, frozen snapshots
+LAST_DAEMON_STATUS = snapshot.EMPTY
 DAEMON_STATUS_LOCK = RLock()
-DAEMON_STATUS = {}
+DAEMON_STATUS = snapshot.EMPTY
 PATCH_ID = 0
 
 # disable orchestration if a peer announces a different compat version than
 # ours
-COMPAT_VERSION = 10
+COMPAT_VERSION = 11
+
+# the compat version from which the peers accept the binary heartbeat
+# message envelope
+BINARY_HB_COMPAT = 11
+
+# the compat version from which the peers apply the coalesced generation
+# patches
+COALESCED_PATCH_COMPAT = 11
+
+# the compat version from which the peers read the disk hb slot header
+DISK_SLOT_HEADER_COMPAT = 11
 
 # expose api handlers version
 API_VERSION = 6
@@ -96,6 +110,41 @@ REMOTE_GEN = {}
 # track the local dataset gen diffs pending merge by peers
 GEN_DIFF = {}
 
+# track the local dataset key paths changed since the last gen diff
+LOCAL_DATA_JOURNAL = Journal()
+
+# track the objects with a changed configuration file or status.json, fed by
+# the watcher thread.
+CONFIG_DIRTY = DirtyPaths()
+STATUS_DIRTY = DirtyPaths()
+
+# track the objects whose aggregated status must be recomputed, fed by the
+# cluster dataset changes.
+AGG_DIRTY = DirtyPaths()
+
+# track the objects the monitor must orchestrate, fed by the cluster dataset
+# changes and the local objects monitor changes.
+ORCH_DIRTY = DirtyPaths()
+
+# the node dataset keys whose changes may change the orchestration
+# decisions of all objects: the node monitor, freeze and compat states, the
+# nodes selection data, and the overload thresholds.
+# The other keys are not read by the orchestration: "env" is only read
+# from the local node config, the arbitrators are pinged directly by the
+# quorum code, and "speaker", "locks", "agent" and "api" are informational
+# or served by their own handlers.
+ORCH_NODE_KEYS = ("compat", "frozen", "labels", "min_avail_mem",
+                  "min_avail_swap", "monitor", "targets")
+
+# the node dataset keys read by the placement, refreshed by each node every
+# 30 seconds. Their changes invalidate the orchestration only if the node
+# placement score or overload state changed. The finer load drifts are
+# picked up by the monitor periodic full orchestration sweep.
+ORCH_PLACEMENT_KEYS = ("load", "stats")
+
+# the last placement state of each node, as returned by placement_state()
+ORCH_PLACEMENT_STATE = {}
+
 DATEFMT = "%Y-%m-%dT%H:%M:%S.%fZ"
 JSON_DATEFMT = "%Y-%m-%dT%H:%M:%SZ"
 MAX_MSG_SIZE = 1024 * 1024
@@ -123,11 +172,12 @@ AGG_LOCK = RLock()
 # It is refreshed in the monitor thread loop.
 HB_MSG = None
 HB_MSG_LEN = 0
+HB_MSG_BINARY = False
 HB_MSG_LOCK = RLock()
 
 # the local service monitor data, where the listener can set expected states
 SMON_DATA = {}
-SMON_DATA_LOCK = RLock()
+SMON_DATA_LOCK = ProfiledRLock()
 
 # the local node monitor data, where the listener can set expected states
 NMON_DATA = Storage({
@@ -155,7 +205,22 @@ LOCKS_LOCK = RLock()
 # The per-threads configuration, stats and states store
 # The monitor thread states include cluster-wide aggregated data
 CLUSTER_DATA = {Env.nodename: {}}
-CLUSTER_DATA_LOCK = RLock()
+CLUSTER_DATA_LOCK = ProfiledRLock()
+
+# the locks reporting their wait and hold times in the daemon stats
+PROFILED_LOCKS = {
+    "cluster_data": CLUSTER_DATA_LOCK,
+    "smon_data": SMON_DATA_LOCK,
+}
+
+# the per-thread sampling profiler, enabled at runtime through the
+# daemon_profile handler
+SAMPLER = SamplingProfiler()
+
+# The frozen view of CLUSTER_DATA handed to readers. A new version, sharing
+# the unchanged subtrees with the previous one, is published on each node
+# dataset generation change.
+CLUSTER_SNAPSHOT = snapshot.EMPTY
 
 # The lock to serialize CLUSTER_DATA updates from rx threads
 RX_LOCK = RLock()
@@ -185,9 +250,20 @@ JOIN_LOCK = RLock()
 # Agent as a relay heartbeart server
 RELAY_DATA = {}
 RELAY_LOCK = RLock()
+
+# the relay per-cluster slot write counters, and the id of this counters
+# set, so the clients detect the counters reset on relay restart
+RELAY_VERSIONS = {}
+RELAY_EPOCH = str(uuid.uuid4())
 RELAY_SLOT_MAX_AGE = 24 * 60 * 60
 RELAY_JANITOR_INTERVAL = 10 * 60
 
+# the peer datasets reloaded from the warm restart snapshot, installed
+# by the rx threads on the first peer patch lining up with their gen
+WARM_DATA = {}
+WARM_DATA_TTL = 60
+WARM_SNAPSHOT_MAX_AGE = 300
+
 # try to give a name to the locks, for debugging when using
 # the pure python locks (native locks don't support setattr)
 try:
@@ -215,6 +291,80 @@ def wake_heartbeat_tx():
         HB_TX_TICKER.notify_all()
 
 
+def save_warm_snapshot():
+    """
+    Dump the peer datasets and their generations, so the next daemon
+    can be sent the deltas since these generations instead of the full
+    peer datasets.
+    """
+    with CLUSTER_DATA_LOCK:
+        gens = dict((nodename, gen) for nodename, gen in REMOTE_GEN.items()
+                    if gen and nodename != Env.nodename and nodename in CLUSTER_DATA)
+        buff = json.dumps({
+            "created": time.time(),
+            "nodename": Env.nodename,
+            "gen": gens,
+            "data": dict((nodename, CLUSTER_DATA[nodename]) for nodename in gens),
+        }, separators=(",", ":"))
+    tmpf = tempfile.NamedTemporaryFile(delete=False, dir=Env.paths.pathtmp)
+    fpath = tmpf.name
+    tmpf.close()
+    with open(fpath, "w") as ofile:
+        ofile.write(buff)
+    shutil.move(fpath, Env.paths.daemon_warm_snapshot)
+    return len(gens)
+
+
+def load_warm_snapshot(nodenames):
+    """
+    Load and remove the warm restart snapshot, and return the number of
+    peer datasets loaded in WARM_DATA. The snapshot is ignored if older
+    than WARM_SNAPSHOT_MAX_AGE, and the datasets of nodes not in
+    <nodenames> are dropped.
+    """
+    try:
+        with open(Env.paths.daemon_warm_snapshot, "r") as ofile:
+            data = json.load(ofile)
+    except (IOError, OSError, ValueError):
+        return 0
+    finally:
+        try:
+            os.unlink(Env.paths.daemon_warm_snapshot)
+        except OSError:
+            pass
+    now = time.time()
+    if data.get("nodename") != Env.nodename or now - data.get("created", 0) > WARM_SNAPSHOT_MAX_AGE:
+        return 0
+    for nodename, gen in data.get("gen", {}).items():
+        if nodename not in nodenames or nodename not in data.get("data", {}):
+            continue
+        WARM_DATA[nodename] = {
+            "gen": gen,
+            "data": data["data"][nodename],
+            "expire": now + WARM_DATA_TTL,
+        }
+    return len(WARM_DATA)
+
+
+def pop_warm_data(nodename):
+    """
+    Remove and return the <nodename> warm restart dataset, or None if
+    not loaded or expired.
+    """
+    data = WARM_DATA.pop(nodename, None)
+    if data is None or data["expire"] < time.time():
+        return
+    return data
+
+
+def warm_gens():
+    """
+    Return the generations of the unexpired warm restart datasets.
+    """
+    now = time.time()
+    return dict((nodename, data["gen"]) for nodename, data in list(WARM_DATA.items()) if data["expire"] >= now)
+
+
 def wake_monitor(reason="unknown", immediate=False):
     """
     Notify the monitor thread to do they periodic job immediatly
@@ -226,6 +376,73 @@ def wake_monitor(reason="unknown", immediate=False):
             MON_TICKER.notify_all()
 
 
+def publish_cluster_snapshot(nodename, paths=None):
+    """
+    Publish a new CLUSTER_SNAPSHOT version with the <nodename> dataset
+    subtrees at <paths> refreshed, or the whole <nodename> dataset if <paths>
+    is not set. A <nodename> no longer in CLUSTER_DATA is dropped.
+
+    The caller must hold CLUSTER_DATA_LOCK.
+    """
+    global CLUSTER_SNAPSHOT
+    if paths is None:
+        paths = [[]]
+    CLUSTER_SNAPSHOT = snapshot.update(
+        CLUSTER_SNAPSHOT, CLUSTER_DATA,
+        [[nodename] + list(path) for path in paths]
+    )
+    invalidate_objects(paths, nodename)
+
+
+def invalidate_objects(paths, nodename=None):
+    """
+    Mark dirty the objects whose aggregated status or orchestration may be
+    changed by the <nodename> dataset changes at the key <paths>.
+
+    The caller must hold CLUSTER_DATA_LOCK.
+    """
+    if nodename is None:
+        nodename = Env.nodename
+    for path in paths:
+        if len(path) > 2 and path[0] == "services" and path[1] in ("config", "status"):
+            AGG_DIRTY.add(path[2])
+            ORCH_DIRTY.add(path[2])
+        elif len(path) == 0 or path[0] == "services":
+            AGG_DIRTY.invalidate()
+            ORCH_DIRTY.invalidate()
+            ORCH_PLACEMENT_STATE[nodename] = placement_state(CLUSTER_DATA.get(nodename, {}))
+            return
+        elif path[0] in ORCH_NODE_KEYS:
+            ORCH_DIRTY.invalidate()
+        elif path[0] in ORCH_PLACEMENT_KEYS:
+            state = placement_state(CLUSTER_DATA.get(nodename, {}))
+            if ORCH_PLACEMENT_STATE.get(nodename) != state:
+                ORCH_PLACEMENT_STATE[nodename] = state
+                ORCH_DIRTY.invalidate()
+
+
+def node_data_overloaded(node_data):
+    """
+    Return True if the node dataset <node_data> reports an available
+    memory or swap below the node thresholds.
+    """
+    for key in ("mem", "swap"):
+        limit = node_data.get("min_avail_"+key, 0)
+        total = node_data.get("stats", {}).get(key+"_total", 0)
+        val = node_data.get("stats", {}).get(key+"_avail", 0)
+        if total > 0 and val < limit:
+            return True
+    return False
+
+
+def placement_state(node_data):
+    """
+    Return the node dataset <node_data> values compared by the placement:
+    its score and its overload state.
+    """
+    return node_data.get("stats", {}).get("score"), node_data_overloaded(node_data)
+
+
 def wake_collector():
     """
     Notify the scheduler thread to do they periodic job immediatly
@@ -254,6 +471,9 @@ class OsvcThread(threading.Thread, Crypt):
     """
     stop_tmo = 60
 
+    # a PhaseProfiler, for the threads instrumenting their loop phases
+    profiler = None
+
     def __init__(self):
         super(OsvcThread, self).__init__()
         self.log = None
@@ -371,6 +591,8 @@ class OsvcThread(threading.Thread, Crypt):
                 "total": tid_mem_total,
             },
         }
+        if self.profiler:
+            self.stats_data["phases"] = self.profiler.summary()
         self.last_stats_refresh = now
         return self.stats_data
 
@@ -503,6 +725,10 @@ class OsvcThread(threading.Thread, Crypt):
         unset_lazy(self, "sorted_cluster_nodes")
         unset_lazy(self, "maintenance_grace_period")
         unset_lazy(self, "rejoin_grace_period")
+        unset_lazy(self, "dataset_journal_check")
+        unset_lazy(self, "status_workers_size")
+        unset_lazy(self, "status_queue_size")
+        unset_lazy(self, "watcher_poll_interval")
         unset_lazy(self, "ready_period")
         self.arbitrators_data = None
         self.alerts = []
@@ -583,6 +809,7 @@ class OsvcThread(threading.Thread, Crypt):
                     NMON_DATA.global_expect_updated = time.time()
 
         if changed:
+            LOCAL_DATA_JOURNAL.add(["monitor"])
             wake_monitor(reason="node mon change")
 
     def set_smon(self, path, status=None, local_expect=None,
@@ -688,7 +915,17 @@ class OsvcThread(threading.Thread, Crypt):
                     SMON_DATA[path].stonith = stonith
                     changed = True
         if changed:
-            wake_monitor(reason="service %s mon change" % path)
+            self.smon_changed(path)
+
+    @staticmethod
+    def smon_changed(path):
+        """
+        Journal a change of the <path> Monitor data, so it is committed to
+        the local dataset and sent to the peers, and wake the monitor.
+        """
+        LOCAL_DATA_JOURNAL.add(["services", "status", path, "monitor"])
+        ORCH_DIRTY.add(path)
+        wake_monitor(reason="service %s mon change" % path)
 
     def get_node_monitor(self, nodename=None):
         """
@@ -708,11 +945,13 @@ class OsvcThread(threading.Thread, Crypt):
         """
         Return the Monitor data of a service.
         """
-        try:
-            data = Storage(SMON_DATA[path])
-        except KeyError:
+        if path not in SMON_DATA:
             self.set_smon(path, "idle")
+        with SMON_DATA_LOCK:
             data = Storage(SMON_DATA[path])
+            if "restart" in data:
+                # don't share the mutable counters with the dataset
+                data["restart"] = dict(data["restart"])
         data["placement"] = self.get_service_placement(path)
         return data
 
@@ -833,6 +1072,22 @@ class OsvcThread(threading.Thread, Crypt):
     def rejoin_grace_period(self):
         return NODE.oget("node", "rejoin_grace_period")
 
+    @lazy
+    def dataset_journal_check(self):
+        return NODE.oget("node", "dataset_journal_check")
+
+    @lazy
+    def status_workers_size(self):
+        return NODE.oget("node", "status_workers")
+
+    @lazy
+    def status_queue_size(self):
+        return NODE.oget("node", "status_queue_size")
+
+    @lazy
+    def watcher_poll_interval(self):
+        return NODE.oget("node", "watcher_poll_interval")
+
     @lazy
     def ready_period(self):
         return NODE.oget("node", "ready_period")
@@ -924,6 +1179,7 @@ class OsvcThread(threading.Thread, Crypt):
                 del CLUSTER_DATA[nodename]
             except KeyError:
                 pass
+            publish_cluster_snapshot(nodename)
             try:
                 del LOCAL_GEN[nodename]
             except KeyError:
@@ -1309,6 +1565,10 @@ class OsvcThread(threading.Thread, Crypt):
         if inc:
             GEN += 1
         gen = {Env.nodename: GEN}
+        if WARM_DATA:
+            # announce the warm restart datasets gen, so the peers send
+            # the deltas since this gen instead of a full dataset
+            gen.update(warm_gens())
         gen.update(REMOTE_GEN)
         return gen
 
@@ -1318,13 +1578,7 @@ class OsvcThread(threading.Thread, Crypt):
         node_data = CLUSTER_DATA.get(nodename)
         if node_data is None:
             return False
-        for key in ("mem", "swap"):
-            limit = node_data.get("min_avail_"+key, 0)
-            total = node_data.get("stats", {}).get(key+"_total", 0)
-            val = node_data.get("stats", {}).get(key+"_avail", 0)
-            if total > 0 and val < limit:
-                return True
-        return False
+        return node_data_overloaded(node_data)
 
     def nodes_info(self):
         data = {}
@@ -1395,6 +1649,7 @@ class OsvcThread(threading.Thread, Crypt):
                 try:
                     # trigger status.json reload by the mon thread
                     CLUSTER_DATA[Env.nodename]["services"]["status"][path]["updated"] = 0
+                    LOCAL_DATA_JOURNAL.add(["services", "status", path, "updated"])
                 except KeyError:
                     pass
         wake_monitor(reason="nodes info change")
@@ -1602,6 +1857,9 @@ class OsvcThread(threading.Thread, Crypt):
         """
         data = {
             "pid": DAEMON.pid,
+            "crypto": {
+                "backend": CRYPTO_MODULE,
+            },
             "cluster": {
                 "name": self.cluster_name,
                 "id": self.cluster_id,
@@ -1620,12 +1878,9 @@ class OsvcThread(threading.Thread, Crypt):
         global DAEMON_STATUS
         global EVENT_Q
         global PATCH_ID
-        LAST_DAEMON_STATUS = json.loads(json.dumps(DAEMON_STATUS))
-        DAEMON_STATUS = self._daemon_status()
-        diff = json_delta.diff(
-            LAST_DAEMON_STATUS, DAEMON_STATUS,
-            verbose=False, array_align=False, compare_lengths=False
-        )
+        LAST_DAEMON_STATUS = DAEMON_STATUS
+        DAEMON_STATUS = snapshot.freeze(self._daemon_status(), LAST_DAEMON_STATUS)
+        diff = snapshot.diff(LAST_DAEMON_STATUS, DAEMON_STATUS)
         if not diff:
             return
         PATCH_ID += 1
@@ -1637,22 +1892,40 @@ class OsvcThread(threading.Thread, Crypt):
         })
 
     def daemon_status(self):
-        return json.loads(json.dumps(LAST_DAEMON_STATUS))
+        """
+        Return the last daemon status frozen snapshot.
+        """
+        return LAST_DAEMON_STATUS
 
     def filter_daemon_status(self, data, namespace=None, namespaces=None, selector=None):
+        """
+        Return a copy of the <data> daemon status without the objects not
+        selected. <data> is not modified, and the copy shares its unfiltered
+        subtrees.
+        """
         if selector is None:
             selector = "**"
-        keep = self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces)
-        for node in [n for n in data.get("monitor", {}).get("nodes", {})]:
-            for path in [p for p in data["monitor"]["nodes"][node].get("services", {}).get("status", {})]:
-                if path not in keep:
-                    del data["monitor"]["nodes"][node]["services"]["status"][path]
-            for path in [p for p in data["monitor"]["nodes"][node].get("services", {}).get("config", {})]:
-                if path not in keep:
-                    del data["monitor"]["nodes"][node]["services"]["config"][path]
-        for path in [p for p in data.get("monitor", {}).get("services", {})]:
-            if path not in keep:
-                del data["monitor"]["services"][path]
+        keep = set(self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces))
+
+        def filter_paths(pdata):
+            return dict((path, _pdata) for path, _pdata in pdata.items() if path in keep)
+
+        data = dict(data)
+        if "monitor" not in data:
+            return data
+        monitor = data["monitor"] = dict(data["monitor"])
+        if "nodes" in monitor:
+            nodes = monitor["nodes"] = dict(monitor["nodes"])
+            for node, ndata in list(nodes.items()):
+                if "services" not in ndata:
+                    continue
+                ndata = nodes[node] = dict(ndata)
+                services = ndata["services"] = dict(ndata["services"])
+                for key in ("status", "config"):
+                    if key in services:
+                        services[key] = filter_paths(services[key])
+        if "services" in monitor:
+            monitor["services"] = filter_paths(monitor["services"])
         return data
 
     def match_object_selector(self, selector=None, namespace=None, namespaces=None, path=None):
@@ -1778,7 +2051,7 @@ class OsvcThread(threading.Thread, Crypt):
         path.
         """
         try:
-            data = AGG[path]
+            data = Storage(AGG[path])
             data["nodes"] = {}
         except KeyError:
             return
@@ -0,0 +1,168 @@
+"""
+Immutable, structurally shared snapshots of the daemon datasets.
+
+A new snapshot version is derived from the previous one by re-freezing
+only the changed subtrees. The unchanged subtrees are shared between
+versions, so readers can hold a version without copying it, and the
+differences between two versions can be computed by identity.
+"""
+
+
+class FrozenError(TypeError):
+    pass
+
+
+def _frozen(*args, **kwargs):
+    raise FrozenError("snapshot data can not be modified")
+
+
+class FrozenDict(dict):
+    """
+    A dict refusing modifications. Use dict(frozen) for a mutable shallow
+    copy.
+    """
+    __setitem__ = _frozen
+    __delitem__ = _frozen
+    clear = _frozen
+    pop = _frozen
+    popitem = _frozen
+    setdefault = _frozen
+    update = _frozen
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    """
+    A list refusing modifications. Use list(frozen) for a mutable shallow
+    copy.
+    """
+    __setitem__ = _frozen
+    __delitem__ = _frozen
+    __iadd__ = _frozen
+    __imul__ = _frozen
+    append = _frozen
+    extend = _frozen
+    insert = _frozen
+    pop = _frozen
+    remove = _frozen
+    reverse = _frozen
+    sort = _frozen
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+FROZEN = (FrozenDict, FrozenList)
+EMPTY = FrozenDict()
+
+
+def freeze(data, previous=None):
+    """
+    Return a frozen version of <data>, reusing the subtrees of the
+    <previous> frozen version equal to their <data> counterpart.
+
+    Already frozen subtrees of <data> are reused as-is.
+    """
+    if isinstance(data, FROZEN):
+        return data
+    if isinstance(data, dict):
+        if not isinstance(previous, FrozenDict):
+            previous = None
+        same = previous is not None and len(previous) == len(data)
+        items = {}
+        for key, value in data.items():
+            prev = None if previous is None else previous.get(key)
+            value = freeze(value, prev)
+            if same and (value is not prev or key not in previous):
+                same = False
+            items[key] = value
+        if same:
+            return previous
+        return FrozenDict(items)
+    if isinstance(data, (list, tuple)):
+        if not isinstance(previous, FrozenList):
+            previous = None
+        same = previous is not None and len(previous) == len(data)
+        items = []
+        for idx, value in enumerate(data):
+            prev = previous[idx] if same else None
+            value = freeze(value, prev)
+            if same and value is not prev:
+                same = False
+            items.append(value)
+        if same:
+            return previous
+        return FrozenList(items)
+    if previous is not None and type(previous) == type(data) and previous == data:
+        return previous
+    return data
+
+
+def update(snapshot, data, paths):
+    """
+    Return a new version of the <snapshot> frozen view of <data>, with the
+    subtrees at <paths> refreshed. The other subtrees are shared with
+    <snapshot>.
+    """
+    paths = [tuple(path) for path in paths]
+    if not isinstance(snapshot, FrozenDict) or not isinstance(data, dict) or \
+       any(len(path) == 0 for path in paths):
+        return freeze(data, snapshot)
+    groups = {}
+    for path in paths:
+        groups.setdefault(path[0], []).append(path[1:])
+    items = None
+    for key, subpaths in groups.items():
+        if key in data:
+            value = update(snapshot.get(key), data[key], subpaths)
+            if key in snapshot and value is snapshot[key]:
+                continue
+            if items is None:
+                items = dict(snapshot)
+            items[key] = value
+        elif key in snapshot:
+            if items is None:
+                items = dict(snapshot)
+            del items[key]
+    if items is None:
+        return snapshot
+    return FrozenDict(items)
+
+
+def diff(old, new, path=None):
+    """
+    Return the json_delta formatted changes from the <old> to the <new>
+    snapshot versions. The subtrees shared by both versions are not walked.
+    """
+    if path is None:
+        path = []
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key, value in new.items():
+            if key in old:
+                changes += diff(old[key], value, path + [key])
+            else:
+                changes.append([path + [key], value])
+        for key in old:
+            if key not in new:
+                changes.append([path + [key]])
+        return changes
+    if type(old) == type(new) and old == new:
+        return []
+    return [[path, new]]
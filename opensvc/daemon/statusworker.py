@@ -0,0 +1,222 @@
+"""
+Object status evaluation workers.
+
+A status worker is a long-lived python process with the node and the
+object drivers already loaded, reading status refresh requests on its
+stdin, one json document per line, evaluating the object status and
+writing its status.json like "om <path> status --refresh" does, then
+answering one json document per line on its stdout.
+
+The daemon monitor feeds a pool of such workers through a StatusWorkers
+pool, instead of spawning an "om" process for each status refresh.
+Refresh requests for an object already queued are coalesced, and a refresh
+requested while the same object is being evaluated is executed again
+after the running evaluation.
+"""
+import json
+import os
+import select
+import sys
+import threading
+from subprocess import Popen, PIPE
+
+from env import Env
+from utilities.string import bdecode
+from .workers import WorkerPool
+
+
+class StatusWorkers(WorkerPool):
+    """
+    A pool of <size> status worker processes, each driven by a pool
+    thread, with at most <queue_size> refreshes queued.
+    """
+    timeout = 600
+
+    def __init__(self, size=2, queue_size=1024, on_done=None, log=None, exists=None):
+        WorkerPool.__init__(self, "status", size=size, queue_size=queue_size,
+                            on_done=on_done, log=log)
+        self.exists = exists
+        self.local = threading.local()
+        self.procs = []
+        self.rerun = set()
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def refresh(self, path):
+        """
+        Ask for a <path> status refresh. Return False if the refresh can not
+        be queued, in which case the caller is expected to fallback to a
+        "om <path> status --refresh" command.
+        """
+        with self.lock:
+            if path in self.active:
+                self.rerun.add(path)
+                return True
+            if path in self.pending:
+                # coalesce with the queued refresh
+                return True
+        return self.submit([path], self.eval_status, path)
+
+    def discard(self, path):
+        """
+        Forget the rerun of a deleted object. Its queued refresh is dropped
+        by eval_status().
+        """
+        with self.lock:
+            self.rerun.discard(path)
+
+    def completed(self):
+        done = WorkerPool.completed(self)
+        with self.lock:
+            rerun = [path for path in self.rerun if path not in self.active]
+        for path in rerun:
+            if self.submit([path], self.eval_status, path) or self.is_pending(path):
+                with self.lock:
+                    self.rerun.discard(path)
+        return done
+
+    def stop(self):
+        WorkerPool.stop(self)
+        with self.lock:
+            procs, self.procs = self.procs, []
+        for proc in procs:
+            self.kill(proc)
+
+    @staticmethod
+    def kill(proc):
+        try:
+            proc.kill()
+        except OSError:
+            pass
+        try:
+            proc.communicate()
+        except (OSError, ValueError):
+            pass
+
+    def spawn(self):
+        env = os.environ.copy()
+        env["OSVC_ACTION_ORIGIN"] = "daemon"
+        proc = Popen(Env.python_cmd + ["-m", Env.package + ".daemon.statusworker"],
+                     stdin=PIPE, stdout=PIPE, close_fds=True, env=env)
+        with self.lock:
+            self.procs.append(proc)
+        if self.log:
+            self.log.info("started status worker pid %d", proc.pid)
+        return proc
+
+    def forget(self, proc):
+        with self.lock:
+            if proc in self.procs:
+                self.procs.remove(proc)
+        self.kill(proc)
+        self.local.proc = None
+
+    def eval_status(self, path):
+        """
+        Send the <path> status refresh request to this thread status worker
+        process, spawned if not already running, and return the worker
+        response.
+
+        The refreshes of objects deleted since queued are dropped.
+        """
+        if self.exists is not None and not self.exists(path):
+            return {"path": path, "status": 1, "error": "not found"}
+        proc = getattr(self.local, "proc", None)
+        if proc is None or proc.poll() is not None:
+            proc = self.local.proc = self.spawn()
+        try:
+            proc.stdin.write((json.dumps({"path": path}) + "\n").encode())
+            proc.stdin.flush()
+            if os.name != "nt":
+                ready, _, _ = select.select([proc.stdout], [], [], self.timeout)
+                if not ready:
+                    raise IOError("status worker pid %d timeout" % proc.pid)
+            line = proc.stdout.readline()
+        except (IOError, OSError, ValueError):
+            self.forget(proc)
+            raise
+        if not line:
+            self.forget(proc)
+            raise IOError("status worker pid %d died" % proc.pid)
+        return json.loads(bdecode(line))
+
+    def status(self):
+        data = WorkerPool.status(self)
+        data["procs"] = len(self.procs)
+        return data
+
+
+#############################################################################
+#
+# Worker process side
+#
+#############################################################################
+def node_config_mtime():
+    mtimes = []
+    for fpath in (Env.paths.nodeconf, Env.paths.clusterconf):
+        try:
+            mtimes.append(os.path.getmtime(fpath))
+        except OSError:
+            mtimes.append(0)
+    return mtimes
+
+
+def eval_status(node, path):
+    from utilities.naming import factory, split_path, svc_pathcf
+    if not os.path.exists(svc_pathcf(path)):
+        # don't recreate a deleted object
+        return {"path": path, "status": 1, "error": "not found"}
+    name, namespace, kind = split_path(path)
+    try:
+        svc = factory(kind)(name, namespace, node=node)
+    except Exception as exc:
+        return {"path": path, "status": 1, "error": "build: %s" % exc}
+    svc.options.refresh = True
+    svc.options.waitlock = 0
+    try:
+        svc.print_status_data(refresh=True)
+    except Exception as exc:
+        return {"path": path, "status": 1, "error": str(exc)}
+    return {"path": path, "status": 0}
+
+
+def main():
+    # the responses channel. the evaluation stray outputs go to stderr.
+    out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    from core.node import Node
+    from utilities.cache import purge_cache
+    # preload the object classes before the first request
+    import core.objects.svc  # pylint: disable=unused-import
+
+    node = None
+    mtime = None
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        try:
+            path = json.loads(line)["path"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        current_mtime = node_config_mtime()
+        if node is None or current_mtime != mtime:
+            if node is not None:
+                node.close()
+            node = Node()
+            mtime = current_mtime
+        purge_cache()
+        result = eval_status(node, path)
+        out.write((json.dumps(result) + "\n").encode())
+        out.flush()
+    if node is not None:
+        node.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+Watcher Thread
+
+Track the objects configuration files, status.json and frozen flag changes,
+feed the shared CONFIG_DIRTY and STATUS_DIRTY sets and wake the monitor, so
+the monitor only rescans the changed objects.
+
+Use inotify on Linux, and fall back to polling the files mtime elsewhere or
+if the inotify watches can not be set up.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+import daemon.shared as shared
+from env import Env
+from utilities.naming import fmt_path, list_services, split_path, svc_pathcf, svc_pathvar
+from utilities.string import bencode, bdecode
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+ROOT_KINDS = ("vol", "cfg", "sec", "usr")
+KINDS = ("svc", "vol", "cfg", "sec", "usr", "ccfg", "nscfg")
+STATUS_FILES = ("status.json", "frozen")
+
+
+def rel_parts(path, base):
+    """
+    Return the list of <path> components relative to <base>, or None if
+    <path> is not <base> or one of its descendants.
+    """
+    if path == base:
+        return []
+    base = os.path.join(base, "")
+    if not path.startswith(base):
+        return
+    return path[len(base):].split(os.sep)
+
+
+def config_path(fpath):
+    """
+    Return the path of the object configured by the <fpath> file, or None.
+    """
+    if not fpath.endswith(".conf"):
+        return
+    parts = rel_parts(fpath, Env.paths.pathetcns)
+    if parts is not None:
+        if len(parts) == 2 and parts[1] == "namespace.conf":
+            return fmt_path("namespace", parts[0], "nscfg")
+        if len(parts) == 3:
+            return fmt_path(parts[2][:-5], parts[0], parts[1])
+        return
+    parts = rel_parts(fpath, Env.paths.pathetc)
+    if parts is None:
+        return
+    if len(parts) == 2 and parts[0] in ROOT_KINDS:
+        return fmt_path(parts[1][:-5], None, parts[0])
+    if len(parts) != 1:
+        return
+    try:
+        return fmt_path(*split_path(parts[0][:-5]))
+    except ValueError:
+        return
+
+
+def status_path(fpath):
+    """
+    Return the path of the object whose status is changed by a <fpath>
+    file change, or None.
+    """
+    if os.path.basename(fpath) not in STATUS_FILES:
+        return
+    parts = rel_parts(fpath, os.path.join(Env.paths.pathvar, "namespaces"))
+    if parts is not None:
+        if len(parts) == 4:
+            return fmt_path(parts[2], parts[0], parts[1])
+        return
+    parts = rel_parts(fpath, Env.paths.pathvar)
+    if parts is not None and len(parts) == 3 and parts[0] in KINDS:
+        return fmt_path(parts[1], None, parts[0])
+
+
+def want_watch(dpath):
+    """
+    Return True if the <dpath> directory may contain, or lead to, files
+    tracked by the watcher.
+    """
+    parts = rel_parts(dpath, Env.paths.pathetcns)
+    if parts is not None:
+        return len(parts) <= 2
+    parts = rel_parts(dpath, Env.paths.pathetc)
+    if parts is not None:
+        return len(parts) == 0 or (len(parts) == 1 and parts[0] in ROOT_KINDS)
+    parts = rel_parts(dpath, os.path.join(Env.paths.pathvar, "namespaces"))
+    if parts is not None:
+        return len(parts) <= 3
+    parts = rel_parts(dpath, Env.paths.pathvar)
+    if parts is not None:
+        return len(parts) == 0 or parts == ["node"] or \
+               (len(parts) <= 2 and parts[0] in KINDS)
+    return False
+
+
+class Inotify(object):
+    """
+    A minimal ctypes binding of the Linux inotify api.
+    """
+    def __init__(self):
+        libc = ctypes.util.find_library("c")
+        if libc is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self.libc = ctypes.CDLL(libc, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify not supported")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.wds = {}
+
+    def add_watch(self, dpath):
+        wd = self.libc.inotify_add_watch(self.fd, ctypes.c_char_p(bencode(dpath)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dpath)
+        self.wds[wd] = dpath
+
+    def read(self, timeout):
+        """
+        Return the list of (<directory>, <mask>, <name>) events received
+        within <timeout> seconds.
+        """
+        events = []
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error:
+            return events
+        if not ready:
+            return events
+        try:
+            buff = os.read(self.fd, 65536)
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return events
+            raise
+        offset = 0
+        while offset < len(buff):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buff, offset)
+            offset += EVENT_HEADER.size
+            name = bdecode(buff[offset:offset+length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            events.append((self.wds.get(wd), mask, name))
+        return events
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+        self.wds = {}
+
+
+class Watcher(shared.OsvcThread):
+    """
+    The thread tracking the objects configuration and status files changes.
+    """
+    name = "watcher"
+    error_delay = 1
+    read_timeout = 1
+
+    def run(self):
+        self.set_tid()
+        self.log = logging.LoggerAdapter(logging.getLogger(Env.nodename+".osvcd.watcher"), {"node": Env.nodename, "component": self.name})
+        self.inotify = None
+        self.mtimes = {}
+        self.node_frozen = None
+        self.last_poll = 0
+        self.watch_failed = False
+        self.setup()
+        try:
+            while True:
+                try:
+                    self.do()
+                except Exception as exc:
+                    self.log.exception(exc)
+                    time.sleep(self.error_delay)
+                if self.stopped():
+                    break
+        finally:
+            shared.CONFIG_DIRTY.track(False)
+            shared.STATUS_DIRTY.track(False)
+            if self.inotify:
+                self.inotify.close()
+        sys.exit(0)
+
+    def setup(self):
+        if Env.sysname == "Linux":
+            try:
+                self.inotify = Inotify()
+                for dpath in (Env.paths.pathetc, Env.paths.pathvar):
+                    self.add_watches(dpath)
+                self.log.info("watching %d directories", len(self.inotify.wds))
+            except OSError as exc:
+                self.log.warning("inotify setup failed: %s. fallback to polling", exc)
+                if self.inotify:
+                    self.inotify.close()
+                self.inotify = None
+        if self.inotify is None:
+            self.poll(track=False)
+        # the changes before the watches setup are caught by the full
+        # rescan forced by track()
+        shared.CONFIG_DIRTY.track()
+        shared.STATUS_DIRTY.track()
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify else "poll"
+
+    def status(self, **kwargs):
+        data = shared.OsvcThread.status(self, **kwargs)
+        data["mode"] = self.mode
+        if self.inotify:
+            data["watches"] = len(self.inotify.wds)
+        return data
+
+    def do(self):
+        if self.inotify:
+            self.watch()
+            return
+        time.sleep(self.read_timeout)
+        if time.time() >= self.last_poll + self.watcher_poll_interval:
+            self.poll()
+
+    #########################################################################
+    #
+    # inotify mode
+    #
+    #########################################################################
+    def add_watches(self, dpath, scan=False):
+        """
+        Add a watch on <dpath> and its relevant subdirectories, and return
+        the number of changes found. With <scan>, also handle the files
+        already there as changed, because they may have been created
+        before the watch was set.
+
+        Without <scan>, at setup, the watch errors are raised so the caller
+        can fall back to polling. With <scan>, a directory that can not be
+        watched, for example when the max_user_watches limit is reached,
+        asks for a full rescan.
+        """
+        if not want_watch(dpath):
+            return 0
+        try:
+            self.inotify.add_watch(dpath)
+        except OSError as exc:
+            if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+                return 0
+            if not scan:
+                raise
+            if not self.watch_failed:
+                self.log.warning("%s. changes in this directory are caught by the "
+                                 "periodic full rescans only", exc)
+                self.watch_failed = True
+            shared.CONFIG_DIRTY.invalidate()
+            shared.STATUS_DIRTY.invalidate()
+            return 1
+        try:
+            entries = os.listdir(dpath)
+        except OSError:
+            return 0
+        changes = 0
+        for entry in entries:
+            fpath = os.path.join(dpath, entry)
+            if os.path.isdir(fpath):
+                changes += self.add_watches(fpath, scan=scan)
+            elif scan:
+                changes += self.on_file_change(fpath)
+        return changes
+
+    def watch(self):
+        changes = 0
+        for dpath, mask, name in self.inotify.read(self.read_timeout):
+            if mask & IN_Q_OVERFLOW:
+                self.log.warning("inotify queue overflow. ask for a full rescan")
+                shared.CONFIG_DIRTY.invalidate()
+                shared.STATUS_DIRTY.invalidate()
+                changes += 1
+                continue
+            if dpath is None or not name:
+                continue
+            fpath = os.path.join(dpath, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changes += self.add_watches(fpath, scan=True)
+                continue
+            changes += self.on_file_change(fpath)
+        if changes:
+            shared.wake_monitor(reason="%d object files changed" % changes)
+
+    def on_file_change(self, fpath):
+        path = config_path(fpath)
+        if path is not None:
+            shared.CONFIG_DIRTY.add(path)
+            return 1
+        path = status_path(fpath)
+        if path is not None:
+            shared.STATUS_DIRTY.add(path)
+            return 1
+        if fpath == os.path.join(Env.paths.pathvar, "node", "frozen"):
+            # all instances inherit the node frozen state
+            shared.STATUS_DIRTY.invalidate()
+            return 1
+        return 0
+
+    #########################################################################
+    #
+    # polling mode
+    #
+    #########################################################################
+    @staticmethod
+    def getmtime(fpath):
+        try:
+            return os.path.getmtime(fpath)
+        except (OSError, IOError):
+            return 0
+
+    def poll(self, track=True):
+        """
+        Compare the objects files mtime with the previous poll, and mark
+        the changed objects dirty.
+        """
+        self.last_poll = time.time()
+        changes = 0
+        mtimes = {}
+        for path in list_services():
+            config_mtime = self.getmtime(svc_pathcf(path))
+            status_mtime = max([self.getmtime(svc_pathvar(path, fname)) for fname in STATUS_FILES])
+            mtimes[path] = (config_mtime, status_mtime)
+            if not track:
+                continue
+            last = self.mtimes.get(path)
+            if last is None or last[0] != config_mtime:
+                shared.CONFIG_DIRTY.add(path)
+                changes += 1
+            if last is None or last[1] != status_mtime:
+                shared.STATUS_DIRTY.add(path)
+                changes += 1
+        if track:
+            for path in set(self.mtimes) - set(mtimes):
+                shared.CONFIG_DIRTY.add(path)
+                shared.STATUS_DIRTY.add(path)
+                changes += 1
+        self.mtimes = mtimes
+        node_frozen = self.getmtime(os.path.join(Env.paths.pathvar, "node", "frozen"))
+        if track and node_frozen != self.node_frozen:
+            shared.STATUS_DIRTY.invalidate()
+            changes += 1
+        self.node_frozen = node_frozen
+        if changes:
+            shared.wake_monitor(reason="%d object files changed" % changes)
@@ -0,0 +1,134 @@
+"""
+A bounded pool of worker threads, executing the blocking jobs submitted by
+a daemon thread, so the submitter loop is not stalled by slow peers or
+slow commands.
+
+The submitter passes the set of keys a job works on, and a key can not be
+submitted again until the job completion is collected by the submitter.
+"""
+import threading
+
+from foreign.six.moves import queue
+
+
+class WorkerPool(object):
+    """
+    A pool of <size> worker threads consuming a job queue bounded to
+    <queue_size> jobs.
+    """
+    def __init__(self, name, size=4, queue_size=64, on_done=None, log=None):
+        self.name = name
+        self.size = size
+        self.on_done = on_done
+        self.log = log
+        self.jobs = queue.Queue(queue_size)
+        self.results = queue.Queue()
+        self.lock = threading.RLock()
+        self.pending = set()
+        self.active = set()
+        self.running = 0
+        self.threads = []
+
+    def start(self):
+        with self.lock:
+            self.threads = [thr for thr in self.threads if thr.is_alive()]
+            for idx in range(len(self.threads), self.size):
+                thr = threading.Thread(target=self.work, name="%s worker %d" % (self.name, idx))
+                thr.daemon = True
+                thr.start()
+                self.threads.append(thr)
+
+    def stop(self):
+        """
+        Ask the workers to exit after their current job. The queued jobs
+        are dropped.
+        """
+        with self.lock:
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in self.threads:
+                try:
+                    self.jobs.put_nowait(None)
+                except queue.Full:
+                    break
+            self.threads = []
+
+    def is_pending(self, key):
+        with self.lock:
+            return key in self.pending
+
+    def is_active(self, key):
+        """
+        Return True if a job working on <key> is being executed.
+        """
+        with self.lock:
+            return key in self.active
+
+    def submit(self, keys, fn, *args, **kwargs):
+        """
+        Queue the fn(*args, **kwargs) job working on <keys>. Return False if
+        one of the keys is already pending or if the queue is full.
+        """
+        keys = set(keys)
+        with self.lock:
+            if keys & self.pending:
+                return False
+            try:
+                self.jobs.put_nowait((keys, fn, args, kwargs))
+            except queue.Full:
+                return False
+            self.pending |= keys
+        self.start()
+        return True
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            keys, fn, args, kwargs = job
+            with self.lock:
+                self.running += 1
+                self.active |= keys
+            try:
+                result = fn(*args, **kwargs)
+                error = None
+            except Exception as exc:
+                if self.log:
+                    self.log.exception(exc)
+                result = None
+                error = exc
+            with self.lock:
+                self.running -= 1
+                self.active -= keys
+            self.results.put((keys, result, error))
+            if self.on_done:
+                self.on_done()
+
+    def completed(self):
+        """
+        Return the list of (<keys>, <result>, <error>) of the jobs completed
+        since the last call, and release their keys.
+        """
+        done = []
+        while True:
+            try:
+                keys, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.pending -= keys
+            done.append((keys, result, error))
+        return done
+
+    def status(self):
+        with self.lock:
+            return {
+                "workers": len(self.threads),
+                "running": self.running,
+                "queued": self.jobs.qsize(),
+                "pending": len(self.pending),
+            }
@@ -91,6 +91,7 @@ class Paths(object):
 
         self.daemon_pid = os.path.join(self.pathvar, "osvcd.pid")
         self.daemon_pid_args = os.path.join(self.pathvar, "osvcd.pid.args")
+        self.daemon_warm_snapshot = os.path.join(self.pathvar, "osvcd.warm.json")
         self.daemon_lock = os.path.join(self.pathlock, "osvcd.lock")
 
         self.tmp_prepared = False
@@ -36,6 +36,7 @@ def osvc_path_tests_fixture(tmpdir):
     env.Env.paths.lsnruxh2sock = os.path.join(test_dir, 'var', 'lsnr', 'h2.sock')
     env.Env.paths.daemon_pid = os.path.join(test_dir, 'var', "osvcd.pid")
     env.Env.paths.daemon_pid_args = os.path.join(test_dir, 'var', "osvcd.pid.args")
+    env.Env.paths.daemon_warm_snapshot = os.path.join(test_dir, 'var', "osvcd.warm.json")
     os.makedirs(os.path.join(env.Env.paths.pathvar, 'lsnr'))
     os.makedirs(os.path.join(env.Env.paths.pathvar, 'node'))
     os.makedirs(env.Env.paths.pathtmpv)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import foreign.pyaes as pyaes
+from core.aes import (Backend, PyaesBackend, available_backends, benchmark,
+                      get_backend)
+
+KEY = b"0123456789abcdef0123456789abcdef"
+IV = b"fedcba9876543210"
+
+
+def reference_encrypt(message):
+    obj = pyaes.Encrypter(pyaes.AESModeOfOperationCBC(KEY, iv=IV))
+    return obj.feed(message) + obj.feed()
+
+
+@pytest.mark.ci
+class TestAesBackends:
+    @staticmethod
+    @pytest.mark.parametrize("backend_class", available_backends())
+    @pytest.mark.parametrize("size", [1, 15, 16, 1000])
+    def test_backends_are_interoperable(backend_class, size):
+        backend = backend_class()
+        message = os.urandom(size)
+        ciphertext = backend.encrypt(message, KEY, IV)
+        assert ciphertext == reference_encrypt(message)
+        assert backend.decrypt(ciphertext, KEY, IV) == message
+
+    @staticmethod
+    def test_key_schedule_is_cached(mocker):
+        backend = PyaesBackend()
+        make_schedule = mocker.spy(backend, "make_schedule")
+        backend.encrypt(b"a", KEY, IV)
+        backend.encrypt(b"b", KEY.decode(), IV)
+        assert make_schedule.call_count == 1
+
+    @staticmethod
+    def test_unknown_backend_name_selects_the_preferred_backend():
+        assert get_backend("unknown").name == available_backends()[0].name
+        assert get_backend("pyaes").name == "pyaes"
+
+    @staticmethod
+    def test_unavailable_backends_are_skipped():
+        assert Backend not in available_backends()
+        assert PyaesBackend in available_backends()
+
+    @staticmethod
+    def test_benchmark_reports_each_backend_and_size():
+        data = benchmark(sizes=(64, 128), duration=0.01)
+        assert len(data) == 2 * len(available_backends())
+        assert data[0]["size"] == 64
+        assert data[0]["encrypt"] > 0
@@ -1,13 +1,16 @@
 import json
+import os
 import socket
 import uuid
 import time
 
 import pytest
 
-from core.comm import Crypt, PAUSE, SOCK_TMO_REQUEST
+from core.comm import (Crypt, H2Pool, PAUSE, SOCK_TMO_REQUEST, binary_message_created,
+                       binary_message_len, is_binary_message)
 from core.node import Node
 from env import Env
+from utilities.lazy import set_lazy
 
 MSG_TIMEOUT_CONNECT = 'timeout daemon request (connect error)'
 MSG_TIMEOUT_RECV = 'timeout daemon request (recv_message error)'
@@ -200,3 +203,133 @@ class TestClusterNodes:
     def test_is_array_with_nodename(mocker):
         mocker.patch.object(Crypt, 'get_node', return_value=Node())
         assert Crypt().cluster_nodes == [Env.nodename]
+
+
+@pytest.fixture()
+def keyed_crypt(mocker):
+    crypt = Crypt()
+    crypt.log = mocker.Mock(name='log')
+    set_lazy(crypt, 'cluster_name', 'demo')
+    set_lazy(crypt, 'cluster_names', set(['demo']))
+    set_lazy(crypt, 'cluster_drpnodes', [])
+    set_lazy(crypt, 'cluster_key', b'0123456789abcdef0123456789abcdef')
+    return crypt
+
+
+@pytest.mark.ci
+class TestMessageEnvelope:
+    @staticmethod
+    def test_binary_envelope_roundtrip(keyed_crypt):
+        data = {"gen": {"node1": 3}, "updated": 1.5}
+        message = keyed_crypt.encrypt(data, binary=True)
+        assert is_binary_message(message)
+        assert binary_message_len(message) == len(message)
+        assert abs(binary_message_created(message) - time.time()) < 5
+        assert keyed_crypt.decrypt(message) == ("demo", Env.nodename, data)
+
+    @staticmethod
+    def test_legacy_envelope_roundtrip(keyed_crypt):
+        data = {"gen": {"node1": 3}}
+        message = keyed_crypt.encrypt(data)
+        assert not is_binary_message(message)
+        assert message.endswith(b"\0")
+        assert keyed_crypt.decrypt(message) == ("demo", Env.nodename, data)
+
+    @staticmethod
+    def test_binary_envelope_from_foreign_cluster_is_discarded(keyed_crypt):
+        message = keyed_crypt.encrypt({"a": 1}, cluster_name="other", binary=True)
+        assert keyed_crypt.decrypt(message) == (None, None, None)
+
+
+class FakeSock(object):
+    def __init__(self):
+        self.can_read = False
+
+    def settimeout(self, timeout):
+        pass
+
+
+class FakeConn(object):
+    def __init__(self):
+        self._sock = FakeSock()
+        self.closed = False
+
+    def _single_read(self):
+        raise ConnectionResetError()
+
+    def close(self):
+        self.closed = True
+        self._sock = None
+
+
+@pytest.mark.ci
+class TestH2Pool:
+    @staticmethod
+    def test_idle_connections_are_reused_per_key():
+        pool = H2Pool()
+        conn, reused = pool.get("n1", FakeConn)
+        assert not reused
+        pool.put("n1", conn)
+        assert pool.get("n2", FakeConn)[0] is not conn
+        assert pool.get("n1", FakeConn) == (conn, True)
+        assert pool.status() == {"created": 2, "reused": 1, "discarded": 0, "idle": 0}
+
+    @staticmethod
+    def test_connections_closed_by_the_peer_are_dropped():
+        pool = H2Pool()
+        conn = FakeConn()
+        pool.put("n1", conn)
+        conn._sock.can_read = True
+        new, reused = pool.get("n1", FakeConn)
+        assert new is not conn
+        assert not reused
+        assert conn.closed
+        assert pool.status()["discarded"] == 1
+
+    @staticmethod
+    def test_connections_without_the_hyper_internals_are_not_reused():
+        pool = H2Pool()
+        conn = FakeConn()
+        del conn._sock.can_read
+        pool.put("n1", conn)
+        assert conn.closed
+        assert pool.status() == {"created": 0, "reused": 0, "discarded": 1, "idle": 0}
+        conn = FakeConn()
+        pool.put("n1", conn)
+        del conn._sock.can_read
+        new, reused = pool.get("n1", FakeConn)
+        assert new is not conn
+        assert not reused
+        assert conn.closed
+
+    @staticmethod
+    def test_expired_connections_are_closed(mocker):
+        pool = H2Pool(idle_timeout=60)
+        conn = FakeConn()
+        pool.put("n1", conn)
+        mocker.patch.object(time, "time", return_value=time.time() + 61)
+        assert pool.get("n1", FakeConn)[0] is not conn
+        assert conn.closed
+
+    @staticmethod
+    def test_idle_connections_are_capped():
+        pool = H2Pool(max_idle=1)
+        conns = [FakeConn(), FakeConn()]
+        for conn in conns:
+            pool.put("n1", conn)
+        assert conns[0].closed
+        assert pool.status()["idle"] == 1
+        pool.clear()
+        assert conns[1].closed
+
+    @staticmethod
+    def test_connections_inherited_from_the_parent_are_dropped(mocker):
+        pool = H2Pool()
+        conn = FakeConn()
+        pool.put("n1", conn)
+        mocker.patch.object(os, "getpid", return_value=pool.pid + 1)
+        new, reused = pool.get("n1", FakeConn)
+        assert new is not conn
+        assert not reused
+        assert not conn.closed
+        assert pool.status()["idle"] == 0
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import daemon.shared as shared
+from daemon.handlers.object.configs.get import Handler as GetObjectConfigs
+from env import Env
+from utilities.files import fsum
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestGetObjectConfigs:
+    @staticmethod
+    def test_return_configs_of_all_paths(thr):
+        os.makedirs(Env.paths.pathetc)
+        cf = os.path.join(Env.paths.pathetc, 'svc1.conf')
+        with open(cf, 'w') as ofile:
+            ofile.write('[DEFAULT]\nid = abc\n')
+        response = GetObjectConfigs().action('node2', thr=thr, options={'paths': ['svc1', 'svc2']})
+        assert response['status'] == 0
+        assert response['data']['svc1'] == {
+            'status': 0,
+            'data': '[DEFAULT]\nid = abc\n',
+            'mtime': os.path.getmtime(cf),
+            'csum': fsum(cf),
+        }
+        assert response['data']['svc2']['status'] == 3
+
+    @staticmethod
+    def test_refuse_deleting_objects(thr, mocker):
+        mocker.patch.dict(shared.SMON_DATA, {'svc1': {'status': 'deleting'}})
+        response = GetObjectConfigs().action('node2', thr=thr, options={'paths': ['svc1']})
+        assert response['data']['svc1']['status'] == 2
@@ -0,0 +1,50 @@
+import pytest
+
+import daemon.shared as shared
+from daemon.handlers.relay.slots.get import Handler as GetRelaySlots
+from daemon.handlers.relay.tx.post import Handler as PostRelayTx
+
+
+@pytest.fixture(scope='function')
+def relay(mocker):
+    mocker.patch.object(shared, 'RELAY_DATA', {})
+    mocker.patch.object(shared, 'RELAY_VERSIONS', {})
+
+
+def relay_tx(thr, nodename, cluster_id, msg):
+    PostRelayTx().action(nodename, thr=thr, options={'cluster_id': cluster_id, 'msg': msg})
+
+
+def relay_slots(thr, **options):
+    return GetRelaySlots().action('node1', thr=thr, options=options)
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests', 'relay')
+class TestGetRelaySlots:
+    @staticmethod
+    def test_return_slots_written_since_version(thr):
+        relay_tx(thr, 'node1', 'c1', 'm1')
+        relay_tx(thr, 'node2', 'c1', 'm2')
+        relay_tx(thr, 'node3', 'c2', 'm3')
+        response = relay_slots(thr, cluster_id='c1')
+        assert response['version'] == 2
+        assert sorted(response['slots']) == ['node1', 'node2']
+        assert response['slots']['node2']['data'] == 'm2'
+
+        epoch = response['epoch']
+        relay_tx(thr, 'node2', 'c1', 'm2bis')
+        response = relay_slots(thr, cluster_id='c1', version=2, epoch=epoch)
+        assert response['version'] == 3
+        assert list(response['slots']) == ['node2']
+        assert response['slots']['node2']['data'] == 'm2bis'
+
+        response = relay_slots(thr, cluster_id='c1', version=3, epoch=epoch)
+        assert response == {'status': 0, 'epoch': epoch, 'version': 3, 'slots': {}}
+
+    @staticmethod
+    def test_return_all_slots_on_epoch_change(thr):
+        relay_tx(thr, 'node1', 'c1', 'm1')
+        relay_tx(thr, 'node2', 'c1', 'm2')
+        response = relay_slots(thr, cluster_id='c1', version=2, epoch='old', slots=['node2'])
+        assert list(response['slots']) == ['node2']
@@ -0,0 +1,326 @@
+import time
+
+import pytest
+
+import daemon.shared as shared
+from core.node import Node
+from daemon.hb.hb import Hb
+from daemon.hb.relay import HbRelayRx
+from env import Env
+
+
+@pytest.fixture(scope='function')
+def hb(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = Hb("hb#1", role="rx")
+    thr.log = mocker.MagicMock()
+    thr.hb_nodes = [Env.nodename, "node2"]
+    mocker.patch.object(shared, "GEN_DIFF", {})
+    mocker.patch.object(shared, "CLUSTER_DATA", {"node2": {"compat": shared.COMPAT_VERSION}})
+    mocker.patch.object(shared, "REMOTE_GEN", {})
+    mocker.patch.object(shared, "LOCAL_GEN", {})
+    mocker.patch.object(shared, "publish_cluster_snapshot")
+    yield thr
+
+
+@pytest.mark.ci
+class TestHbDeltas:
+    @staticmethod
+    def test_consecutive_deltas_are_coalesced(hb):
+        shared.GEN_DIFF.update({
+            3: [[["monitor", "updated"], 3]],
+            4: [[["monitor", "updated"], 4], [["labels", "az"], "fr1"]],
+            5: [[["monitor", "updated"], 5]],
+        })
+        assert hb.get_deltas(2) == ({5: [[["labels", "az"], "fr1"], [["monitor", "updated"], 5]]}, 2)
+        assert hb.get_deltas(4) == ({5: [[["monitor", "updated"], 5]]}, None)
+
+    @staticmethod
+    def test_deltas_are_not_coalesced_for_old_peers(hb):
+        shared.CLUSTER_DATA["node2"]["compat"] = 10
+        shared.GEN_DIFF.update({
+            4: [[["monitor", "updated"], 4]],
+            5: [[["monitor", "updated"], 5]],
+        })
+        assert hb.get_deltas(3) == (shared.GEN_DIFF, None)
+
+    @staticmethod
+    def test_coalesced_patch_is_applied_as_a_gen_range(hb):
+        shared.CLUSTER_DATA["node2"] = {"monitor": {"updated": 4}, "labels": {}, "gen": {}}
+        shared.REMOTE_GEN["node2"] = 4
+        shared.LOCAL_GEN["node2"] = 1
+        hb._store_rx_data({
+            "kind": "patch",
+            "since": 3,
+            "deltas": {"6": [[["labels", "az"], "fr1"], [["monitor", "updated"], 6]]},
+            "gen": {Env.nodename: 2},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 6
+        assert shared.LOCAL_GEN["node2"] == 2
+        assert shared.CLUSTER_DATA["node2"]["monitor"]["updated"] == 6
+        assert shared.CLUSTER_DATA["node2"]["labels"] == {"az": "fr1"}
+
+    @staticmethod
+    def test_coalesced_patch_from_a_later_gen_asks_for_a_full(hb):
+        shared.CLUSTER_DATA["node2"] = {"monitor": {"updated": 2}, "gen": {}}
+        shared.REMOTE_GEN["node2"] = 2
+        shared.LOCAL_GEN["node2"] = 1
+        hb._store_rx_data({
+            "kind": "patch",
+            "since": 3,
+            "deltas": {"6": [[["monitor", "updated"], 6]]},
+            "gen": {Env.nodename: 2},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 0
+        assert shared.CLUSTER_DATA["node2"]["monitor"]["updated"] == 2
+
+
+
+@pytest.mark.ci
+class TestHbMetrics:
+    @staticmethod
+    def test_rx_metrics_are_recorded(mocker, hb):
+        shared.CLUSTER_DATA["node2"] = {"monitor": {"updated": 2}, "gen": {}}
+        shared.REMOTE_GEN["node2"] = 2
+        shared.LOCAL_GEN["node2"] = 1
+        data = {
+            "kind": "patch",
+            "deltas": {"3": [[["monitor", "updated"], 3]]},
+            "gen": {Env.nodename: 2},
+        }
+        mocker.patch.object(shared.OsvcThread, "decrypt", return_value=("cluster1", "node2", data))
+        _, nodename, data = hb.decrypt(b"x" * 100)
+        hb.store_rx_data(data, nodename)
+        metrics = hb.status()["peers"]["node2"]["metrics"]
+        assert metrics["size"]["max"] == 100
+        assert metrics["decrypt"]["count"] == 1
+        assert metrics["patch"]["count"] == 1
+        assert metrics["latency"]["count"] == 1
+        assert metrics["resyncs"] == 0
+
+    @staticmethod
+    def test_latency_is_measured_from_the_reception(mocker, hb):
+        shared.CLUSTER_DATA["node2"] = {"monitor": {"updated": 2}, "gen": {}}
+        shared.REMOTE_GEN["node2"] = 2
+        shared.LOCAL_GEN["node2"] = 1
+        data = {
+            "kind": "patch",
+            "deltas": {"3": [[["monitor", "updated"], 3]]},
+            "gen": {Env.nodename: 2},
+        }
+        mocker.patch.object(shared.OsvcThread, "decrypt", return_value=("cluster1", "node2", data))
+        _, nodename, data = hb.decrypt(b"x" * 100, received=time.time() - 5)
+        hb.store_rx_data(data, nodename)
+        assert hb.status()["peers"]["node2"]["metrics"]["latency"]["max"] >= 5
+
+    @staticmethod
+    def test_full_resync_requests_are_counted(hb):
+        shared.CLUSTER_DATA["node2"] = {"monitor": {"updated": 2}, "gen": {}}
+        shared.REMOTE_GEN["node2"] = 2
+        shared.LOCAL_GEN["node2"] = 1
+        hb._store_rx_data({
+            "kind": "patch",
+            "deltas": {"4": [[["monitor", "updated"], 4]]},
+            "gen": {Env.nodename: 2},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 0
+        assert hb.status()["peers"]["node2"]["metrics"]["resyncs"] == 1
+
+    @staticmethod
+    def test_undecryptable_messages_are_not_measured(mocker, hb):
+        mocker.patch.object(shared.OsvcThread, "decrypt", return_value=(None, None, None))
+        hb.decrypt(b"x")
+        assert "metrics" not in hb.status()["peers"]["node2"]
+
+
+@pytest.mark.ci
+class TestHbTxSchedule:
+    @staticmethod
+    def test_keepalive_interval_is_stretched_up_to_a_third_of_the_timeout(mocker, hb):
+        mocker.patch.object(shared.HB_TX_TICKER, "wait")
+        hb.interval = 5
+        hb.timeout = 45
+        shared.LOCAL_GEN["node2"] = shared.GEN
+        delays = []
+        for _ in range(4):
+            hb.tx_wait()
+            delays.append(hb.tx_delay)
+        assert delays == [5, 10, 15, 15]
+
+    @staticmethod
+    def test_keepalive_interval_is_not_below_the_interval(mocker, hb):
+        mocker.patch.object(shared.HB_TX_TICKER, "wait")
+        hb.interval = 5
+        hb.timeout = 12
+        shared.LOCAL_GEN["node2"] = shared.GEN
+        hb.tx_wait()
+        hb.tx_wait()
+        assert hb.tx_delay == 5
+
+    @staticmethod
+    def test_full_requests_wake_the_tx_threads(mocker, hb):
+        wake = mocker.patch.object(shared, "wake_heartbeat_tx")
+        shared.LOCAL_GEN["node2"] = 3
+        hb.store_rx_data({"kind": "ping", "gen": {Env.nodename: 0}, "monitor": {}}, "node2")
+        assert wake.call_count == 1
+        hb.store_rx_data({"kind": "ping", "gen": {Env.nodename: 0}, "monitor": {}}, "node2")
+        assert wake.call_count == 1
+
+    @staticmethod
+    def test_keepalive_interval_keyword_lowers_the_cap(mocker, hb):
+        mocker.patch.object(shared.HB_TX_TICKER, "wait")
+        hb.interval = 5
+        hb.timeout = 25
+        hb.keepalive_interval = 8
+        shared.LOCAL_GEN["node2"] = shared.GEN
+        hb.tx_wait()
+        hb.tx_wait()
+        assert hb.tx_delay == 8
+
+    @staticmethod
+    def test_lagging_peers_are_sent_at_interval(mocker, hb):
+        mocker.patch.object(shared.HB_TX_TICKER, "wait")
+        hb.interval = 5
+        hb.timeout = 25
+        shared.LOCAL_GEN["node2"] = shared.GEN - 1
+        hb.tx_wait()
+        hb.tx_wait()
+        assert hb.tx_delay == 5
+
+    @staticmethod
+    def test_changes_are_batched(mocker, hb):
+        wait = mocker.patch.object(shared.HB_TX_TICKER, "wait")
+        mocker.patch.object(shared, "GEN", 3)
+        sleep = mocker.patch("daemon.hb.hb.time.sleep")
+
+        def change(timeout):
+            shared.GEN += 1
+
+        wait.side_effect = change
+        hb.batch_window = 0.2
+        hb.tx_wait()
+        sleep.assert_called_once_with(0.2)
+        wait.side_effect = None
+        hb.tx_wait()
+        assert sleep.call_count == 1
+
+    @staticmethod
+    def test_batch_window_is_a_sub_second_duration(hb):
+        hb.configure_tx_schedule()
+        assert hb.batch_window == 0.2
+
+
+@pytest.fixture(scope='function')
+def warm(mocker, hb):
+    mocker.patch.object(hb, "on_nodes_info_change")
+    del shared.CLUSTER_DATA["node2"]
+    mocker.patch.object(shared, "WARM_DATA", {
+        "node2": {
+            "gen": 4,
+            "data": {"monitor": {"updated": 4}, "gen": {}},
+            "expire": time.time() + 60,
+        },
+    })
+    yield hb
+
+
+@pytest.mark.ci
+class TestHbWarmRestart:
+    @staticmethod
+    def test_lined_up_patch_is_applied_to_the_warm_dataset(warm):
+        warm._store_rx_data({
+            "kind": "patch",
+            "deltas": {"5": [[["monitor", "updated"], 5]]},
+            "gen": {Env.nodename: 2},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 5
+        assert shared.LOCAL_GEN["node2"] == 2
+        assert shared.CLUSTER_DATA["node2"]["monitor"]["updated"] == 5
+        assert shared.WARM_DATA == {}
+
+    @staticmethod
+    def test_misaligned_patch_asks_for_a_full(warm):
+        warm._store_rx_data({
+            "kind": "patch",
+            "deltas": {"7": [[["monitor", "updated"], 7]]},
+            "gen": {Env.nodename: 2},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 0
+        assert "node2" not in shared.CLUSTER_DATA
+        assert shared.WARM_DATA == {}
+        assert warm.status()["peers"]["node2"]["metrics"]["resyncs"] == 1
+
+    @staticmethod
+    def test_patch_without_deltas_at_the_warm_gen_installs_the_dataset(warm):
+        warm._store_rx_data({
+            "kind": "patch",
+            "deltas": {},
+            "gen": {Env.nodename: 2, "node2": 4},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 4
+        assert shared.CLUSTER_DATA["node2"]["monitor"]["updated"] == 4
+
+    @staticmethod
+    def test_patch_without_deltas_past_the_warm_gen_asks_for_a_full(warm):
+        warm._store_rx_data({
+            "kind": "patch",
+            "deltas": {},
+            "gen": {Env.nodename: 2, "node2": 9},
+        }, "node2")
+        assert shared.REMOTE_GEN["node2"] == 0
+        assert "node2" not in shared.CLUSTER_DATA
+        assert shared.WARM_DATA == {}
+        assert warm.status()["peers"]["node2"]["metrics"]["resyncs"] == 1
+
+    @staticmethod
+    def test_ping_drops_the_warm_dataset(warm):
+        warm._store_rx_data({
+            "kind": "ping",
+            "monitor": {"status": "idle"},
+            "gen": {Env.nodename: 0},
+        }, "node2")
+        assert shared.WARM_DATA == {}
+        assert shared.CLUSTER_DATA["node2"]["monitor"] == {"status": "idle"}
+
+@pytest.fixture(scope='function')
+def rx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = HbRelayRx("hb#1")
+    thr.log = mocker.MagicMock()
+    thr.relay = "relay1"
+    thr.secret = "s"
+    thr.timeout = 15
+    thr.hb_nodes = [Env.nodename, "node2"]
+    mocker.patch.object(thr, "reload_config")
+    yield thr
+
+
+@pytest.mark.ci
+class TestHbRelayRx:
+    @staticmethod
+    def test_changed_slots_are_fetched_in_one_request(mocker, rx):
+        rx.hb_nodes = [Env.nodename, "node2", "node3"]
+        mocker.patch.object(rx, "decrypt", side_effect=lambda data, sender_id=None, received=None: (rx.cluster_name, "node2", data))
+        store_rx_data = mocker.patch.object(rx, "store_rx_data")
+        daemon_get = mocker.patch.object(rx, "daemon_get", return_value={
+            "status": 0, "epoch": "e1", "version": 7,
+            "slots": {"node2": {"updated": 1.0, "data": '{"a": 1}'}},
+        })
+        rx.do()
+        assert daemon_get.call_count == 1
+        assert daemon_get.call_args[0][0]["options"]["version"] == 0
+        store_rx_data.assert_called_once_with(b'{"a": 1}', "node2")
+        rx.do()
+        assert daemon_get.call_args[0][0]["options"]["version"] == 7
+        assert daemon_get.call_args[0][0]["options"]["epoch"] == "e1"
+
+    @staticmethod
+    def test_fallback_to_per_slot_receive(mocker, rx):
+        mocker.patch.object(rx, "handle_slot")
+        daemon_get = mocker.patch.object(rx, "daemon_get", side_effect=[
+            {"status": 1, "error": "handler GET relay_slots is not supported"},
+            {"status": 0, "updated": 1.0, "data": '{"a": 1}'},
+        ])
+        rx.do()
+        assert [call[0][0]["action"] for call in daemon_get.call_args_list] == ["relay_slots", "relay_rx"]
+        assert rx.batch_retry_at > 0
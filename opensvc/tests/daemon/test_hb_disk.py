@@ -0,0 +1,85 @@
+import mmap
+
+import pytest
+
+import daemon.shared as shared
+from core.comm import to_bytes
+from core.node import Node
+from daemon.hb.disk import SLOT_HEADER, HbDiskRx, HbDiskTx
+from env import Env
+
+
+@pytest.fixture(scope='function')
+def dev(tmp_path):
+    path = tmp_path / "dev"
+    with open(str(path), "wb") as filep:
+        filep.truncate(HbDiskTx.METASIZE + 2 * HbDiskTx.SLOTSIZE)
+    with open(str(path), "rb+") as filep:
+        yield filep
+
+
+def setup_thr(thr, mocker):
+    thr.log = mocker.MagicMock()
+    thr.timeout = 15
+    thr.dev = "dev"
+    thr.hb_nodes = [Env.nodename, "node2"]
+    thr.slot_buff = mmap.mmap(-1, thr.SLOTSIZE)
+    thr.slot_view = memoryview(thr.slot_buff)
+    mocker.patch.object(thr, "reload_config")
+    return thr
+
+
+@pytest.fixture(scope='function')
+def tx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = setup_thr(HbDiskTx("hb#1"), mocker)
+    thr.peer_config = {Env.nodename: {"slot": 1}}
+    mocker.patch.object(shared, "CLUSTER_DATA", {"node2": {"compat": shared.COMPAT_VERSION}})
+    yield thr
+
+
+@pytest.fixture(scope='function')
+def rx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = setup_thr(HbDiskRx("hb#1"), mocker)
+    thr.peer_config = {"node2": {"slot": 1}}
+    mocker.patch.object(thr, "store_rx_data")
+    mocker.patch.object(thr, "decrypt", side_effect=lambda msg, received=None: (thr.cluster_name, "node2", to_bytes(msg)))
+    yield thr
+
+
+@pytest.mark.ci
+class TestHbDiskSlotHeader:
+    @staticmethod
+    def test_unchanged_slot_is_not_decrypted(mocker, tx, rx, dev):
+        message = "x" * 10000
+        mocker.patch.object(tx, "get_message", return_value=(message, len(message)))
+        tx._do(dev)
+        rx._do(dev)
+        rx._do(dev)
+        assert rx.decrypt.call_count == 1
+        rx.store_rx_data.assert_called_once_with(message.encode(), "node2")
+        tx._do(dev)
+        rx._do(dev)
+        assert rx.decrypt.call_count == 2
+
+    @staticmethod
+    def test_small_payload_is_read_in_one_io(mocker, tx, rx, dev):
+        mocker.patch.object(tx, "get_message", return_value=("msg", 3))
+        tx._do(dev)
+        rx.slot_buff[:] = b"\0" * rx.SLOTSIZE
+        readinto = mocker.spy(dev, "readinto")
+        rx._do(dev)
+        assert readinto.call_count == 1
+        assert len(readinto.call_args[0][0]) == rx.SLOT_IOSIZE
+        rx.store_rx_data.assert_called_once_with(b"msg", "node2")
+
+    @staticmethod
+    def test_legacy_slot_is_written_for_old_peers(mocker, tx, rx, dev):
+        shared.CLUSTER_DATA["node2"]["compat"] = 10
+        mocker.patch.object(tx, "get_message", return_value=("msg", 3))
+        tx._do(dev)
+        assert rx.read_slot_header(1, fo=dev) is None
+        rx._do(dev)
+        rx.store_rx_data.assert_called_once_with(b"msg", "node2")
+        assert bytes(rx.slot_buff[:SLOT_HEADER.size]).startswith(b'{"msg": "msg"')
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+import daemon.shared as shared
+from core.comm import BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION
+from core.node import Node
+from daemon.hb.mcast import FRAGMENT_HEADER, HbMcastRx, HbMcastTx
+from env import Env
+
+
+def binary_message(size):
+    data = b"".join(bytes(bytearray([idx % 256])) for idx in range(size))
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, 1, 1, 0.0, size, b"i" * 16) + b"cn" + data
+
+
+class FakeSock(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendmsg(self, buffers, ancdata, flags, addr):
+        self.sent.append(b"".join(bytes(buff) for buff in buffers))
+
+    def sendto(self, data, addr):
+        self.sent.append(bytes(data))
+
+
+@pytest.fixture(scope='function')
+def tx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = HbMcastTx("hb#1")
+    thr.sock = FakeSock()
+    thr.group = ("224.3.29.71", 10000)
+    yield thr
+
+
+@pytest.fixture(scope='function')
+def rx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = HbMcastRx("hb#1")
+    thr.log = mocker.MagicMock()
+    thr.hb_nodes = [Env.nodename, "node2"]
+    mocker.patch.object(thr, "handle")
+    yield thr
+    thr.handlers.stop()
+
+
+@pytest.mark.ci
+class TestHbMcastFragments:
+    @staticmethod
+    def test_small_message_is_sent_unfragmented(tx):
+        message = binary_message(100)
+        tx.send_binary(message)
+        assert tx.sock.sent == [message]
+
+    @staticmethod
+    def test_fragments_are_reassembled_in_any_order(tx, rx):
+        message = binary_message(5000)
+        tx.send_binary(message)
+        assert len(tx.sock.sent) == 4
+        assert all(len(datagram) <= tx.max_datagram for datagram in tx.sock.sent)
+        for datagram in reversed(tx.sock.sent):
+            rx.add_fragment(memoryview(datagram), ("10.0.0.2", 1000))
+        assert rx.handle.call_count == 1
+        assert bytes(rx.handle.call_args[0][0]) == message
+        assert rx.fragments == {}
+
+    @staticmethod
+    def test_incomplete_messages_expire_per_sender(tx, rx):
+        tx.send_binary(binary_message(5000))
+        rx.add_fragment(memoryview(tx.sock.sent[0]), ("10.0.0.2", 1000))
+        rx.add_fragment(memoryview(tx.sock.sent[0]), ("10.0.0.3", 1000))
+        for assembly in rx.fragments[("10.0.0.2", 1000)].values():
+            assembly.created -= rx.reassembly_tmo + 1
+        rx.expire_fragments()
+        assert list(rx.fragments) == [("10.0.0.3", 1000)]
+
+    @staticmethod
+    def test_fragment_overflowing_the_message_is_dropped(rx):
+        header = FRAGMENT_HEADER.pack(b"\x93OSF", 1, b"m" * 16, 0, 2, 90, 100)
+        rx.add_fragment(memoryview(header + b"x" * 20), ("10.0.0.2", 1000))
+        assert rx.fragments == {}
+
+
+@pytest.mark.ci
+class TestHbMcastHandlers:
+    @staticmethod
+    def test_last_message_of_a_busy_sender_is_deferred(mocker, osvc_path_tests):
+        shared.NODE = Node()
+        rx = HbMcastRx("hb#1")
+        handled = []
+        mocker.patch.object(rx, "handle_client", side_effect=lambda data, addr, received: handled.append((data, received)))
+        addr = ("10.0.0.2", 1000)
+        try:
+            rx.handlers.submit([addr], time.sleep, 0.1)
+            rx.handle("m1", addr, 1.0)
+            rx.handle("m2", addr, 2.0)
+            assert rx.deferred == {addr: ("m2", 2.0)}
+            for _ in range(100):
+                rx.collect_handlers()
+                if handled:
+                    break
+                time.sleep(0.01)
+            for _ in range(100):
+                rx.handlers.completed()
+                if not rx.handlers.is_pending(addr):
+                    break
+                time.sleep(0.01)
+            assert handled == [("m2", 2.0)]
+            assert rx.deferred == {}
+        finally:
+            rx.handlers.stop()
@@ -0,0 +1,139 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import daemon.shared as shared
+from core.node import Node
+from core.comm import BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION
+from daemon.hb.ucast import HbUcastRx, HbUcastTx
+from env import Env
+
+
+@pytest.fixture(scope='function')
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(5)
+    sock.settimeout(5)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture(scope='function')
+def tx(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = HbUcastTx("hb#1")
+    thr.log = mocker.MagicMock()
+    thr.timeout = 15
+    thr.interval = 5
+    thr.hb_nodes = [Env.nodename, "node2"]
+    mocker.patch.object(thr, "reload_config")
+    mocker.patch.object(thr, "get_message", return_value=("msg", 3))
+    mocker.patch.object(thr, "event")
+    yield thr
+    thr.senders.stop()
+    thr.close_conns()
+
+
+def wait_sent(thr, count):
+    for _ in range(100):
+        thr.senders.completed()
+        if thr.stats.beats + thr.stats.errors >= count and not thr.senders.is_pending("node2"):
+            break
+        time.sleep(0.01)
+
+
+@pytest.mark.ci
+class TestHbUcastTx:
+    @staticmethod
+    def test_messages_are_sent_through_a_persistent_connection(tx, listener):
+        tx.peer_config = {
+            Env.nodename: {"addr": "127.0.0.1", "port": 0},
+            "node2": {"addr": "127.0.0.1", "port": listener.getsockname()[1]},
+        }
+        tx.do()
+        wait_sent(tx, 1)
+        tx.do()
+        wait_sent(tx, 2)
+        conn, _ = listener.accept()
+        conn.settimeout(5)
+        data = b""
+        while data.count(b"\0") < 2:
+            data += conn.recv(4096)
+        assert data == b"msg\0msg\0"
+        conn.close()
+        assert tx.stats.beats == 2
+        status = tx.status()
+        assert status["peers"]["node2"]["connected"]
+        assert status["peers"]["node2"]["send_latency"]["count"] == 2
+
+    @staticmethod
+    def test_closed_connection_is_reopened(tx, listener):
+        tx.peer_config = {
+            Env.nodename: {"addr": "127.0.0.1", "port": 0},
+            "node2": {"addr": "127.0.0.1", "port": listener.getsockname()[1]},
+        }
+        tx.do()
+        wait_sent(tx, 1)
+        conn, _ = listener.accept()
+        conn.close()
+        time.sleep(0.1)
+        tx.do()
+        wait_sent(tx, 2)
+        conn, _ = listener.accept()
+        conn.settimeout(5)
+        assert conn.recv(4096) == b"msg\0"
+        conn.close()
+        assert tx.stats.errors == 0
+
+    @staticmethod
+    def test_unreachable_peer_is_retried_with_backoff(tx, listener):
+        port = listener.getsockname()[1]
+        listener.close()
+        tx.peer_config = {
+            Env.nodename: {"addr": "127.0.0.1", "port": 0},
+            "node2": {"addr": "127.0.0.1", "port": port},
+        }
+        tx.do()
+        wait_sent(tx, 1)
+        assert tx.stats.errors == 1
+        assert tx.conns["node2"].backoff == 5
+        tx.do()
+        time.sleep(0.05)
+        assert not tx.senders.is_pending("node2")
+        assert tx.stats.errors == 1
+
+
+@pytest.mark.ci
+class TestHbUcastRx:
+    @staticmethod
+    def test_messages_are_split_on_nul(mocker, osvc_path_tests):
+        shared.NODE = Node()
+        rx = HbUcastRx("hb#1")
+        rx.timeout = 15
+        handle_message = mocker.patch.object(rx, "handle_message")
+        sender, receiver = socket.socketpair()
+        sender.sendall(b"m1\0m2\0m")
+        sender.sendall(b"3\0")
+        sender.close()
+        rx._handle_client(receiver, ("127.0.0.1", 0))
+        receiver.close()
+        assert [call[0][0] for call in handle_message.call_args_list] == [b"m1", b"m2", b"m3"]
+
+    @staticmethod
+    def test_binary_and_legacy_messages_are_split(mocker, osvc_path_tests):
+        shared.NODE = Node()
+        rx = HbUcastRx("hb#1")
+        rx.timeout = 15
+        handle_message = mocker.patch.object(rx, "handle_message")
+        binary = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, 1, 1, 0.0, 3, b"i" * 16) + b"cn\0\0x"
+        sender, receiver = socket.socketpair()
+        sender.sendall(b"m1\0" + binary[:10])
+        sender.sendall(binary[10:] + b"m2\0")
+        sender.close()
+        rx._handle_client(receiver, ("127.0.0.1", 0))
+        receiver.close()
+        assert [bytes(call[0][0]) for call in handle_message.call_args_list] == [b"m1", binary, b"m2"]
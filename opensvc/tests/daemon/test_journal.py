@@ -0,0 +1,97 @@
+import foreign.json_delta as json_delta
+import pytest
+
+from daemon.journal import Journal, coalesce, copy, diff, patch, reduce_paths
+
+
+@pytest.mark.ci
+class TestJournal:
+    @staticmethod
+    def test_reduce_paths_drops_descendants():
+        paths = set([("a",), ("a", "b"), ("c", "d"), ("c", "e", "f")])
+        assert reduce_paths(paths) == [("a",), ("c", "d"), ("c", "e", "f")]
+
+    @staticmethod
+    def test_set_records_only_changes():
+        journal = Journal()
+        data = {"a": 1, "b": {"c": 2}}
+        journal.set(data, ["a"], 1)
+        assert journal.pop() == []
+        journal.set(data, ["b", "c"], 3)
+        assert data["b"]["c"] == 3
+        assert journal.pop() == [("b", "c")]
+
+    @staticmethod
+    def test_itemized_set_records_changed_keys():
+        journal = Journal()
+        data = {"s": {"x": {"v": 1}, "y": {"v": 1}, "z": {"v": 1}}}
+        journal.set(data, ["s"], {"x": {"v": 1}, "y": {"v": 2}, "w": {"v": 1}}, itemized=True)
+        assert journal.pop() == [("s", "w"), ("s", "y"), ("s", "z")]
+
+    @staticmethod
+    def test_diff_patch_applies_to_last_data():
+        journal = Journal()
+        data = {"s": {"x": {"v": 1, "r": [1, 2]}, "y": {"v": 1}}, "m": "idle"}
+        last = copy(data)
+        peer = copy(data)
+        journal.set(data, ["s"], {"x": {"v": 1, "r": [1, 3]}, "z": {"a": {"b": 1}}}, itemized=True)
+        journal.set(data, ["m"], "busy")
+        journal.add(["s", "z", "a", "b"])
+        patch = diff(last, data, journal.pop())
+        assert last == data
+        assert json_delta.patch(peer, patch) == data
+        assert json_delta.diff(last, data, verbose=False) == []
+
+    @staticmethod
+    def test_diff_of_unchanged_paths_is_empty():
+        data = {"a": {"b": 1}}
+        last = copy(data)
+        assert diff(last, data, [("a",), ("a", "b"), ("x", "y")]) == []
+
+
+@pytest.mark.ci
+class TestCoalesce:
+    @staticmethod
+    def test_superseded_changes_are_dropped():
+        patches = [
+            [[["monitor", "updated"], 1], [["s", "x", "v"], 1]],
+            [[["monitor", "updated"], 2], [["s", "x"], {"v": 2}]],
+            [[["monitor", "updated"], 3], [["s", "y"]]],
+        ]
+        assert coalesce(patches) == [
+            [["s", "x"], {"v": 2}],
+            [["monitor", "updated"], 3],
+            [["s", "y"]],
+        ]
+
+    @staticmethod
+    def test_descendant_changes_are_folded():
+        value = {"v": 1, "r": {"a": 1}}
+        patches = [
+            [[["s", "x"], value]],
+            [[["s", "x", "v"], 2]],
+            [[["s", "x", "r", "a"]], [["s", "x", "r", "b"], 2]],
+        ]
+        assert coalesce(patches) == [[["s", "x"], {"v": 2, "r": {"b": 2}}]]
+        assert value == {"v": 1, "r": {"a": 1}}
+
+    @staticmethod
+    def test_list_item_changes_are_not_coalesced():
+        assert coalesce([[[["a", 0], 1]], [[["b"], 1]]]) is None
+        assert coalesce([[[[], {}]]]) is None
+
+    @staticmethod
+    def test_coalesced_patch_applies_from_any_gen_of_the_range():
+        gens = [{"m": {"u": 0}, "s": {"x": {"v": 0}, "y": {"v": 0}}}]
+        patches = [
+            [[["m", "u"], 1], [["s", "z"], {"v": 1}]],
+            [[["m", "u"], 2], [["s", "y"]]],
+            [[["m", "u"], 3], [["s", "z", "v"], 3], [["s", "x", "v"], 3]],
+        ]
+        for _patch in patches:
+            gens.append(json_delta.patch(copy(gens[-1]), _patch))
+        coalesced = coalesce(patches)
+        for data in gens:
+            data = copy(data)
+            patch(data, copy(coalesced))
+            assert data == gens[-1]
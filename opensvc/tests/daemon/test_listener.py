@@ -0,0 +1,342 @@
+import json
+import logging
+import socket
+import time
+
+import pytest
+
+import daemon.shared as shared
+from core.node import Node
+from daemon.listener import AuthCache, ClientHandler, EventMessage, Listener, PeerRequests
+from daemon.workers import WorkerPool
+from env import Env
+from foreign.six.moves import queue
+from utilities.storage import Storage
+
+
+@pytest.fixture(scope='function')
+def lsnr(mocker, osvc_path_tests):
+    shared.NODE = Node()
+    thr = Listener()
+    thr.log = mocker.MagicMock()
+    thr.events_clients = []
+    thr.sessions = {}
+    thr.deferred = []
+    thr.deferred_sids = set()
+    thr.sockmap = {}
+    thr.handlers = {}
+    thr.stats = Storage({
+        "sessions": Storage({
+            "accepted": 0,
+            "busy": 0,
+            "auth_validated": 0,
+            "tx": 0,
+            "rx": 0,
+            "alive": Storage({}),
+            "clients": Storage({"local": Storage({"accepted": 0, "auth_validated": 0, "tx": 0, "rx": 0})}),
+        }),
+    })
+    thr.configure_io()
+    yield thr
+    thr.stop_sessions()
+
+
+def add_session(lsnr):
+    client, server = socket.socketpair()
+    client.settimeout(5)
+    thr = ClientHandler(lsnr, server, ["local"], False, "raw", False, None, pooled=True)
+    thr.log = logging.getLogger("test")
+    thr.open_session()
+    lsnr.sessions[thr.sid] = thr
+    lsnr.register_session(thr)
+    return client, thr
+
+
+def recv_result(lsnr, client):
+    buff = b""
+    for _ in range(50):
+        lsnr.do_selector()
+        try:
+            client.setblocking(False)
+            chunk = client.recv(65536)
+        except socket.error:
+            continue
+        buff += chunk
+        if not chunk or buff.endswith(b"\0"):
+            break
+    return json.loads(buff.rstrip(b"\0").decode())
+
+
+@pytest.mark.ci
+class TestListenerSelector:
+    @staticmethod
+    def test_raw_request_is_served_by_a_handler_thread(lsnr):
+        assert lsnr.io_mode == "selector"
+        client, thr = add_session(lsnr)
+        client.sendall(b'{"action": "foo"}\0')
+        assert recv_result(lsnr, client)["status"] == 501
+        for _ in range(50):
+            lsnr.do_selector()
+            if thr.sid not in lsnr.sessions:
+                break
+        assert thr.sid not in lsnr.sessions
+        assert lsnr.status()["io"]["sessions"] == 0
+        client.close()
+
+    @staticmethod
+    def test_already_registered_session_is_kept(lsnr):
+        client, thr = add_session(lsnr)
+        lsnr.register_session(thr)
+        assert thr.sid in lsnr.sessions
+        assert lsnr.selector.get_key(thr.io_sock()).data is thr
+        client.close()
+
+    @staticmethod
+    def test_closed_session_is_not_registered(lsnr):
+        client, thr = add_session(lsnr)
+        lsnr.unregister_session(thr)
+        thr.conn.close()
+        lsnr.register_session(thr)
+        assert thr.sid not in lsnr.sessions
+        client.close()
+
+    @staticmethod
+    def test_new_session_is_answered_busy_when_the_queue_is_full(lsnr):
+        lsnr.workers.stop()
+        lsnr.workers = WorkerPool("listener", size=0, queue_size=1)
+        lsnr.workers.submit(["other"], time.sleep, 0)
+        client, thr = add_session(lsnr)
+        client.sendall(b'{"action": "foo"}\0')
+        assert recv_result(lsnr, client) == {"status": 503, "error": "listener busy"}
+        assert thr.sid not in lsnr.sessions
+        assert lsnr.stats.sessions.busy == 1
+        client.close()
+
+    @staticmethod
+    def test_raw_events_are_pushed_to_idle_subscribers(lsnr):
+        client, thr = add_session(lsnr)
+        thr.served = True
+        thr.raw_events = True
+        thr.event_queue = queue.Queue()
+        thr.event_queue.put({"kind": "event"})
+        assert recv_result(lsnr, client) == {"kind": "event"}
+        assert thr.sid in lsnr.sessions
+        client.close()
+        for _ in range(50):
+            lsnr.do_selector()
+            if thr.sid not in lsnr.sessions:
+                break
+        assert thr.sid not in lsnr.sessions
+
+
+class SlowPeers(object):
+    """
+    A fake requester answering each peer after <delays>[peer] seconds.
+    """
+    def __init__(self, delays):
+        self.log = logging.getLogger("test")
+        self.delays = delays
+
+    def daemon_request(self, data, server=None, silent=False, method="GET", timeout=None):
+        time.sleep(self.delays[server])
+        return {"status": 0, "data": server}
+
+
+@pytest.mark.ci
+class TestPeerRequests:
+    @staticmethod
+    def test_peers_are_requested_concurrently():
+        thr = SlowPeers({"n1": 0.2, "n2": 0.2, "n3": 0.2})
+        begin = time.time()
+        results = list(PeerRequests(thr, ["n1", "n2", "n3"], {}, "GET").results())
+        assert time.time() - begin < 0.5
+        assert sorted(nodename for nodename, _, _ in results) == ["n1", "n2", "n3"]
+        for nodename, result, latency in results:
+            assert result == {"status": 0, "data": nodename}
+            assert latency >= 0.2
+
+    @staticmethod
+    def test_results_are_yielded_as_they_arrive():
+        thr = SlowPeers({"n1": 0.3, "n2": 0.0})
+        results = PeerRequests(thr, ["n1", "n2"], {}, "GET").results()
+        assert next(results)[0] == "n2"
+        assert next(results)[0] == "n1"
+
+    @staticmethod
+    def test_concurrency_is_capped():
+        thr = SlowPeers({"n1": 0.1, "n2": 0.1, "n3": 0.1, "n4": 0.1})
+        begin = time.time()
+        results = list(PeerRequests(thr, ["n1", "n2", "n3", "n4"], {}, "GET", size=2).results())
+        assert len(results) == 4
+        assert time.time() - begin >= 0.2
+
+    @staticmethod
+    def test_slow_peers_are_reported_as_timed_out():
+        thr = SlowPeers({"n1": 0.0, "n2": 1.0})
+        begin = time.time()
+        results = dict((nodename, result) for nodename, result, _ in PeerRequests(thr, ["n1", "n2"], {}, "GET", timeout=0.2).results())
+        assert time.time() - begin < 0.8
+        assert results["n1"]["status"] == 0
+        assert results["n2"] == {"status": 1, "error": "timeout"}
+
+    @staticmethod
+    def test_no_peers():
+        assert list(PeerRequests(SlowPeers({}), [], {}, "GET").results()) == []
+
+    @staticmethod
+    def test_multiplex_reports_the_nodes_results_and_latencies(lsnr, mocker):
+        client, thr = add_session(lsnr)
+        mocker.patch.object(shared.NODE, "nodes_selector", return_value=[Env.nodename, "n2"])
+        mocker.patch.object(thr, "daemon_request", return_value={"status": 1})
+        handler = mocker.MagicMock(stream=False, routes=(("GET", "foo"),))
+        handler.action.return_value = {"status": 0}
+        result = thr.multiplex("*", handler, {}, {"action": "foo"}, Env.nodename, "foo")
+        assert result["nodes"] == {Env.nodename: {"status": 0}, "n2": {"status": 1}}
+        assert result["status"] == 1
+        assert sorted(result["latencies"]) == sorted([Env.nodename, "n2"])
+        client.close()
+
+
+class FakeUsr(object):
+    def __init__(self, path, grant):
+        self.path = path
+        self.name = path.split("/")[-1]
+        self.grant = grant
+
+    def oget(self, section, keyword):
+        return self.grant
+
+
+@pytest.mark.ci
+class TestAuthCache:
+    @staticmethod
+    def test_least_recently_used_entries_are_evicted():
+        cache = AuthCache(size=2)
+        for key in ("a", "b"):
+            cache.put(key, None, {}, "x")
+        assert cache.get("a")
+        cache.put("c", None, {}, "x")
+        assert cache.get("b") is None
+        assert cache.get("a")
+        assert cache.get("c")
+
+    @staticmethod
+    def test_entries_expire(mocker):
+        cache = AuthCache(ttl=60)
+        cache.put("a", None, {}, "x")
+        cache.put("b", None, {}, "x", expire=time.time() + 10)
+        mocker.patch.object(time, "time", return_value=time.time() + 30)
+        assert cache.get("a")
+        assert cache.get("b") is None
+
+    @staticmethod
+    def test_user_config_changes_invalidate_its_entries():
+        cache = AuthCache()
+        cache.put("a", FakeUsr("system/usr/u1", ""), {}, "x")
+        cache.put("b", FakeUsr("system/usr/u2", ""), {}, "x")
+        prefix = ["monitor", "nodes", Env.nodename, "services", "config"]
+        cache.invalidate_patch({"kind": "patch", "data": [[prefix + ["svc1", "csum"], "y"]]})
+        assert cache.status()["entries"] == 2
+        cache.invalidate_patch({"kind": "patch", "data": [[prefix + ["system/usr/u1", "csum"], "y"]]})
+        assert cache.get("a") is None
+        assert cache.get("b")
+        cache.invalidate_patch({"kind": "patch", "data": [[prefix + ["ns1/svc/svc2"], {}]]})
+        assert cache.status()["entries"] == 0
+
+    @staticmethod
+    def test_credentials_are_authenticated_once(lsnr, mocker):
+        client, thr = add_session(lsnr)
+        thr.tls = True
+        usr = FakeUsr("system/usr/u1", "guest:ns* admin:ns1 squatter")
+        authenticate = mocker.MagicMock(return_value=usr)
+        mocker.patch.object(thr, "get_all_ns", return_value=set(["ns1", "ns2", "other"]))
+        mocker.patch.object(thr, "current_usr_cf_sum", return_value="csum1")
+        for _ in range(2):
+            _usr, grants, cf_sum = thr.cached_auth("basic", "Basic xxx", authenticate)
+        assert authenticate.call_count == 1
+        assert _usr is usr
+        assert cf_sum == "csum1"
+        assert grants["guest"] == set(["ns1", "ns2"])
+        assert grants["admin"] == set(["ns1"])
+        assert grants["squatter"] is None
+        thr.current_usr_cf_sum.return_value = "csum2"
+        thr.cached_auth("basic", "Basic xxx", authenticate)
+        assert authenticate.call_count == 2
+        thr.cached_auth("basic", "Basic yyy", authenticate)
+        assert authenticate.call_count == 3
+        client.close()
+
+
+def add_subscriber(lsnr, selector=None, namespaces=None):
+    client, thr = add_session(lsnr)
+    thr.selector = selector
+    thr.event_queue = queue.Queue()
+    if namespaces is not None:
+        thr.usr = FakeUsr("system/usr/u1", "")
+        thr.usr_grants = {"guest": set(namespaces)}
+    lsnr.events_clients.append(thr)
+    return client, thr
+
+
+@pytest.mark.ci
+class TestEventsGroups:
+    @staticmethod
+    def test_events_are_filtered_and_encoded_once_per_group(lsnr, mocker):
+        lsnr.events_grace_period = False
+        subscribers = [
+            add_subscriber(lsnr),
+            add_subscriber(lsnr),
+            add_subscriber(lsnr, namespaces=["ns1"]),
+            add_subscriber(lsnr, namespaces=["ns1"]),
+            add_subscriber(lsnr, namespaces=["ns2"]),
+        ]
+        filter_event = mocker.spy(lsnr, "filter_event")
+        key = ["monitor", "nodes", Env.nodename, "services", "status"]
+        event = {"kind": "patch", "data": [[key + ["ns1/svc/s1"], {"avail": "up"}]]}
+        while not shared.EVENT_Q.empty():
+            shared.EVENT_Q.get()
+        shared.EVENT_Q.put(event)
+        lsnr.janitor_events()
+        assert filter_event.call_count == 3
+        msgs = [thr.event_queue.get_nowait() for _, thr in subscribers]
+        assert all(isinstance(msg, EventMessage) for msg in msgs)
+        assert msgs[0] is msgs[1]
+        assert msgs[2] is msgs[3]
+        assert msgs[2] is not msgs[4]
+        assert msgs[2].data["data"] == event["data"]
+        assert msgs[4].data["data"] == []
+        assert msgs[0].raw(subscribers[0][1]) is msgs[1].raw(subscribers[1][1])
+        assert json.loads(msgs[0].json()) == event
+        for client, _ in subscribers:
+            client.close()
+
+
+@pytest.mark.ci
+class TestListenerLongPoll:
+    @staticmethod
+    def test_waiters_dont_hold_the_handler_threads(lsnr, mocker):
+        from daemon.handlers.sync.get import Handler
+        lsnr.handlers[("GET", "sync")] = Handler()
+        lsnr.workers.stop()
+        lsnr.workers = WorkerPool("listener", size=2, queue_size=16, on_done=lsnr.wakeup)
+        mocker.patch.object(shared, "GEN", 2)
+        mocker.patch.object(shared, "LOCAL_GEN", {"node2": 1})
+        waiters = []
+        for _ in range(5):
+            client, thr = add_session(lsnr)
+            client.sendall(b'{"action": "sync", "method": "GET", "options": {"timeout": 10}}\0')
+            waiters.append((client, thr))
+            for _ in range(50):
+                lsnr.do_selector()
+                if thr.long_poll is not None:
+                    break
+            assert thr.long_poll is not None
+        client, thr = add_session(lsnr)
+        client.sendall(b'{"action": "foo"}\0')
+        assert recv_result(lsnr, client)["status"] == 501
+        client.close()
+        shared.LOCAL_GEN["node2"] = 2
+        for client, thr in waiters:
+            assert recv_result(lsnr, client) == {"status": 0, "data": {"satisfied": True, "gen": 2}}
+            client.close()
+        assert lsnr.stats.sessions.busy == 0
@@ -0,0 +1,212 @@
+import pytest
+
+import daemon.shared as shared
+from daemon.monitor import Monitor
+from env import Env
+from utilities.storage import Storage
+
+
+def instance(avail, **kwargs):
+    data = {
+        "avail": avail,
+        "overall": avail,
+        "frozen": 0,
+        "provisioned": True,
+        "topology": "failover",
+        "monitor": {"status": "idle"},
+        "updated": 1,
+    }
+    data.update(kwargs)
+    return data
+
+
+@pytest.fixture(scope='function')
+def monitor(mocker):
+    thr = Monitor()
+    thr.log = mocker.MagicMock()
+    thr._lazy_cluster_nodes = [Env.nodename]
+    shared.CLUSTER_DATA[Env.nodename] = {
+        "services": {
+            "config": {"svc1": {}, "svc2": {}, "parent": {}},
+            "status": {
+                "svc1": instance("up"),
+                "svc2": instance("up"),
+                "parent": instance("up", slaves=["svc1"]),
+            },
+        },
+    }
+    shared.AGG_DIRTY.track()
+    yield thr
+    shared.AGG_DIRTY.track(False)
+    shared.CLUSTER_DATA.clear()
+    shared.LOCAL_DATA_JOURNAL.clear()
+    shared.AGG = {}
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestMonitorAgg:
+    @staticmethod
+    def test_only_invalidated_objects_are_recomputed(monitor):
+        data = monitor.get_agg_services()
+        assert data["svc1"].avail == "up"
+        assert data["svc2"].avail == "up"
+        services = shared.CLUSTER_DATA[Env.nodename]["services"]["status"]
+        services["svc1"]["avail"] = "down"
+        services["svc2"]["avail"] = "down"
+        with shared.CLUSTER_DATA_LOCK:
+            shared.publish_cluster_snapshot(Env.nodename, [["services", "status", "svc1", "avail"]])
+        data = monitor.get_agg_services()
+        assert data["svc1"].avail == "down"
+        assert data["svc2"].avail == "up"
+
+    @staticmethod
+    def test_parents_are_refreshed_after_children(monitor):
+        monitor.get_agg_services()
+        shared.CLUSTER_DATA[Env.nodename]["services"]["status"]["svc1"]["avail"] = "down"
+        shared.LOCAL_DATA_JOURNAL.add(["services", "status", "svc1", "avail"])
+        data = monitor.get_agg_services()
+        assert data["svc1"].avail == "down"
+        assert data["parent"].avail == "up"
+        shared.LOCAL_DATA_JOURNAL.clear()
+        data = monitor.get_agg_services()
+        assert data["parent"].avail == "warn"
+
+    @staticmethod
+    def test_removed_objects_are_dropped(monitor):
+        monitor.get_agg_services()
+        del shared.CLUSTER_DATA[Env.nodename]["services"]["config"]["svc2"]
+        del shared.CLUSTER_DATA[Env.nodename]["services"]["status"]["svc2"]
+        with shared.CLUSTER_DATA_LOCK:
+            shared.publish_cluster_snapshot(Env.nodename, [["services", "config", "svc2"],
+                                                           ["services", "status", "svc2"]])
+        assert "svc2" not in monitor.get_agg_services()
+
+
+@pytest.fixture(scope='function')
+def orchestrated(mocker):
+    shared.SMON_DATA.update({
+        "svc1": Storage(status="idle"),
+        "svc2": Storage(status="idle"),
+        "child": Storage(status="idle"),
+        "busy": Storage(status="ready"),
+    })
+    shared.SERVICES["child"] = mocker.Mock(namespace=None, parents=["svc1"],
+                                           children_and_slaves=[], hard_affinity=[],
+                                           hard_anti_affinity=[], soft_affinity=[],
+                                           soft_anti_affinity=[])
+    shared.ORCH_DIRTY.track()
+    yield
+    shared.ORCH_DIRTY.track(False)
+    for path in ("svc1", "svc2", "child", "busy"):
+        shared.SMON_DATA.pop(path, None)
+    shared.SERVICES.pop("child", None)
+    shared.ORCH_PLACEMENT_STATE.clear()
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests', 'orchestrated')
+class TestMonitorOrchestratorPaths:
+    @staticmethod
+    def test_only_dirty_related_and_busy_objects_are_orchestrated(monitor):
+        assert sorted(monitor.orchestrator_paths()) == ["busy", "child", "svc1", "svc2"]
+        assert monitor.orchestrator_paths() == ["busy"]
+        shared.ORCH_DIRTY.add("svc1")
+        assert sorted(monitor.orchestrator_paths()) == ["busy", "child", "svc1"]
+
+    @staticmethod
+    def test_dataset_changes_mark_objects_dirty(monitor):
+        monitor.orchestrator_paths()
+        shared.invalidate_objects([["services", "status", "svc2", "avail"], ["speaker"]])
+        assert sorted(monitor.orchestrator_paths()) == ["busy", "svc2"]
+        shared.invalidate_objects([["monitor"]])
+        assert len(monitor.orchestrator_paths()) == 4
+
+    @staticmethod
+    @pytest.mark.parametrize("key", ["targets", "min_avail_mem"])
+    def test_placement_data_changes_mark_all_objects_dirty(monitor, key):
+        monitor.orchestrator_paths()
+        shared.invalidate_objects([[key]])
+        assert len(monitor.orchestrator_paths()) == 4
+
+    @staticmethod
+    def test_stats_refresh_with_unchanged_score_is_ignored(monitor):
+        data = shared.CLUSTER_DATA[Env.nodename]
+        data["stats"] = {"score": 50, "load_15m": 0.5, "mem_avail": 40, "mem_total": 100}
+        shared.invalidate_objects([["stats"]])
+        monitor.orchestrator_paths()
+        data["stats"] = {"score": 50, "load_15m": 0.7, "mem_avail": 38, "mem_total": 100}
+        shared.invalidate_objects([["stats"]])
+        assert monitor.orchestrator_paths() == ["busy"]
+        data["stats"] = {"score": 49, "load_15m": 0.9, "mem_avail": 36, "mem_total": 100}
+        shared.invalidate_objects([["stats"]])
+        assert len(monitor.orchestrator_paths()) == 4
+
+    @staticmethod
+    def test_stats_refresh_crossing_the_overload_threshold_is_orchestrated(monitor):
+        data = shared.CLUSTER_DATA[Env.nodename]
+        data["min_avail_mem"] = 20
+        data["stats"] = {"score": 50, "mem_avail": 21, "mem_total": 100}
+        shared.invalidate_objects([["stats"]])
+        monitor.orchestrator_paths()
+        data["stats"] = {"score": 50, "mem_avail": 19, "mem_total": 100}
+        shared.invalidate_objects([["stats"]])
+        assert len(monitor.orchestrator_paths()) == 4
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestMonitorConfigSync:
+    @staticmethod
+    def test_new_objects_are_installed_by_the_monitor_thread(monitor, mocker):
+        svc = mocker.Mock(kind="cfg", path="new")
+        svc.paths.cf = "/nonexistent"
+        mocker.patch.object(monitor, "fetch_service_config")
+        mocker.patch.object(monitor.object_cache, "get", return_value=svc)
+        shared.CONFIG_DIRTY.track()
+        shared.CONFIG_DIRTY.pop()
+        try:
+            svcs = monitor.install_services_conf("node2", [("new", True)])
+            assert svcs == {"new": svc}
+            assert "new" not in shared.SERVICES
+            monitor.config_sync_pool = mocker.Mock()
+            monitor.config_sync_pool.completed.return_value = [(["new"], svcs, None)]
+            monitor.sync_services_conf_completed()
+            assert shared.SERVICES["new"] is svc
+            assert shared.CONFIG_DIRTY.pop() == {"new"}
+        finally:
+            shared.CONFIG_DIRTY.track(False)
+            shared.SERVICES.pop("new", None)
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestMonitorSmonRetries:
+    @staticmethod
+    def test_restart_counters_changes_are_journaled_and_not_shared(monitor):
+        shared.SMON_DATA["svc1"] = Storage(status="idle")
+        try:
+            shared.LOCAL_DATA_JOURNAL.clear()
+            monitor.inc_smon_retries("svc1", "app#0")
+            assert shared.LOCAL_DATA_JOURNAL.peek() == [("services", "status", "svc1", "monitor")]
+            published = dict(monitor.get_service_monitor("svc1"))
+            monitor.inc_smon_retries("svc1", "app#0")
+            assert published["restart"] == {"app#0": 1}
+            assert shared.SMON_DATA["svc1"].restart == {"app#0": 2}
+            shared.LOCAL_DATA_JOURNAL.clear()
+            monitor.reset_smon_retries("svc1", "app#0")
+            assert "restart" not in shared.SMON_DATA["svc1"]
+            assert shared.LOCAL_DATA_JOURNAL.peek() == [("services", "status", "svc1", "monitor")]
+        finally:
+            shared.SMON_DATA.pop("svc1", None)
+
+    @staticmethod
+    def test_local_expect_started_from_status_is_journaled(monitor):
+        shared.SMON_DATA["svc1"] = Storage(status="idle")
+        try:
+            shared.LOCAL_DATA_JOURNAL.clear()
+            monitor.set_smon_l_expect_from_status({"svc1": {"avail": "up"}}, "svc1")
+            assert shared.SMON_DATA["svc1"].local_expect == "started"
+            assert shared.LOCAL_DATA_JOURNAL.peek() == [("services", "status", "svc1", "monitor")]
+        finally:
+            shared.SMON_DATA.pop("svc1", None)
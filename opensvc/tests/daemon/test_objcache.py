@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from core.node import Node
+from daemon.objcache import ObjectCache, node_refs
+from utilities.naming import svc_pathcf
+
+
+def write_config(path, buff):
+    cf = svc_pathcf(path)
+    if not os.path.exists(os.path.dirname(cf)):
+        os.makedirs(os.path.dirname(cf))
+    with open(cf, "w") as filep:
+        filep.write(buff)
+
+
+def write_node_config(buff):
+    from env import Env
+    if not os.path.exists(Env.paths.pathetc):
+        os.makedirs(Env.paths.pathetc)
+    with open(Env.paths.nodeconf, "w") as filep:
+        filep.write(buff)
+
+
+@pytest.mark.ci
+class TestNodeRefs:
+    @staticmethod
+    def test_node_level_references_are_detected():
+        assert node_refs("[DEFAULT]\nenv = {node.env}\ncomment = {upper:clustername} {#clusternodes}\n") == \
+            set(["node.env", "cluster_name", "cluster_nodes"])
+
+    @staticmethod
+    def test_object_references_are_ignored():
+        assert node_refs("[DEFAULT]\nid = {name}\n[fs#1]\nmnt = /srv/{fqdn}\n") == set(["cluster_name"])
+
+    @staticmethod
+    def test_node_selectors_depend_on_labels():
+        assert node_refs("[DEFAULT]\nnodes = az=fr1\n") == set(["cluster_nodes", "nodes_info"])
+        assert node_refs("[DEFAULT]\nnodes = n1 n2\n") == set()
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestObjectCache:
+    @staticmethod
+    def test_unchanged_objects_are_reused():
+        write_config("svc1", "[DEFAULT]\nid = a\n")
+        cache = ObjectCache()
+        node = Node()
+        svc = cache.get("svc1", node)
+        assert cache.get("svc1", node) is svc
+        assert cache.get("svc1", Node()) is svc
+
+    @staticmethod
+    def test_config_change_rebuilds():
+        write_config("svc1", "[DEFAULT]\nid = a\n")
+        cache = ObjectCache()
+        node = Node()
+        svc = cache.get("svc1", node)
+        write_config("svc1", "[DEFAULT]\nid = b\n")
+        assert cache.get("svc1", node) is not svc
+        csum = cache.csum("svc1")
+        assert cache.get("svc1", node, csum=csum) is cache.get("svc1", node)
+
+    @staticmethod
+    def test_only_objects_referencing_changed_node_keywords_are_rebuilt():
+        write_node_config("[node]\nenv = TST\n")
+        write_config("svc1", "[DEFAULT]\nid = a\ncomment = {node.env}\n")
+        write_config("svc2", "[DEFAULT]\nid = b\n")
+        cache = ObjectCache()
+        node = Node()
+        svc1 = cache.get("svc1", node)
+        svc2 = cache.get("svc2", node)
+        write_node_config("[node]\nenv = PRD\n")
+        node = Node()
+        assert cache.outdated("svc1", node)
+        assert not cache.outdated("svc2", node)
+        assert cache.get("svc1", node) is not svc1
+        assert cache.get("svc2", node) is svc2
+        assert svc2.node is node
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from daemon.profiler import PhaseProfiler, ProfiledRLock, RollingStats, SamplingProfiler
+
+
+@pytest.mark.ci
+class TestRollingStats:
+    @staticmethod
+    def test_percentiles_of_the_last_samples():
+        stats = RollingStats(size=100)
+        for val in range(200):
+            stats.add(float(val))
+        summary = stats.summary()
+        assert summary["count"] == 200
+        assert summary["p50"] == 150.0
+        assert summary["p99"] == 198.0
+        assert summary["max"] == 199.0
+
+    @staticmethod
+    def test_empty_summary():
+        assert RollingStats().summary()["p90"] == 0.0
+
+
+@pytest.mark.ci
+class TestPhaseProfiler:
+    @staticmethod
+    def test_phases_are_timed():
+        profiler = PhaseProfiler()
+        with profiler.phase("a"):
+            time.sleep(0.01)
+        with pytest.raises(ValueError):
+            with profiler.phase("b"):
+                raise ValueError
+        summary = profiler.summary()
+        assert summary["a"]["max"] >= 0.01
+        assert summary["b"]["count"] == 1
+
+
+@pytest.mark.ci
+class TestProfiledRLock:
+    @staticmethod
+    def test_outermost_acquire_is_measured():
+        lock = ProfiledRLock()
+        with lock:
+            with lock:
+                time.sleep(0.01)
+        summary = lock.summary()
+        assert summary["wait"]["count"] == 1
+        assert summary["hold"]["count"] == 1
+        assert summary["hold"]["max"] >= 0.01
+
+    @staticmethod
+    def test_wait_time_is_measured():
+        lock = ProfiledRLock()
+        lock.acquire()
+        thr = threading.Thread(target=lambda: lock.acquire() and lock.release())
+        thr.start()
+        time.sleep(0.05)
+        lock.release()
+        thr.join()
+        assert lock.summary()["wait"]["max"] >= 0.04
+
+    @staticmethod
+    def test_non_blocking_acquire_failure_is_not_measured():
+        lock = ProfiledRLock()
+        lock.acquire()
+        result = []
+        thr = threading.Thread(target=lambda: result.append(lock.acquire(False)))
+        thr.start()
+        thr.join()
+        lock.release()
+        assert result == [False]
+        assert lock.summary()["hold"]["count"] == 1
+
+
+@pytest.mark.ci
+class TestSamplingProfiler:
+    @staticmethod
+    def test_enabled_threads_are_sampled():
+        stop = threading.Event()
+
+        def busy_function():
+            while not stop.is_set():
+                sum(range(1000))
+
+        thr = threading.Thread(target=busy_function)
+        thr.start()
+        sampler = SamplingProfiler(interval=0.001)
+        try:
+            sampler.enable("busy", thr.ident)
+            time.sleep(0.1)
+            report = sampler.report("busy")
+            assert report["samples"] > 0
+            assert any("busy_function" in entry["function"] for entry in report["total"])
+        finally:
+            sampler.disable("busy")
+            stop.set()
+            thr.join()
+        assert sampler.report("busy") is None
@@ -118,3 +118,34 @@ class TestSplitHandlerWhenQuorumKwIsTrue:
                             return_value=["arb" + str(i) for i in range(0, arbitrator_votes)])
         thr.split_handler()
         assert suicide.call_count == split_action_count
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestSharedWarmSnapshot:
+    @staticmethod
+    def test_peer_datasets_are_reloaded(mocker):
+        mocker.patch.object(shared, "CLUSTER_DATA", {
+            Env.nodename: {"monitor": {}},
+            "node2": {"monitor": {"status": "idle"}},
+            "node3": {"monitor": {"status": "idle"}},
+        })
+        mocker.patch.object(shared, "REMOTE_GEN", {"node2": 5, "node3": 0})
+        mocker.patch.object(shared, "WARM_DATA", {})
+        assert shared.save_warm_snapshot() == 1
+        assert shared.load_warm_snapshot([Env.nodename, "node2"]) == 1
+        assert shared.WARM_DATA["node2"]["data"] == {"monitor": {"status": "idle"}}
+        assert shared.OsvcThread.get_gen()["node2"] == 5
+        assert not os.path.exists(Env.paths.daemon_warm_snapshot)
+        assert shared.pop_warm_data("node2")["gen"] == 5
+        assert shared.pop_warm_data("node2") is None
+
+    @staticmethod
+    def test_old_snapshot_is_ignored(mocker):
+        mocker.patch.object(shared, "CLUSTER_DATA", {"node2": {}})
+        mocker.patch.object(shared, "REMOTE_GEN", {"node2": 5})
+        mocker.patch.object(shared, "WARM_DATA", {})
+        mocker.patch.object(shared, "WARM_SNAPSHOT_MAX_AGE", -1)
+        shared.save_warm_snapshot()
+        assert shared.load_warm_snapshot([Env.nodename, "node2"]) == 0
+        assert shared.WARM_DATA == {}
@@ -0,0 +1,55 @@
+import copy
+import json
+
+import foreign.json_delta as json_delta
+import pytest
+
+from daemon.snapshot import FrozenDict, FrozenError, diff, freeze, update
+
+
+@pytest.mark.ci
+class TestSnapshot:
+    @staticmethod
+    def test_freeze_refuses_modifications():
+        data = freeze({"a": {"b": [1, 2]}})
+        with pytest.raises(FrozenError):
+            data["a"]["c"] = 1
+        with pytest.raises(FrozenError):
+            data["a"]["b"].append(3)
+        assert json.loads(json.dumps(data)) == {"a": {"b": [1, 2]}}
+        assert copy.deepcopy(data) is data
+
+    @staticmethod
+    def test_freeze_reuses_unchanged_subtrees():
+        previous = freeze({"a": {"x": 1}, "b": {"y": [1, 2]}})
+        current = freeze({"a": {"x": 2}, "b": {"y": [1, 2]}}, previous)
+        assert current is not previous
+        assert current["b"] is previous["b"]
+        assert freeze({"a": {"x": 2}, "b": {"y": [1, 2]}}, current) is current
+
+    @staticmethod
+    def test_update_refreshes_only_paths():
+        data = {"n1": {"services": {"s1": {"avail": "up"}, "s2": {"avail": "up"}}, "gen": 1}}
+        snap = freeze(data)
+        data["n1"]["services"]["s1"]["avail"] = "down"
+        data["n1"]["gen"] = 2
+        del data["n1"]["services"]["s2"]
+        new = update(snap, data, [["n1", "services", "s1"], ["n1", "services", "s2"], ["n1", "gen"]])
+        assert new == data
+        assert isinstance(new["n1"]["services"], FrozenDict)
+        assert snap["n1"]["services"]["s1"]["avail"] == "up"
+        assert update(new, data, [["n1", "services", "s1"]]) is new
+
+    @staticmethod
+    def test_update_drops_removed_keys():
+        snap = freeze({"n1": {}, "n2": {}})
+        assert update(snap, {"n1": {}}, [["n2"]]) == {"n1": {}}
+
+    @staticmethod
+    def test_diff_is_a_json_delta_patch():
+        old = freeze({"a": {"x": 1, "y": [1]}, "b": {"z": 1}, "c": 1})
+        new = freeze({"a": {"x": 2, "y": [1]}, "b": {"z": 1}, "d": 1}, old)
+        changes = diff(old, new)
+        assert sorted(changes) == sorted([[["a", "x"], 2], [["d"], 1], [["c"]]])
+        target = json.loads(json.dumps(old))
+        assert json_delta.patch(target, changes) == new
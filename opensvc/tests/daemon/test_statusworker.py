@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+from subprocess import Popen, PIPE
+
+import pytest
+
+from daemon.statusworker import StatusWorkers, eval_status
+from env import Env
+
+ECHO_WORKER = """
+import json, sys
+for line in iter(sys.stdin.readline, ""):
+    sys.stdout.write(json.dumps({"path": json.loads(line)["path"], "status": 0}) + "\\n")
+    sys.stdout.flush()
+"""
+
+
+@pytest.fixture(scope='function')
+def workers(mocker):
+    done = threading.Event()
+    pool = StatusWorkers(size=1, queue_size=4, on_done=done.set)
+    spawn = mocker.patch.object(pool, 'spawn', side_effect=lambda: Popen(
+        [sys.executable, "-c", ECHO_WORKER], stdin=PIPE, stdout=PIPE))
+    pool.done = done
+    pool.spawned = spawn
+    yield pool
+    pool.stop()
+
+
+def wait_completed(pool, count):
+    done = []
+    for _ in range(50):
+        pool.done.wait(0.1)
+        pool.done.clear()
+        done += pool.completed()
+        if len(done) >= count:
+            break
+    return done
+
+
+@pytest.mark.ci
+class TestStatusWorkers:
+    @staticmethod
+    def test_refresh_is_executed_by_a_long_lived_worker(workers):
+        assert workers.refresh("svc1")
+        assert wait_completed(workers, 1) == [(set(["svc1"]), {"path": "svc1", "status": 0}, None)]
+        assert workers.refresh("svc2")
+        assert wait_completed(workers, 1)[0][1]["path"] == "svc2"
+        assert workers.spawned.call_count == 1
+
+    @staticmethod
+    def test_refreshes_are_coalesced(workers):
+        release = threading.Event()
+        workers.submit(["block"], release.wait, 5)
+        assert workers.refresh("svc1")
+        assert workers.refresh("svc1")
+        assert workers.status()["pending"] == 2
+        release.set()
+        done = wait_completed(workers, 2)
+        assert sorted([list(keys)[0] for keys, _, _ in done]) == ["block", "svc1"]
+
+    @staticmethod
+    def test_full_queue_refuses_refresh(workers):
+        release = threading.Event()
+        workers.submit(["block"], release.wait, 5)
+        for _ in range(100):
+            if workers.is_active("block"):
+                break
+            release.wait(0.01)
+        for idx in range(4):
+            assert workers.refresh("svc%d" % idx)
+        assert not workers.refresh("svc5")
+        release.set()
+
+    @staticmethod
+    def test_refresh_of_a_deleted_object_is_dropped(workers):
+        workers.exists = lambda path: path != "deleted"
+        assert workers.refresh("deleted")
+        assert wait_completed(workers, 1)[0][1] == {"path": "deleted", "status": 1, "error": "not found"}
+        assert workers.spawned.call_count == 0
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures("osvc_path_tests")
+class TestEvalStatus:
+    @staticmethod
+    def test_missing_object_is_not_created(mocker):
+        factory = mocker.patch("utilities.naming.factory")
+        assert eval_status(None, "foo") == {"path": "foo", "status": 1, "error": "not found"}
+        assert factory.call_count == 0
+        assert not os.path.exists(os.path.join(Env.paths.pathetc, "foo.conf"))
@@ -0,0 +1,141 @@
+import errno
+import os
+import time
+
+import pytest
+
+import daemon.shared as shared
+from daemon.watcher import Inotify, Watcher, config_path, status_path
+from env import Env
+
+
+@pytest.fixture(scope='function')
+def watcher(mocker):
+    thr = Watcher()
+    thr.log = mocker.MagicMock()
+    thr.inotify = None
+    thr.mtimes = {}
+    thr.node_frozen = None
+    thr.last_poll = 0
+    thr.watch_failed = False
+    thr.read_timeout = 0.1
+    return thr
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestWatcherPaths:
+    @staticmethod
+    @pytest.mark.parametrize('relpath, expected', [
+        ('svc1.conf', 'svc1'),
+        ('cluster.conf', 'cluster'),
+        ('node.conf', None),
+        ('vol/vol1.conf', 'vol/vol1'),
+        ('namespaces/ns1/svc/svc1.conf', 'ns1/svc/svc1'),
+        ('namespaces/ns1/namespace.conf', 'ns1/'),
+        ('svc1.conf.tmp', None),
+    ])
+    def test_config_path(relpath, expected):
+        assert config_path(os.path.join(Env.paths.pathetc, relpath)) == expected
+
+    @staticmethod
+    @pytest.mark.parametrize('relpath, expected', [
+        ('svc/svc1/status.json', 'svc1'),
+        ('svc/svc1/frozen', 'svc1'),
+        ('vol/vol1/status.json', 'vol/vol1'),
+        ('namespaces/ns1/svc/svc1/status.json', 'ns1/svc/svc1'),
+        ('svc/svc1/status.json.abc', None),
+        ('lsnr/status.json', None),
+    ])
+    def test_status_path(relpath, expected):
+        assert status_path(os.path.join(Env.paths.pathvar, relpath)) == expected
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('osvc_path_tests')
+class TestWatcher:
+    @staticmethod
+    def test_dirty_paths_ask_for_full_rescan_until_tracked():
+        shared.CONFIG_DIRTY.track(False)
+        shared.CONFIG_DIRTY.add('svc1')
+        assert shared.CONFIG_DIRTY.pop() is None
+        shared.CONFIG_DIRTY.track()
+        assert shared.CONFIG_DIRTY.pop() is None
+        shared.CONFIG_DIRTY.add('svc1')
+        assert shared.CONFIG_DIRTY.pop() == set(['svc1'])
+        assert shared.CONFIG_DIRTY.pop() == set()
+        shared.CONFIG_DIRTY.track(False)
+
+    @staticmethod
+    def test_poll_marks_changed_objects(watcher):
+        os.makedirs(Env.paths.pathetc)
+        cf = os.path.join(Env.paths.pathetc, 'svc1.conf')
+        with open(cf, 'w') as ofile:
+            ofile.write('[DEFAULT]\n')
+        shared.CONFIG_DIRTY.track()
+        shared.CONFIG_DIRTY.pop()
+        watcher.poll(track=False)
+        os.utime(cf, (time.time() + 10, time.time() + 10))
+        watcher.poll()
+        assert shared.CONFIG_DIRTY.pop() == set(['svc1'])
+        os.unlink(cf)
+        watcher.poll()
+        assert shared.CONFIG_DIRTY.pop() == set(['svc1'])
+        shared.CONFIG_DIRTY.track(False)
+
+    @staticmethod
+    @pytest.mark.skipif(Env.sysname != 'Linux', reason='inotify is linux only')
+    def test_inotify_marks_changed_objects(watcher):
+        os.makedirs(os.path.join(Env.paths.pathvar, 'svc', 'svc1'))
+        watcher.inotify = Inotify()
+        try:
+            watcher.add_watches(Env.paths.pathvar)
+            shared.STATUS_DIRTY.track()
+            shared.STATUS_DIRTY.pop()
+            with open(os.path.join(Env.paths.pathvar, 'svc', 'svc1', 'frozen'), 'w'):
+                pass
+            os.makedirs(os.path.join(Env.paths.pathvar, 'namespaces', 'ns1', 'svc', 'svc2'))
+            with open(os.path.join(Env.paths.pathvar, 'namespaces', 'ns1', 'svc', 'svc2', 'status.json'), 'w'):
+                pass
+            for _ in range(5):
+                watcher.watch()
+            assert shared.STATUS_DIRTY.pop() == set(['svc1', 'ns1/svc/svc2'])
+        finally:
+            watcher.inotify.close()
+            shared.STATUS_DIRTY.track(False)
+
+    @staticmethod
+    def test_poll_mode_scans_at_the_poll_interval(mocker, watcher):
+        mocker.patch.object(Watcher, 'watcher_poll_interval', 10)
+        poll = mocker.patch.object(watcher, 'poll')
+        watcher.do()
+        assert poll.call_count == 1
+        watcher.last_poll = time.time()
+        watcher.do()
+        assert poll.call_count == 1
+
+    @staticmethod
+    def test_add_watches_error_asks_for_a_full_rescan(mocker, watcher):
+        os.makedirs(os.path.join(Env.paths.pathvar, 'svc', 'svc1'))
+        watcher.inotify = mocker.MagicMock()
+        watcher.inotify.add_watch.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+        shared.CONFIG_DIRTY.track()
+        shared.STATUS_DIRTY.track()
+        shared.CONFIG_DIRTY.pop()
+        shared.STATUS_DIRTY.pop()
+        try:
+            assert watcher.add_watches(os.path.join(Env.paths.pathvar, 'svc'), scan=True) == 1
+            assert watcher.add_watches(os.path.join(Env.paths.pathvar, 'svc', 'svc1'), scan=True) == 1
+            assert watcher.log.warning.call_count == 1
+            assert shared.CONFIG_DIRTY.pop() is None
+            assert shared.STATUS_DIRTY.pop() is None
+        finally:
+            shared.CONFIG_DIRTY.track(False)
+            shared.STATUS_DIRTY.track(False)
+
+    @staticmethod
+    def test_add_watches_error_at_setup_is_raised(mocker, watcher):
+        watcher.inotify = mocker.MagicMock()
+        watcher.inotify.add_watch.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+        with pytest.raises(OSError):
+            watcher.add_watches(Env.paths.pathvar)
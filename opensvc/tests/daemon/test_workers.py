@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from daemon.workers import WorkerPool
+
+
+@pytest.mark.ci
+class TestWorkerPool:
+    @staticmethod
+    def test_jobs_complete_and_release_their_keys():
+        done = threading.Event()
+        pool = WorkerPool("test", size=2, on_done=done.set)
+        try:
+            assert pool.submit(["a", "b"], lambda x: x * 2, 21)
+            assert done.wait(5)
+            assert pool.completed() == [(set(["a", "b"]), 42, None)]
+            assert not pool.is_pending("a")
+        finally:
+            pool.stop()
+
+    @staticmethod
+    def test_pending_keys_and_full_queue_are_refused():
+        release = threading.Event()
+        pool = WorkerPool("test", size=1, queue_size=1)
+        try:
+            assert pool.submit(["a"], release.wait, 5)
+            assert not pool.submit(["a"], release.wait, 5)
+            assert pool.is_pending("a")
+            for _ in range(100):
+                if pool.status()["running"]:
+                    break
+                release.wait(0.01)
+            assert pool.submit(["b"], release.wait, 5)
+            assert not pool.submit(["c"], release.wait, 5)
+        finally:
+            release.set()
+            pool.stop()
+
+    @staticmethod
+    def test_job_errors_are_reported():
+        done = threading.Event()
+        pool = WorkerPool("test", size=1, on_done=done.set)
+
+        def fail():
+            raise ValueError("bad")
+        try:
+            pool.submit(["a"], fail)
+            assert done.wait(5)
+            (keys, result, error), = pool.completed()
+            assert isinstance(error, ValueError)
+        finally:
+            pool.stop()
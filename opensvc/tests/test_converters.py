@@ -202,6 +202,9 @@ class TestConverters:
         assert convert_duration("1h1s") == 3601
         assert convert_duration("1h 1s") == 3601
         assert convert_duration("1h 1s", _to="m") == 60
+        assert convert_duration("200ms") == 0.2
+        assert convert_duration("1s500ms") == 1.5
+        assert convert_duration("1m500ms") == 60.5
         assert convert_duration(None, _to="m") is None
         assert convert_duration("", _to="m") == 0
         try:
@@ -208,6 +208,7 @@ def convert_duration(s, _to="s", _from="s"):
       h: hour
       m: minute
       s: second
+      ms: millisecond
     Example:
       1w => 604800
       1d => 86400
@@ -215,6 +216,7 @@ def convert_duration(s, _to="s", _from="s"):
       1h1m => 3660
       1h2s => 3602
       1 => 1
+      200ms => 0.2
     """
     if s is None:
         return
@@ -241,17 +243,29 @@ def convert_duration(s, _to="s", _from="s"):
     s = s.lower()
     duration = 0
     prev = 0
-    for idx, unit in enumerate(s):
-        if unit not in units:
+    idx = 0
+    while idx < len(s):
+        unit = s[idx]
+        if s[idx:idx+2] == "ms":
+            unit = "ms"
+        elif unit not in units:
+            idx += 1
             continue
         _duration = s[prev:idx]
         try:
             _duration = int(_duration)
         except ValueError:
             raise ValueError("convert duration error: invalid format %s at index %d" % (s, idx))
-        duration += _duration * units[unit]
-        prev = idx + 1
+        if unit == "ms":
+            duration += _duration / 1000.0
+        else:
+            duration += _duration * units[unit]
+        idx += len(unit)
+        prev = idx
 
+    if _to == "s":
+        # keep the sub-second part of millisecond durations
+        return duration
     return duration // units[_to]
 
 
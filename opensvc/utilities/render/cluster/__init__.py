@@ -210,6 +210,26 @@ def fmt_cpu_time(get, stats_data):
     except Exception:
         return ""
 
+def fmt_profile(get, _data, scale=1000):
+    """
+    Format the p50/p99 of a rolling percentiles summary, in milliseconds
+    for the default <scale>.
+    """
+    try:
+        summary = get(_data)
+        return "%d/%d" % (summary["p50"] * scale, summary["p99"] * scale)
+    except (KeyError, TypeError):
+        return ""
+
+def fmt_crypto(_data):
+    """
+    Format the daemon communications encryption backend.
+    """
+    try:
+        return "aes: %s" % _data["backend"]
+    except (KeyError, TypeError):
+        return ""
+
 def fmt_tid(_data, stats_data):
     if not stats_data:
         return ""
@@ -594,7 +614,7 @@ def format_cluster(paths=None, node=None, data=None, prev_stats_data=None,
             fmt_thr_cpu_usage(key, prev_stats_data, stats_data),
             fmt_thr_cpu_time(key, stats_data),
             fmt_thr_mem_total(key, stats_data),
-            "",
+            fmt_crypto(data.get("crypto")),
             "",
             "",
             "",
@@ -863,6 +883,88 @@ def format_cluster(paths=None, node=None, data=None, prev_stats_data=None,
         if len(set(versions)) > 1:
             out.append(line)
 
+    def load_profile():
+        if "threads" not in sections or not stats_data or not nodenames:
+            return
+        phases = set()
+        locks = set()
+        for _data in stats_data.values():
+            try:
+                phases |= set(_data["monitor"]["phases"])
+            except (KeyError, TypeError):
+                pass
+            try:
+                locks |= set(_data["locks"])
+            except (KeyError, TypeError):
+                pass
+        if not phases and not locks:
+            return
+        load_header("Monitor Profile (p50/p99 ms)")
+
+        def load_profile_line(title, get):
+            line = [
+                colorize(" "+title, color.BOLD),
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "|",
+            ]
+            for nodename in nodenames:
+                line.append(fmt_profile(get, stats_data.get(nodename)))
+            out.append(line)
+
+        for phase in sorted(phases):
+            load_profile_line(phase, lambda x: x["monitor"]["phases"][phase])
+        for lock in sorted(locks):
+            for key in ("wait", "hold"):
+                load_profile_line("%s lock %s" % (lock, key), lambda x: x["locks"][lock][key])
+        out.append([])
+
+    def load_hb_metrics():
+        if "threads" not in sections or not nodenames:
+            return
+        hbs = sorted([key for key in data if key.startswith("hb#") and
+                      any("metrics" in peer for peer in data[key].get("peers", {}).values())])
+        if not hbs:
+            return
+        load_header("Heartbeat Metrics (p50/p99 bytes or ms)")
+
+        def load_metric_line(title, peers, fmt):
+            line = [
+                colorize(" "+title, color.BOLD),
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "",
+                "|",
+            ]
+            for nodename in nodenames:
+                line.append(fmt(peers.get(nodename, {}).get("metrics")))
+            out.append(line)
+
+        for key in hbs:
+            peers = data[key].get("peers", {})
+            load_metric_line("%s size" % key, peers, lambda x: fmt_profile(lambda y: y["size"], x, scale=1))
+            for metric in ("latency", "decrypt", "patch"):
+                load_metric_line("%s %s" % (key, metric), peers, lambda x: fmt_profile(lambda y: y[metric], x))
+            load_metric_line("%s resyncs" % key, peers, lambda x: str(x["resyncs"]) if x else "")
+        out.append([])
+
     def load_arbitrators():
         if "arbitrators" not in sections:
             return
@@ -1048,6 +1150,8 @@ def format_cluster(paths=None, node=None, data=None, prev_stats_data=None,
 
     # load data in lists
     load_threads()
+    load_profile()
+    load_hb_metrics()
     load_arbitrators()
     load_nodes()
     load_services(selector, namespace)